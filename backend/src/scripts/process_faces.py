@@ -1,14 +1,243 @@
-
 import os
+import json
+import time
+import hashlib
 import argparse
+import importlib.util
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO
 from pathlib import Path
 from PIL import Image
 
-def process_folder(input_dir, output_dir=None, bg_color=(128, 128, 128)):
-    try:
-        from rembg import remove
-    except ImportError as e:
-        print(f"Error importing rembg: {e}")
+# Extensions that claim to be images; the format itself is sniffed from the content
+EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+SNIFF_BYTES = 12
+
+# Written to the output directory; records what each output was made from
+MANIFEST_NAME = ".manifest.json"
+MANIFEST_SAVE_EVERY = 25  # completed images between manifest writes
+
+# Per-process rembg session, created once by _init_worker
+_session = None
+
+
+def _init_worker(model_name, threads):
+    """Process pool initializer: load the rembg model once per worker process."""
+    global _session
+    # rembg sizes its ONNX Runtime thread pools from OMP_NUM_THREADS; split the
+    # cores between workers instead of every worker using all of them
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    from rembg import new_session
+    _session = new_session(model_name)
+
+
+def _process_image(source, destination, bg_color, image_format):
+    """Remove the background from one image and composite it on bg_color. Runs in a worker."""
+    from rembg import remove
+
+    with open(source, 'rb') as f:
+        # The format was sniffed while walking; don't let PIL guess from the name
+        image = Image.open(BytesIO(f.read()), formats=[image_format])
+        image.load()
+
+    # Passing a PIL image keeps rembg from encoding and re-decoding PNG bytes
+    foreground = remove(image.convert("RGB"), session=_session)
+
+    final_image = Image.new("RGB", foreground.size, bg_color)
+    final_image.paste(foreground, mask=foreground.getchannel("A"))
+
+    # PNG is safer for face references, and compresses well on a solid background
+    Path(destination).parent.mkdir(parents=True, exist_ok=True)
+    final_image.save(destination, format="PNG")
+    return destination
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Source content hash, parameters and output file for every processed image,
+    keyed by source path relative to the input directory.
+
+    An image is skipped when its hash and parameters match its entry and the
+    output still exists. Size and mtime are kept too, so unchanged files
+    aren't re-read just to be hashed. The file is rewritten atomically every
+    MANIFEST_SAVE_EVERY images, so an interrupted run resumes where it stopped.
+
+    Outputs are named {stem}_clean.png next to where the source sits. When
+    two sources in one folder share a stem (a.jpg and a.png), the first to
+    claim the name keeps it and later ones get {name}_clean.png
+    (a.png_clean.png); the name each source got is recorded here, so it
+    stays stable between runs. An entry whose output isn't the name it
+    would get now, or that shares its output with another entry, counts as
+    changed and is redone. Outputs are reference-counted, so an output file
+    is only deleted once no entry points at it.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        if self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text()).get("entries", {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {self.path}: {e}")
+        self.owners = Counter(entry["output"] for entry in self.entries.values())
+        # Output name -> the source key it belongs to
+        self.claims = {}
+        for key in sorted(self.entries):
+            self.claims.setdefault(self.entries[key]["output"], key)
+
+    def output_name(self, key):
+        """
+        Output for a source key: {stem}_clean.png in the source's folder, or
+        {name}_clean.png if another source already claimed that name.
+        """
+        path = Path(key)
+        candidates = [f"{path.stem}_clean.png", f"{path.name}_clean.png"]
+        candidates += [f"{path.name}_{n}_clean.png" for n in range(2, len(self.claims) + 3)]
+        for candidate in candidates:
+            name = path.with_name(candidate).as_posix()
+            if self.claims.setdefault(name, key) == key:
+                return name
+
+    def check(self, key, source, params, output_path, output):
+        """Return (status, digest, stat): status is 'unchanged', 'changed' or 'new'."""
+        stat = source.stat()
+        entry = self.entries.get(key)
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            digest = entry["hash"]
+        else:
+            digest = _file_hash(source)
+        if entry is None:
+            return "new", digest, stat
+        if (entry["hash"] == digest and entry.get("params") == params and entry["output"] == output
+                and self.owners[output] == 1 and (output_path / output).exists()):
+            # Touched but identical: refresh the stat so the next run doesn't re-hash
+            entry["size"], entry["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+            return "unchanged", digest, stat
+        return "changed", digest, stat
+
+    def record(self, key, digest, stat, params, output):
+        """Record a processed image; returns its previous output if nothing references it any more."""
+        previous = self._release(key)
+        self.owners[output] += 1
+        self.claims[output] = key
+        self.entries[key] = {
+            "hash": digest,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "params": params,
+            "output": output,
+        }
+        return previous if previous != output and not self.owners[previous] else None
+
+    def remove(self, key):
+        """Forget a deleted source; returns its output if no other entry still references it."""
+        output = self._release(key)
+        return output if not self.owners[output] else None
+
+    def _release(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        output = entry["output"]
+        self.owners[output] -= 1
+        if self.claims.get(output) == key:
+            del self.claims[output]
+        return output
+
+    def save(self):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"version": 1, "entries": self.entries}, indent=1, sort_keys=True))
+        os.replace(tmp, self.path)
+
+
+def sniff_format(path):
+    """PIL format name from the file's magic bytes, or None if it isn't a supported image."""
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    if head.startswith(b'\xff\xd8\xff'):
+        return "JPEG"
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return "PNG"
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return "WEBP"
+    return None
+
+
+def iter_images(input_path, exclude=(), errors=None):
+    """
+    Yield (path, format) for every image under input_path, recursively, as
+    directories are read, so processing starts before the walk finishes.
+
+    Every regular file is sniffed, so mislabeled and extensionless images are
+    found too; files that claim an image extension but aren't images are
+    reported. Hidden entries, symlinked directories and `exclude`d
+    directories (e.g. an output folder inside the input) are skipped.
+
+    Directories and files that can't be read are reported and appended to
+    `errors`, so callers know the walk didn't see what's under them.
+    """
+    exclude = {os.path.realpath(path) for path in exclude}
+    stack = [str(input_path)]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                subdirectories = []
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if os.path.realpath(entry.path) not in exclude:
+                            subdirectories.append(entry.path)
+                    elif entry.is_file():
+                        try:
+                            image_format = sniff_format(entry.path)
+                        except OSError as e:
+                            print(f"Skipping {entry.path}: {e}")
+                            if errors is not None:
+                                errors.append(Path(entry.path))
+                            continue
+                        if image_format:
+                            yield Path(entry.path), image_format
+                        elif Path(entry.name).suffix.lower() in EXTENSIONS:
+                            print(f"Skipping {entry.path}: not a JPEG, PNG or WebP image")
+        except OSError as e:
+            print(f"Skipping {directory}: {e}")
+            if errors is not None:
+                errors.append(Path(directory))
+            continue
+        # Depth-first, in name order within each directory
+        stack.extend(sorted(subdirectories, reverse=True))
+
+
+def process_folder(input_dir, output_dir=None, bg_color=(128, 128, 128), workers=None,
+                   model_name="u2net", max_in_flight=None, dry_run=False):
+    """
+    Remove backgrounds from every image under input_dir and put them on a
+    neutral background, in parallel. Subdirectories are mirrored in the
+    output directory.
+
+    Each worker process holds one rembg session for the whole run. At most
+    max_in_flight images (default: 2 per worker) are queued at once, so memory
+    stays flat however many files the folder has.
+
+    Runs are incremental: images whose content and parameters match the
+    manifest in the output directory are skipped, and outputs whose source
+    was deleted are removed. Nothing under a folder or file the walk couldn't
+    read is removed. With dry_run, only report what would be done.
+    """
+    if not dry_run and importlib.util.find_spec("rembg") is None:
+        print("Error: rembg is not installed (pip install rembg)")
         return
 
     input_path = Path(input_dir)
@@ -21,51 +250,115 @@ def process_folder(input_dir, output_dir=None, bg_color=(128, 128, 128)):
         output_path = Path(output_dir)
     else:
         output_path = input_path / "Processed_Neutral"
-    
-    output_path.mkdir(parents=True, exist_ok=True)
+
+    if not dry_run:
+        output_path.mkdir(parents=True, exist_ok=True)
     print(f"Output directory: {output_path}")
 
-    # Supported extensions
-    extensions = {'.jpg', '.jpeg', '.png', '.webp'}
-    files = [f for f in input_path.iterdir() if f.suffix.lower() in extensions]
+    manifest = Manifest(output_path / MANIFEST_NAME)
+    params = {"bg_color": list(bg_color), "model": model_name}
+    seen = set()
+    unreadable = []
+    counts = {"unchanged": 0, "changed": 0, "new": 0}
 
-    print(f"Found {len(files)} images. Starting processing...")
+    def plan():
+        """Yield (key, source, format, output, digest, stat) for every image that needs processing."""
+        for file_path, image_format in iter_images(input_path, exclude=[output_path], errors=unreadable):
+            key = file_path.relative_to(input_path).as_posix()
+            seen.add(key)
+            # Relative to output_path, mirroring the source's subdirectory
+            output_name = manifest.output_name(key)
+            status, digest, stat = manifest.check(key, file_path, params, output_path, output_name)
+            counts[status] += 1
+            if status != "unchanged":
+                yield key, file_path, image_format, output_name, digest, stat
+
+    def stale_keys():
+        """Manifest keys whose source is gone. Keys under paths the walk couldn't read are kept."""
+        skipped = [path.relative_to(input_path).as_posix() for path in unreadable]
+        return [key for key in manifest.entries if key not in seen
+                and not any(path == "." or key == path or key.startswith(path + "/") for path in skipped)]
+
+    if dry_run:
+        work_bytes = sum(item[-1].st_size for item in plan())
+        stale = stale_keys()
+        print(f"Dry run: {sum(counts.values())} image(s) found")
+        print(f"  unchanged (skip): {counts['unchanged']}")
+        print(f"  new:              {counts['new']}")
+        print(f"  changed:          {counts['changed']}")
+        print(f"  to process:       {counts['new'] + counts['changed']} ({work_bytes / 1024**2:.1f} MB)")
+        print(f"  outputs to prune: {len(stale)}")
+        return {**counts, "to_process": counts["new"] + counts["changed"], "to_prune": len(stale)}
+
+    workers = workers or max(1, (os.cpu_count() or 1) // 2)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    max_in_flight = max_in_flight or workers * 2
+    print(f"Starting processing with {workers} worker(s), {threads} thread(s) each...")
+
+    processed = failed = 0
+    started = time.perf_counter()
+    pending = {}
+
+    def collect(done):
+        nonlocal processed, failed
+        for future in done:
+            key, file_path, digest, stat, output_name = pending.pop(future)
+            try:
+                future.result()
+                orphaned = manifest.record(key, digest, stat, params, output_name)
+                if orphaned:
+                    # Renamed (e.g. a stem collision was resolved), so the old file is stale
+                    (output_path / orphaned).unlink(missing_ok=True)
+                processed += 1
+                elapsed = time.perf_counter() - started
+                print(f"Processed [{processed}]: {file_path.name} ({processed / elapsed:.2f} images/s)")
+                if processed % MANIFEST_SAVE_EVERY == 0:
+                    manifest.save()
+            except Exception as e:
+                failed += 1
+                print(f"Failed to process {file_path.name}: {e}")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(model_name, threads)) as pool:
+            for key, file_path, image_format, output_name, digest, stat in plan():
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = pool.submit(_process_image, str(file_path), str(output_path / output_name),
+                                     bg_color, image_format)
+                pending[future] = (key, file_path, digest, stat, output_name)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        # The walk finished, so anything in the manifest that wasn't seen was deleted
+        pruned = 0
+        for key in stale_keys():
+            output = manifest.remove(key)
+            if output:
+                (output_path / output).unlink(missing_ok=True)
+            pruned += 1
+    finally:
+        manifest.save()
+
+    elapsed = time.perf_counter() - started
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"\nDone! {processed} image(s) processed, {counts['unchanged']} unchanged, {failed} failed, "
+          f"{pruned} pruned in {elapsed:.1f}s ({rate:.2f} images/s).")
+    print(f"Images saved to '{output_path}'.")
+    return {"processed": processed, "skipped": counts["unchanged"], "failed": failed, "pruned": pruned,
+            "seconds": round(elapsed, 2), "images_per_second": round(rate, 2)}
 
-    for i, file_path in enumerate(files):
-        try:
-            print(f"Processing [{i+1}/{len(files)}]: {file_path.name}")
-            
-            # Load and remove background
-            with open(file_path, 'rb') as f:
-                input_bytes = f.read()
-                output_bytes = remove(input_bytes)
-            
-            # Convert bytes back to PIL Image
-            from io import BytesIO
-            foreground = Image.open(BytesIO(output_bytes)).convert("RGBA")
-            
-            # Create neutral background
-            background = Image.new("RGBA", foreground.size, bg_color + (255,))
-            
-            # Composite
-            final_image = Image.alpha_composite(background, foreground)
-            
-            # Save as PNG (to preserve quality, though background is solid) OR JPG
-            # User wants "face reference photos". JPG is usually fine if background is solid.
-            # But PNG is safer for references.
-            save_name = f"{file_path.stem}_clean.png"
-            final_image.save(output_path / save_name)
-
-        except Exception as e:
-            print(f"Failed to process {file_path.name}: {e}")
-
-    print("\nDone! Images saved to 'Processed_Neutral' folder.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Batch remove background and add neutral background.")
-    parser.add_argument("--input", "-i", type=str, required=True, help="Input directory containing images")
+    parser.add_argument("--input", "-i", type=str, required=True, help="Input directory containing images (searched recursively)")
     parser.add_argument("--output", "-o", type=str, help="Output directory (optional)")
-    
+    parser.add_argument("--workers", "-w", type=int, help="Worker processes (default: half the CPU cores)")
+    parser.add_argument("--model", type=str, default="u2net", help="rembg model name (default: u2net)")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be processed or pruned, then exit")
+
     args = parser.parse_args()
-    
-    process_folder(args.input, args.output)
+
+    process_folder(args.input, args.output, workers=args.workers, model_name=args.model, dry_run=args.dry_run)
@@ -0,0 +1,159 @@
+import os
+import json
+
+import pytest
+from PIL import Image
+
+import process_faces
+from process_faces import MANIFEST_NAME, process_folder
+
+FAKE_REMBG = '''
+def new_session(name):
+    return None
+
+
+def remove(image, session=None):
+    return image.convert("RGBA")
+'''
+
+
+@pytest.fixture(autouse=True)
+def fake_rembg(tmp_path_factory, monkeypatch):
+    """A stand-in rembg that keeps the whole image as foreground."""
+    path = tmp_path_factory.mktemp("fake_rembg")
+    (path / "rembg.py").write_text(FAKE_REMBG)
+    monkeypatch.syspath_prepend(str(path))
+
+
+@pytest.fixture
+def folders(tmp_path):
+    source, output = tmp_path / "faces", tmp_path / "out"
+    source.mkdir()
+    return source, output
+
+
+def save(path, color="red", format=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (8, 8), color).save(path, format=format)
+
+
+def run(source, output):
+    return process_folder(str(source), str(output), workers=1)
+
+
+def outputs(output):
+    return sorted(p.relative_to(output).as_posix() for p in output.rglob("*.png"))
+
+
+def manifest(output):
+    return json.loads((output / MANIFEST_NAME).read_text())["entries"]
+
+
+def test_outputs_keep_the_stem_name_and_unchanged_images_are_skipped(folders):
+    source, output = folders
+    save(source / "a.jpg")
+    save(source / "team" / "b.png")
+
+    assert run(source, output)["processed"] == 2
+    assert outputs(output) == ["a_clean.png", "team/b_clean.png"]
+
+    second = run(source, output)
+    assert (second["processed"], second["skipped"]) == (0, 2)
+
+
+def test_changed_content_or_params_is_reprocessed(folders):
+    source, output = folders
+    save(source / "a.png")
+    run(source, output)
+
+    save(source / "a.png", color="blue")
+    assert run(source, output)["processed"] == 1
+    assert process_folder(str(source), str(output), workers=1, bg_color=(0, 0, 0))["processed"] == 1
+
+
+def test_stem_collisions_get_distinct_outputs_that_stay_stable(folders):
+    source, output = folders
+    save(source / "a.jpg", format="JPEG")
+    save(source / "a.png")
+
+    assert run(source, output)["processed"] == 2
+    names = {key: entry["output"] for key, entry in manifest(output).items()}
+    holder = next(key for key, name in names.items() if name == "a_clean.png")
+    other = ({"a.jpg", "a.png"} - {holder}).pop()
+    assert names[other] == f"{other}_clean.png"
+    assert outputs(output) == sorted(names.values())
+    assert run(source, output)["skipped"] == 2
+
+
+def test_deleted_sources_are_pruned_without_touching_shared_names(folders):
+    source, output = folders
+    save(source / "a.jpg", format="JPEG")
+    save(source / "a.png")
+    save(source / "b.png")
+    run(source, output)
+    names = {key: entry["output"] for key, entry in manifest(output).items()}
+    holder = next(key for key, name in names.items() if name == "a_clean.png")
+    other = "a.png" if holder == "a.jpg" else "a.jpg"
+
+    (source / "b.png").unlink()
+    (source / other).unlink()
+    assert run(source, output)["pruned"] == 2
+
+    assert outputs(output) == ["a_clean.png"]
+    assert list(manifest(output)) == [holder]
+
+
+def test_outputs_named_by_an_older_scheme_are_renamed_and_cleaned_up(folders):
+    source, output = folders
+    save(source / "a.jpg", format="JPEG")
+    run(source, output)
+    # As written by a version that named outputs after the full source name
+    (output / "a_clean.png").rename(output / "a.jpg_clean.png")
+    entries = manifest(output)
+    entries["a.jpg"]["output"] = "a.jpg_clean.png"
+    (output / MANIFEST_NAME).write_text(json.dumps({"version": 1, "entries": entries}))
+
+    assert run(source, output)["processed"] == 1
+    assert outputs(output) == ["a_clean.png"]
+
+
+def test_manifest_output_names():
+    manifest = process_faces.Manifest("/nonexistent/.manifest.json")
+
+    assert manifest.output_name("x/a.jpg") == "x/a_clean.png"
+    assert manifest.output_name("x/a.jpg") == "x/a_clean.png"
+    assert manifest.output_name("x/a.png") == "x/a.png_clean.png"
+    assert manifest.output_name("y/a.png") == "y/a_clean.png"
+    # A file literally named like a disambiguated output
+    assert manifest.output_name("x/a.png.webp") == "x/a.png.webp_clean.png"
+
+
+@pytest.mark.parametrize("unreadable", ["team", "team/b.png", "."])
+def test_nothing_under_an_unreadable_path_is_pruned(folders, monkeypatch, unreadable):
+    source, output = folders
+    save(source / "a.png")
+    save(source / "team" / "b.png")
+    run(source, output)
+    failing = os.path.normpath(source / unreadable)
+    scandir, sniff_format = os.scandir, process_faces.sniff_format
+
+    def flaky_scandir(path):
+        if os.path.normpath(path) == failing:
+            raise PermissionError(13, "Permission denied", path)
+        return scandir(path)
+
+    def flaky_sniff_format(path):
+        if os.path.normpath(path) == failing:
+            raise PermissionError(13, "Permission denied", path)
+        return sniff_format(path)
+
+    monkeypatch.setattr(process_faces.os, "scandir", flaky_scandir)
+    monkeypatch.setattr(process_faces, "sniff_format", flaky_sniff_format)
+    (source / "a.png").unlink()
+
+    assert process_folder(str(source), str(output), dry_run=True)["to_prune"] == (0 if unreadable == "." else 1)
+    run(source, output)
+
+    assert "team/b.png" in manifest(output)
+    assert (output / "team" / "b_clean.png").exists()
+    assert ("a.png" in manifest(output)) == (unreadable == ".")
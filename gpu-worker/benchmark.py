@@ -0,0 +1,844 @@
+"""
+Local benchmarks for the GPU worker.
+
+Each subcommand exercises one subsystem against local stand-ins (no network,
+no GPU required) and prints a small JSON report.
+
+Usage:
+    python benchmark.py fetch [--requests 50] [--size 2048]
+    python benchmark.py upload [--endpoint http://127.0.0.1:9000] [--size-mb 64]
+    python benchmark.py encode [--frames 97] [--width 1280] [--height 720]
+    python benchmark.py scheduler [--jobs 200] [--swap-ms 300] [--run-ms 30]
+    python benchmark.py runpod [--jobs 40] [--concurrency 4]
+    python benchmark.py importtime [--top 15]
+    python benchmark.py lens [--width 3840] [--height 2160] [--repeat 5]
+    python benchmark.py rackfocus [--frames 24,48,96] [--width 1280] [--height 720]
+    python benchmark.py tiling [--sizes 2k,4k,8k] [--ops lens,sharpen,depth]
+    python benchmark.py output [--width 3840] [--height 2160] [--repeat 5]
+"""
+
+import io
+import json
+import time
+import asyncio
+import argparse
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+
+def _latency_summary(samples_ms: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples_ms)
+    return {
+        "mean_ms": round(statistics.mean(ordered), 2),
+        "p50_ms": round(ordered[len(ordered) // 2], 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+    }
+
+
+def _test_jpeg(size: int) -> bytes:
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 255, (size, size, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class _StandInServer:
+    """Keep-alive HTTP/1.1 server on localhost that serves one payload and counts connections."""
+
+    def __init__(self, payload: bytes, content_type: str = "image/jpeg"):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server.lock:
+                    server.connections += 1
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/image.jpg"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.connections = 0
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# ============================================================================
+# fetch: pooled streaming fetch_image vs. a client per call
+# ============================================================================
+
+async def _fetch_per_call(url: str):
+    """The previous fetch_image: new client per call, whole body buffered."""
+    import httpx
+    from PIL import Image
+
+    async with httpx.AsyncClient() as client:
+        response = await client.get(url)
+        response.raise_for_status()
+        return Image.open(io.BytesIO(response.content)).convert("RGB")
+
+
+async def _time_fetches(fetch, url: str, count: int) -> List[float]:
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        await fetch(url)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def bench_fetch(args) -> Dict:
+    from main import fetch_image, close_http_client
+
+    payload = _test_jpeg(args.size)
+    server = _StandInServer(payload)
+    report = {"requests": args.requests, "payload_bytes": len(payload)}
+    try:
+        async def run():
+            results = {}
+            for name, fetch in (("per_call_client", _fetch_per_call), ("pooled_streaming", fetch_image)):
+                await fetch(server.url)  # warm up imports and decoders
+                server.reset()
+                samples = await _time_fetches(fetch, server.url, args.requests)
+                results[name] = {"connections": server.connections, **_latency_summary(samples)}
+            await close_http_client()
+            return results
+
+        report.update(asyncio.run(run()))
+    finally:
+        server.close()
+    return report
+
+
+# ============================================================================
+# upload: shared multipart uploader vs. a boto3 client per put_object
+# ============================================================================
+
+def _s3_stand_in(endpoint: str):
+    """Use the given S3-compatible endpoint, or start moto's server locally."""
+    if endpoint:
+        return endpoint, None
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        raise SystemExit("Pass --endpoint (e.g. a local MinIO) or `pip install moto[server]`")
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    return f"http://{host}:{port}", server
+
+
+def bench_upload(args) -> Dict:
+    import os
+    import boto3
+    from storage import ObjectUploader
+
+    endpoint, server = _s3_stand_in(args.endpoint)
+    credentials = {"aws_access_key_id": args.access_key, "aws_secret_access_key": args.secret_key}
+    bucket = "bench-uploads"
+    payload = os.urandom(int(args.size_mb * 1024**2))
+    try:
+        setup = boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1", **credentials)
+        try:
+            setup.create_bucket(Bucket=bucket)
+        except setup.exceptions.BucketAlreadyOwnedByYou:
+            pass
+
+        def per_call_put():
+            s3 = boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1", **credentials)
+            s3.put_object(Bucket=bucket, Key="bench/per-call.bin", Body=payload)
+
+        uploader = ObjectUploader(
+            endpoint_url=endpoint,
+            access_key=args.access_key,
+            secret_key=args.secret_key,
+            bucket=bucket,
+            public_url_base=f"{endpoint}/{bucket}",
+        )
+
+        def shared_put():
+            uploader.put_bytes(payload, "bench/shared.bin", "application/octet-stream")
+
+        def streamed():
+            # Simulates an encoder emitting 1MB chunks while parts upload behind it
+            with uploader.open_stream("bench/streamed.bin", "application/octet-stream") as stream:
+                view = memoryview(payload)
+                for offset in range(0, len(view), 1024**2):
+                    stream.write(view[offset:offset + 1024**2])
+
+        report = {"endpoint": endpoint, "size_mb": args.size_mb}
+        for name, fn in (("per_call_put_object", per_call_put), ("shared_multipart", shared_put),
+                         ("streamed_multipart", streamed)):
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                fn()
+                samples.append((time.perf_counter() - started) * 1000)
+            report[name] = _latency_summary(samples)
+        uploader.shutdown()
+        return report
+    finally:
+        if server is not None:
+            server.stop()
+
+
+# ============================================================================
+# encode: streaming ffmpeg encoder vs. moviepy temp-file export
+# ============================================================================
+
+def _synthetic_frames(count: int, width: int, height: int):
+    """Float frames in [0, 1], shaped like diffusers output_type="np"."""
+    import numpy as np
+
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    frames = np.empty((count, height, width, 3), dtype=np.float32)
+    for i in range(count):
+        phase = i / max(1, count - 1)
+        frames[i] = np.concatenate([
+            np.broadcast_to((x + phase) % 1.0, (height, width, 1)),
+            np.broadcast_to(y, (height, width, 1)),
+            np.broadcast_to((x * y + phase) % 1.0, (height, width, 1)),
+        ], axis=2)
+    return frames
+
+
+def _encode_moviepy(frames, fps: int) -> int:
+    """The previous export path: PIL frames -> arrays -> temp file -> bytes."""
+    import os
+    import tempfile
+    import numpy as np
+    from PIL import Image
+    from moviepy.editor import ImageSequenceClip
+
+    pil_frames = [Image.fromarray((f * 255).astype(np.uint8)) for f in frames]
+    clip = ImageSequenceClip([np.array(f) for f in pil_frames], fps=fps)
+    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as f:
+        temp_path = f.name
+    clip.write_videofile(temp_path, codec="libx264", audio=False, verbose=False, logger=None)
+    with open(temp_path, "rb") as f:
+        video_bytes = f.read()
+    os.unlink(temp_path)
+    return len(video_bytes)
+
+
+def _encode_streaming(frames, fps: int) -> int:
+    from video_encoder import FrameStreamEncoder
+
+    class CountingSink:
+        size = 0
+
+        def write(self, data):
+            self.size += len(data)
+
+    sink = CountingSink()
+    height, width = frames.shape[1:3]
+    with FrameStreamEncoder(width, height, fps, sink) as encoder:
+        for frame in frames:
+            encoder.write_frame(frame)
+    return sink.size
+
+
+def _encode_worker(mode: str, count: int, width: int, height: int, fps: int):
+    import resource
+
+    frames = _synthetic_frames(count, width, height)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    size = (_encode_moviepy if mode == "moviepy" else _encode_streaming)(frames, fps)
+    elapsed = (time.perf_counter() - started) * 1000
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"ms": round(elapsed, 1), "output_bytes": size,
+            "peak_rss_mb": round(peak / 1024, 1), "rss_growth_mb": round((peak - baseline) / 1024, 1)}
+
+
+def bench_encode(args) -> Dict:
+    import multiprocessing
+
+    # Each mode runs in a fresh process so peak RSS isn't shared between them
+    context = multiprocessing.get_context("spawn")
+    report = {"frames": args.frames, "resolution": f"{args.width}x{args.height}"}
+    for mode in ("moviepy", "streaming"):
+        with context.Pool(1) as pool:
+            report[mode] = pool.apply(_encode_worker, (mode, args.frames, args.width, args.height, args.fps))
+    return report
+
+
+# ============================================================================
+# scheduler: family-aware job ordering vs. arrival order
+# ============================================================================
+
+async def _run_workload(workload: List[str], family_aware: bool, args) -> Dict:
+    """Drain a mixed workload through a one-worker JobQueue with simulated model swaps."""
+    from jobs import JobQueue, FamilyScheduler
+
+    state = {"resident": None, "swaps": 0}
+
+    async def runner(operation, params):
+        if params["family"] != state["resident"]:
+            state["swaps"] += 1
+            state["resident"] = params["family"]
+            await asyncio.sleep(args.swap_ms / 1000)
+        await asyncio.sleep(args.run_ms / 1000)
+        return {"success": True}
+
+    family_of = (lambda operation, params: params["family"]) if family_aware else None
+    queue = JobQueue(runner, workers=1, family_of=family_of,
+                     scheduler=FamilyScheduler(max_burst=args.max_burst, max_wait=args.max_wait))
+    await queue.start()
+    started = time.perf_counter()
+    submitted = []
+    for family in workload:
+        submitted.append(queue.submit(family, {"family": family}))
+        await asyncio.sleep(args.arrival_ms / 1000)
+    while not all(job.done for job in submitted):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    await queue.stop()
+
+    waits = [(job.started_at - job.created_at) * 1000 for job in submitted]
+    return {
+        "seconds": round(elapsed, 2),
+        "jobs_per_second": round(len(submitted) / elapsed, 2),
+        "model_swaps": state["swaps"],
+        "max_wait_ms": round(max(waits), 1),
+        **{f"wait_{key}": value for key, value in _latency_summary(waits).items()},
+        "scheduler": queue.scheduler.stats() if family_aware else None,
+    }
+
+
+def bench_scheduler(args) -> Dict:
+    import random
+
+    rng = random.Random(0)
+    families = ["depth", "video", "edit"]
+    workload = [rng.choice(families) for _ in range(args.jobs)]
+    report = {"jobs": args.jobs, "swap_ms": args.swap_ms, "run_ms": args.run_ms,
+              "arrival_ms": args.arrival_ms}
+    report["arrival_order"] = asyncio.run(_run_workload(workload, False, args))
+    report["family_aware"] = asyncio.run(_run_workload(workload, True, args))
+    report["throughput_gain"] = round(
+        report["family_aware"]["jobs_per_second"] / report["arrival_order"]["jobs_per_second"], 2
+    )
+    return report
+
+
+# ============================================================================
+# runpod: persistent-loop async handler vs. asyncio.run() per job
+# ============================================================================
+
+def _fake_runpod_jobs(count: int, image_url: str) -> List[Dict]:
+    return [
+        {"id": f"bench-{i}", "input": {"operation": "lens_character",
+                                       "params": {"image_url": image_url, "vignette_strength": 0.3}}}
+        for i in range(count)
+    ]
+
+
+def _per_job_summary(samples_ms: List[float], elapsed: float, connections: int) -> Dict:
+    return {
+        "cold_ms": round(samples_ms[0], 2),
+        **{f"warm_{key}": value for key, value in _latency_summary(samples_ms[1:]).items()},
+        "jobs_per_second": round(len(samples_ms) / elapsed, 2),
+        "connections": connections,
+    }
+
+
+def bench_runpod(args) -> Dict:
+    """
+    Feed fake runpod jobs to the handler the two ways a worker can run them.
+
+    per_job_loop replays the previous sync handler (a fresh asyncio.run() per
+    job, one at a time); persistent_loop awaits the async handler on one loop
+    with up to --concurrency jobs in flight, as runpod does with a
+    concurrency_modifier. Each mode runs in a fresh process so the first job
+    is cold.
+    """
+    import multiprocessing
+
+    payload = _test_jpeg(args.size)
+    server = _StandInServer(payload)
+    context = multiprocessing.get_context("spawn")
+    report = {"jobs": args.jobs, "concurrency": args.concurrency, "payload_bytes": len(payload)}
+    try:
+        for mode in ("per_job_loop", "persistent_loop"):
+            server.reset()
+            with context.Pool(1) as pool:
+                samples, elapsed = pool.apply(_runpod_worker, (mode, args.jobs, args.concurrency, server.url))
+            report[mode] = _per_job_summary(samples, elapsed, server.connections)
+    finally:
+        server.close()
+    return report
+
+
+def _runpod_worker(mode: str, count: int, concurrency: int, image_url: str):
+    import os
+    os.environ["ARTIFACT_FALLBACK"] = "base64"
+    from runpod_handler import handler, process_job_async
+
+    jobs = _fake_runpod_jobs(count, image_url)
+    samples = []
+
+    async def timed(job):
+        started = time.perf_counter()
+        result = await (process_job_async(job) if mode == "per_job_loop" else handler(job))
+        if not result.get("success"):
+            raise RuntimeError(result.get("error"))
+        samples.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    if mode == "per_job_loop":
+        for job in jobs:
+            asyncio.run(timed(job))
+    else:
+        async def feed():
+            # The first job runs alone so it is measured cold, like the first runpod job
+            await timed(jobs[0])
+            slots = asyncio.Semaphore(concurrency)
+
+            async def run(job):
+                async with slots:
+                    await timed(job)
+
+            await asyncio.gather(*(run(job) for job in jobs[1:]))
+
+        asyncio.run(feed())
+    return samples, time.perf_counter() - started
+
+
+# ============================================================================
+# importtime: import cost of the worker and time to first health response
+# ============================================================================
+
+def _parse_importtime(stderr: str) -> List[Dict]:
+    """Top-level entries of `python -X importtime` output (nested imports folded in)."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # Nested imports are indented two extra spaces per level
+        if not cumulative_us.strip().isdigit() or name[1:2] == " ":
+            continue
+        entries.append({"module": name.strip(), "cumulative_ms": round(int(cumulative_us) / 1000, 1)})
+    return entries
+
+
+def _import_report(statement: str, top: int) -> Dict:
+    import os
+    import subprocess
+    import sys
+
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"{statement}; import sys; print('torch' in sys.modules)"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    elapsed = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise SystemExit(result.stderr[-2000:])
+    entries = _parse_importtime(result.stderr)
+    return {
+        "process_ms": round(elapsed, 1),
+        "import_ms": round(sum(entry["cumulative_ms"] for entry in entries), 1),
+        "torch_imported": result.stdout.strip().endswith("True"),
+        "slowest": sorted(entries, key=lambda entry: entry["cumulative_ms"], reverse=True)[:top],
+    }
+
+
+def _time_to_first_health(port: int, timeout: float) -> Dict:
+    """Start the server in a fresh process and time until /live and /health answer."""
+    import os
+    import subprocess
+    import sys
+    import urllib.request
+
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    report = {}
+    try:
+        for path in ("/live", "/health"):
+            while path not in report:
+                if time.perf_counter() - started > timeout:
+                    raise SystemExit(f"{path} did not answer within {timeout}s")
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1):
+                        report[path] = round((time.perf_counter() - started) * 1000, 1)
+                except OSError:
+                    time.sleep(0.02)
+    finally:
+        server.terminate()
+        server.wait()
+    return {"first_live_ms": report["/live"], "first_health_ms": report["/health"]}
+
+
+def _time_to_first_runpod_health() -> float:
+    """Fresh process: import the RunPod handler and answer one health job."""
+    import os
+    import subprocess
+    import sys
+
+    script = (
+        "import asyncio, runpod_handler; "
+        "assert asyncio.run(runpod_handler.handler({'id': 'bench', 'input': {'operation': 'health'}}))['success']"
+    )
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", script], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def bench_importtime(args) -> Dict:
+    report = {
+        "lazy": _import_report("import main", args.top),
+        # What the worker used to pay before torch moved behind first use
+        "eager_torch": _import_report("import torch, main", args.top),
+        "server": _time_to_first_health(args.port, args.timeout),
+    }
+    try:
+        report["runpod_first_health_ms"] = _time_to_first_runpod_health()
+    except Exception as e:
+        report["runpod_first_health_ms"] = f"skipped: {e}"
+    return report
+
+
+# ============================================================================
+# lens: vectorized lens engine vs. the previous PIL/numpy loop
+# ============================================================================
+
+def _legacy_lens_character(image, vignette_strength: float, lens_type: str):
+    """The previous _render_lens_character, minus PNG encoding."""
+    import numpy as np
+    from PIL import Image, ImageFilter, ImageEnhance
+
+    result = image.copy()
+    if vignette_strength > 0:
+        width, height = result.size
+        x = np.linspace(-1, 1, width)
+        y = np.linspace(-1, 1, height)
+        X, Y = np.meshgrid(x, y)
+        R = np.sqrt(X**2 + Y**2)
+        vignette = np.clip(1 - (R * vignette_strength * 0.5), 0, 1)
+        result_array = np.array(result).astype(float)
+        for c in range(3):
+            result_array[:, :, c] *= vignette
+        result = Image.fromarray(result_array.astype("uint8"))
+    if lens_type == "vintage":
+        result = result.filter(ImageFilter.GaussianBlur(radius=0.5))
+        result = ImageEnhance.Contrast(result).enhance(0.95)
+    return result
+
+
+def _lens_test_frame(width: int, height: int):
+    """A gradient frame with a grid of small highlights for bokeh and flare to act on."""
+    import numpy as np
+
+    frame = (_synthetic_frames(1, width, height)[0] * 200).astype(np.uint8)
+    frame[height // 16::height // 8, width // 16::width // 8] = 255
+    return frame
+
+
+def _time_calls(fn, repeat: int) -> Dict:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"first_ms": round(samples[0], 1), **_latency_summary(samples[1:] or samples)}
+
+
+def bench_lens(args) -> Dict:
+    import numpy as np
+    from PIL import Image
+    from lens_effects import apply_lens_character, vignette_mask
+
+    frame = _lens_test_frame(args.width, args.height)
+    image = Image.fromarray(frame)
+    report = {"resolution": f"{args.width}x{args.height}", "repeat": args.repeat}
+
+    # Same work as before: vignette + vintage softness/contrast, PIL in and out
+    report["legacy_vignette_vintage"] = _time_calls(
+        lambda: _legacy_lens_character(image, 0.2, "vintage"), args.repeat
+    )
+    vignette_mask.cache_clear()
+    report["engine_vignette_vintage"] = _time_calls(
+        lambda: Image.fromarray(apply_lens_character(np.asarray(image), "vintage", vignette_strength=0.2)[0]),
+        args.repeat,
+    )
+    # Everything the request advertises, which the old path ignored
+    for lens_type, bokeh_shape in (("vintage", "hexagonal"), ("anamorphic", "oval")):
+        report[f"engine_full_{lens_type}_{bokeh_shape}"] = _time_calls(
+            lambda: apply_lens_character(frame, lens_type, bokeh_shape, aberration_strength=0.5,
+                                         flare_intensity=0.3, vignette_strength=0.2),
+            args.repeat,
+        )
+    return report
+
+
+# ============================================================================
+# rackfocus: precomputed blur stack vs. re-blurring every frame
+# ============================================================================
+
+def _synthetic_depth(width: int, height: int):
+    """Raw disparity: a far gradient background with a near disc in the middle."""
+    import numpy as np
+
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    depth = y / height
+    disc = (x - width / 2) ** 2 + (y - height / 2) ** 2 < (min(width, height) / 4) ** 2
+    depth[disc] = 1.5
+    return depth
+
+
+def _reblur_frames(rgb, depth01, start: float, end: float, num_frames: int, blur_strength: float):
+    """Baseline: rebuild the blur levels for every frame instead of reusing them."""
+    from rack_focus_renderer import RackFocusRenderer, _ease
+
+    for index in range(num_frames):
+        renderer = RackFocusRenderer(rgb, depth01, blur_strength=blur_strength)
+        t = _ease(index / max(1, num_frames - 1))
+        yield renderer.render(start + (end - start) * t)
+
+
+def bench_rackfocus(args) -> Dict:
+    import numpy as np
+    from rack_focus_renderer import RackFocusRenderer, prepare_inputs, sample_focus_depth
+
+    rgb, depth01 = prepare_inputs(_lens_test_frame(args.width, args.height),
+                                  _synthetic_depth(args.width, args.height))
+    start, end = sample_focus_depth(depth01, (0.5, 0.5)), sample_focus_depth(depth01, (0.1, 0.9))
+    report = {"resolution": f"{args.width}x{args.height}", "runs": []}
+
+    for num_frames in (int(value) for value in args.frames.split(",")):
+        started = time.perf_counter()
+        renderer = RackFocusRenderer(rgb, depth01, blur_strength=args.blur_strength)
+        precompute_ms = (time.perf_counter() - started) * 1000
+        for _ in renderer.frames(start, end, num_frames):
+            pass
+        total_ms = (time.perf_counter() - started) * 1000
+        run = {
+            "frames": num_frames,
+            "precompute_ms": round(precompute_ms, 1),
+            "total_ms": round(total_ms, 1),
+            "per_frame_ms": round((total_ms - precompute_ms) / num_frames, 2),
+        }
+        if num_frames <= args.baseline_max_frames:
+            started = time.perf_counter()
+            for _ in _reblur_frames(rgb, depth01, start, end, num_frames, args.blur_strength):
+                pass
+            run["reblur_total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        report["runs"].append(run)
+
+    if args.encode:
+        started = time.perf_counter()
+        frames = RackFocusRenderer(rgb, depth01, blur_strength=args.blur_strength).frames(start, end, 48)
+        report["encode_48_frames_bytes"] = _encode_streaming(np.stack(list(frames)), 24)
+        report["encode_48_frames_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+
+# ============================================================================
+# tiling: whole-image vs. tiled processing at 2K/4K/8K
+# ============================================================================
+
+TILING_SIZES = {"2k": (2048, 1080), "4k": (3840, 2160), "8k": (7680, 4320)}
+
+
+def _tiling_worker(op: str, mode: str, width: int, height: int) -> Dict:
+    """One op at one size in a fresh process; peak RSS is measured over the op only."""
+    import resource
+    import cv2
+    import numpy as np
+    from PIL import Image, ImageEnhance
+    from lens_effects import LensCharacter, apply_lens_character, sharpen
+    from output_stage import depth_finalizer
+    from tiling import merge_depth_tiles, plan_tiles, run_tiled, to_uint8, DEPTH_TILE_OVERLAP, DEPTH_TILE_SIZE
+
+    rgb = _lens_test_frame(width, height)
+    options = dict(lens_type="vintage", bokeh_shape="hexagonal", aberration_strength=0.5,
+                   flare_intensity=0.3, vignette_strength=0.2)
+    if op == "depth":
+        # Stand-ins for model output: whole-image depth at 518px, and per-tile depth at 518px
+        depth = cv2.resize(_synthetic_depth(width, height), (518, 518 * height // width))
+        bands = plan_tiles(height, width, DEPTH_TILE_SIZE, DEPTH_TILE_OVERLAP, halo=0)
+        tile_depths = [cv2.resize(_synthetic_depth(t.x1 - t.x0, t.y1 - t.y0), (518, 518)) for b in bands for t in b]
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if op == "lens" and mode == "whole":
+        result = apply_lens_character(rgb, **options)[0]
+    elif op == "lens":
+        lens = LensCharacter(rgb, **options)
+        result = run_tiled(rgb, lambda region, tile: lens.render(region, tile.py0, tile.px0), to_uint8, np.uint8)
+    elif op == "sharpen" and mode == "whole":
+        result = np.asarray(ImageEnhance.Sharpness(Image.fromarray(rgb)).enhance(2.4))
+    elif op == "sharpen":
+        result = run_tiled(rgb, lambda region, tile: sharpen(region, 2.4), to_uint8, np.uint8)
+    elif mode == "whole":
+        # Previous behaviour: bilinear upscale of the whole-image depth
+        normalized = (depth - depth.min()) / (depth.max() - depth.min()) * 255
+        result = np.asarray(Image.fromarray(normalized.astype("uint8")).resize((width, height), Image.BILINEAR))
+    else:
+        finalize, dtype = depth_finalizer(float(depth.min()), float(depth.max()), "png")
+        result = merge_depth_tiles(depth, tile_depths, bands, finalize, dtype)
+    elapsed = (time.perf_counter() - started) * 1000
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"ms": round(elapsed, 1), "output_shape": list(result.shape),
+            "peak_rss_mb": round(peak / 1024, 1), "rss_growth_mb": round((peak - baseline) / 1024, 1)}
+
+
+def bench_tiling(args) -> Dict:
+    import multiprocessing
+
+    context = multiprocessing.get_context("spawn")
+    report = {}
+    for size in args.sizes.split(","):
+        width, height = TILING_SIZES[size]
+        report[size] = {"resolution": f"{width}x{height}"}
+        for op in args.ops.split(","):
+            for mode in ("whole", "tiled"):
+                with context.Pool(1) as pool:
+                    report[size][f"{op}_{mode}"] = pool.apply(_tiling_worker, (op, mode, width, height))
+    return report
+
+
+# ============================================================================
+# output: shared output stage formats vs. the previous depth PNG path
+# ============================================================================
+
+def _legacy_depth_png(depth, size) -> bytes:
+    """The previous _encode_depth_png: quantize at model size, PIL resize, default PNG save."""
+    from PIL import Image
+
+    depth = (depth - depth.min()) / (depth.max() - depth.min()) * 255
+    depth_image = Image.fromarray(depth.astype("uint8")).resize(size, Image.Resampling.BILINEAR)
+    buffer = io.BytesIO()
+    depth_image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def bench_output(args) -> Dict:
+    import cv2
+    from output_stage import DEPTH_FORMATS, OutputStage, quantize_depth
+
+    size = (args.width, args.height)
+    depth = cv2.resize(_synthetic_depth(args.width, args.height), (518, 518 * args.height // args.width))
+    stage = OutputStage()
+    report = {"resolution": f"{args.width}x{args.height}", "repeat": args.repeat}
+
+    report["legacy_png"] = _time_calls(lambda: _legacy_depth_png(depth, size), args.repeat)
+    report["legacy_png"]["bytes"] = len(_legacy_depth_png(depth, size))
+    for output_format in DEPTH_FORMATS:
+        report[output_format] = _time_calls(
+            lambda: stage.encode(quantize_depth(depth, size, output_format), output_format), args.repeat
+        )
+    for output_format, entry in stage.stats()["formats"].items():
+        report[output_format]["bytes"] = int(entry["mean_kb"] * 1024)
+        report[output_format]["encode_only_ms"] = entry["mean_encode_ms"]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPU worker local benchmarks")
+    subcommands = parser.add_subparsers(dest="benchmark", required=True)
+
+    fetch = subcommands.add_parser("fetch", help="Pooled streaming fetch_image vs. client per call")
+    fetch.add_argument("--requests", type=int, default=50)
+    fetch.add_argument("--size", type=int, default=2048, help="Test image edge length in pixels")
+    fetch.set_defaults(run=bench_fetch)
+
+    upload = subcommands.add_parser("upload", help="Shared multipart uploader vs. client per put_object")
+    upload.add_argument("--endpoint", default="", help="S3-compatible endpoint (default: local moto server)")
+    upload.add_argument("--access-key", default="bench")
+    upload.add_argument("--secret-key", default="bench")
+    upload.add_argument("--size-mb", type=float, default=64)
+    upload.add_argument("--repeat", type=int, default=3)
+    upload.set_defaults(run=bench_upload)
+
+    encode = subcommands.add_parser("encode", help="Streaming ffmpeg encoder vs. moviepy temp-file export")
+    encode.add_argument("--frames", type=int, default=97)
+    encode.add_argument("--width", type=int, default=1280)
+    encode.add_argument("--height", type=int, default=720)
+    encode.add_argument("--fps", type=int, default=24)
+    encode.set_defaults(run=bench_encode)
+
+    scheduler = subcommands.add_parser("scheduler", help="Family-aware job ordering vs. arrival order")
+    scheduler.add_argument("--jobs", type=int, default=200)
+    scheduler.add_argument("--swap-ms", type=float, default=300, help="Simulated model swap cost")
+    scheduler.add_argument("--run-ms", type=float, default=30, help="Simulated job run time")
+    scheduler.add_argument("--arrival-ms", type=float, default=5, help="Time between submissions")
+    scheduler.add_argument("--max-burst", type=int, default=8)
+    scheduler.add_argument("--max-wait", type=float, default=60, help="Seconds before a job jumps the queue")
+    scheduler.set_defaults(run=bench_scheduler)
+
+    runpod = subcommands.add_parser("runpod", help="Persistent-loop async handler vs. asyncio.run() per job")
+    runpod.add_argument("--jobs", type=int, default=40)
+    runpod.add_argument("--concurrency", type=int, default=4)
+    runpod.add_argument("--size", type=int, default=1024, help="Test image edge length in pixels")
+    runpod.set_defaults(run=bench_runpod)
+
+    importtime = subcommands.add_parser("importtime", help="Import cost and time to first health response")
+    importtime.add_argument("--top", type=int, default=15, help="Slowest top-level imports to list")
+    importtime.add_argument("--port", type=int, default=8765)
+    importtime.add_argument("--timeout", type=float, default=120)
+    importtime.set_defaults(run=bench_importtime)
+
+    lens = subcommands.add_parser("lens", help="Vectorized lens engine vs. the previous PIL/numpy path")
+    lens.add_argument("--width", type=int, default=3840)
+    lens.add_argument("--height", type=int, default=2160)
+    lens.add_argument("--repeat", type=int, default=5)
+    lens.set_defaults(run=bench_lens)
+
+    rackfocus = subcommands.add_parser("rackfocus", help="Rack focus renderer scaling vs. re-blurring per frame")
+    rackfocus.add_argument("--frames", default="24,48,96", help="Comma-separated frame counts")
+    rackfocus.add_argument("--width", type=int, default=1280)
+    rackfocus.add_argument("--height", type=int, default=720)
+    rackfocus.add_argument("--blur-strength", type=float, default=1.0)
+    rackfocus.add_argument("--baseline-max-frames", type=int, default=48,
+                           help="Skip the re-blur baseline above this many frames")
+    rackfocus.add_argument("--encode", action="store_true", help="Also stream 48 frames through ffmpeg")
+    rackfocus.set_defaults(run=bench_rackfocus)
+
+    tiling = subcommands.add_parser("tiling", help="Whole-image vs. tiled lens, sharpen and depth merge")
+    tiling.add_argument("--sizes", default="2k,4k,8k", help=f"Comma-separated: {', '.join(TILING_SIZES)}")
+    tiling.add_argument("--ops", default="lens,sharpen,depth", help="Comma-separated: lens, sharpen, depth")
+    tiling.set_defaults(run=bench_tiling)
+
+    output = subcommands.add_parser("output", help="Depth output formats vs. the previous PNG path (time, size)")
+    output.add_argument("--width", type=int, default=3840)
+    output.add_argument("--height", type=int, default=2160)
+    output.add_argument("--repeat", type=int, default=5)
+    output.set_defaults(run=bench_output)
+
+    args = parser.parse_args()
+    print(json.dumps(args.run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
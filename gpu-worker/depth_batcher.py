@@ -0,0 +1,119 @@
+"""
+Dynamic micro-batching for depth estimation.
+
+Depth requests that arrive within a short window are coalesced into one
+batched forward pass instead of one pass per image. A batch is flushed when
+it reaches DEPTH_BATCH_MAX_SIZE images or when its oldest request has waited
+DEPTH_BATCH_MAX_WAIT_MS, whichever comes first. Results are split back to
+each caller, and a failed batch fails every request in it.
+"""
+
+import os
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from executors import DeviceExecutor
+
+logger = logging.getLogger("gpu-worker.depth-batcher")
+
+DEPTH_BATCH_MAX_SIZE = int(os.getenv("DEPTH_BATCH_MAX_SIZE", "8"))
+DEPTH_BATCH_MAX_WAIT_MS = float(os.getenv("DEPTH_BATCH_MAX_WAIT_MS", "10"))
+
+
+@dataclass
+class _PendingBatch:
+    loop: asyncio.AbstractEventLoop
+    items: List[Tuple[Any, asyncio.Future]] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class DepthBatcher:
+    """
+    Coalesces per-image depth requests into batched calls of `predict_batch`.
+
+    `predict_batch(model, images)` is a blocking callable returning one depth
+    array per image, in order; it runs on `executor`.
+    """
+
+    def __init__(
+        self,
+        predict_batch: Callable[[str, List[Any]], List[Any]],
+        executor: Callable[[], DeviceExecutor],
+        max_batch_size: int = DEPTH_BATCH_MAX_SIZE,
+        max_wait_ms: float = DEPTH_BATCH_MAX_WAIT_MS,
+    ):
+        self.predict_batch = predict_batch
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self._pending: Dict[str, _PendingBatch] = {}
+        # The loop only holds weak references to tasks; keep running batches alive
+        self._tasks: Set[asyncio.Task] = set()
+        self.batch_sizes: Counter = Counter()
+
+    async def predict(self, model: str, image: Any) -> Any:
+        """Queue one image for `model` and wait for its depth map."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        batch = self._pending.get(model)
+        if batch is None or batch.loop is not loop:
+            batch = _PendingBatch(loop=loop)
+            self._pending[model] = batch
+            if self.max_wait_ms > 0 and self.max_batch_size > 1:
+                batch.timer = loop.call_later(self.max_wait_ms / 1000, self._flush, model, batch)
+        batch.items.append((image, future))
+
+        if len(batch.items) >= self.max_batch_size or batch.timer is None:
+            self._flush(model, batch)
+
+        return await future
+
+    def _flush(self, model: str, batch: _PendingBatch):
+        if self._pending.get(model) is batch:
+            del self._pending[model]
+        if batch.timer is not None:
+            batch.timer.cancel()
+        if batch.items:
+            items, batch.items = batch.items, []
+            task = batch.loop.create_task(self._run(model, items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, model: str, items: List[Tuple[Any, asyncio.Future]]):
+        # Callers that gave up while queued don't need a forward pass
+        items = [(image, future) for image, future in items if not future.done()]
+        if not items:
+            return
+        self.batch_sizes[len(items)] += 1
+        try:
+            results = await self.executor().run(
+                self.predict_batch, model, [image for image, _ in items]
+            )
+            for (_, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # Cancelled (e.g. at shutdown) or short of results: never leave a caller waiting
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(RuntimeError(f"Depth batch for {model} ended without a result"))
+
+    def stats(self) -> Dict[str, Any]:
+        batches = sum(self.batch_sizes.values())
+        images = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": batches,
+            "images": images,
+            "avg_batch_size": round(images / batches, 2) if batches else None,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+        }
@@ -0,0 +1,226 @@
+"""
+Content-addressed cache for raw depth maps.
+
+Boards send the same source image to /depth/estimate, /utils/depth-map and
+/optics/rack-focus over and over. Depth is keyed by a hash of the decoded
+pixels plus the model name, so the same image hits the cache no matter which
+endpoint or encoding it arrived through.
+
+Tiers:
+- memory: LRU of float arrays bounded by DEPTH_CACHE_MB
+- disk (optional, DEPTH_CACHE_DIR): .npy files read back memory-mapped,
+  bounded by DEPTH_CACHE_DISK_GB with oldest-first cleanup. Disk hits are
+  served from the mapping and not copied into the memory tier, whose budget
+  only counts arrays it actually holds.
+
+Cached arrays are read-only; callers must copy before modifying them.
+"""
+
+import os
+import hashlib
+import tempfile
+import logging
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger("gpu-worker.depth-cache")
+
+DEPTH_CACHE_MB = int(os.getenv("DEPTH_CACHE_MB", "512"))
+DEPTH_CACHE_DIR = os.getenv("DEPTH_CACHE_DIR", "")
+DEPTH_CACHE_DISK_GB = float(os.getenv("DEPTH_CACHE_DISK_GB", "5"))
+
+
+def depth_cache_key(image, model: str) -> str:
+    """Hash of a PIL image's pixels, mode and size, plus the depth model name."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{model}:{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class DepthCache:
+    """Thread-safe two-tier (memory LRU + optional .npy on disk) depth map cache."""
+
+    def __init__(
+        self,
+        max_bytes: int = DEPTH_CACHE_MB * 1024**2,
+        disk_dir: str = DEPTH_CACHE_DIR,
+        disk_max_bytes: int = int(DEPTH_CACHE_DISK_GB * 1024**3),
+    ):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    def get(self, key: str) -> Optional["np.ndarray"]:
+        """Look up a depth map; disk hits come back memory-mapped."""
+        with self._lock:
+            depth = self._memory.get(key)
+            if depth is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return depth
+            on_disk = key in self._disk
+
+        if on_disk:
+            import numpy as np
+
+            try:
+                depth = np.load(self._disk_path(key), mmap_mode="r")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping unreadable depth cache file {key}: {e}")
+                self._forget_disk(key)
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                return depth
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, depth: "np.ndarray"):
+        """Store a depth map in memory and, if configured, on disk."""
+        import numpy as np
+
+        depth = np.ascontiguousarray(depth, dtype=np.float32)
+        depth.setflags(write=False)
+        with self._lock:
+            self._remember(key, depth)
+            write_disk = self.disk_dir is not None and key not in self._disk
+
+        if write_disk:
+            size = self._write_file(key, depth)
+            if size is None:
+                return
+            with self._lock:
+                if key in self._disk:
+                    return
+                self._disk[key] = size
+                self._disk_bytes += size
+                expired = self._trim_disk()
+            for old_key in expired:
+                self._remove_file(old_key)
+
+    def _write_file(self, key: str, depth: "np.ndarray") -> Optional[int]:
+        """
+        Write `depth` to its .npy path and return the file size, or None if the
+        file already existed (another writer got there first) or couldn't be written.
+
+        Each writer gets its own temp file, and the final name is created with
+        a hard link, which fails instead of replacing a file that is already there.
+        """
+        import numpy as np
+
+        path = self._disk_path(key)
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{key}.", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, depth)
+            size = os.path.getsize(tmp)
+            os.link(tmp, path)
+            return size
+        except FileExistsError:
+            return None
+        except OSError as e:
+            logger.warning(f"Could not write depth cache file {key}: {e}")
+            return None
+        finally:
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_mb": round(self._memory_bytes / 1024**2, 1),
+                "memory_budget_mb": self.max_bytes // 1024**2,
+                "disk_entries": len(self._disk),
+                "disk_mb": round(self._disk_bytes / 1024**2, 1),
+                "disk_enabled": self.disk_dir is not None,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else None,
+            }
+
+    def _remember(self, key: str, depth: "np.ndarray"):
+        """Insert into the memory LRU and evict to fit (lock held)."""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        if depth.nbytes > self.max_bytes:
+            return
+        self._memory[key] = depth
+        self._memory_bytes += depth.nbytes
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def _trim_disk(self) -> list:
+        """Drop oldest disk entries until under budget, returning keys to delete (lock held)."""
+        expired = []
+        while self._disk and self._disk_bytes > self.disk_max_bytes:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            expired.append(key)
+        return expired
+
+    def _forget_disk(self, key: str):
+        with self._lock:
+            size = self._disk.pop(key, None)
+            if size is not None:
+                self._disk_bytes -= size
+        self._remove_file(key)
+
+    def _remove_file(self, key: str):
+        try:
+            os.unlink(self._disk_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npy")
+
+    def _scan_disk(self):
+        """Index existing .npy files, oldest first, so the disk tier survives restarts."""
+        found = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith(".npy"):
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, name[:-4], stat.st_size))
+                elif name.endswith(".tmp"):
+                    # Left behind by a writer that died mid-write
+                    os.unlink(path)
+        for _, key, size in sorted(found):
+            self._disk[key] = size
+            self._disk_bytes += size
+        for key in self._trim_disk():
+            self._remove_file(key)
+        if found:
+            logger.info(f"Depth cache: indexed {len(self._disk)} maps on disk ({self._disk_bytes / 1024**2:.0f}MB)")
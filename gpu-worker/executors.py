@@ -0,0 +1,152 @@
+"""
+Bounded executors for blocking compute in the GPU worker.
+
+Torch forward passes, diffusers pipelines, PIL/numpy processing and video
+export are synchronous and can run for minutes. Request handlers hand those
+sections to a DeviceExecutor so the event loop stays free to answer /health
+and accept other requests.
+
+Each device ("cuda", "cpu", ...) gets its own thread pool with a configurable
+concurrency limit (EXECUTOR_CONCURRENCY_<DEVICE>, e.g. EXECUTOR_CONCURRENCY_CUDA=1).
+Queue depth, wait time and run time are tracked per executor.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from profiling import current_profile, traced
+
+logger = logging.getLogger("gpu-worker.executors")
+
+DEFAULT_CONCURRENCY = {
+    "cpu": min(4, os.cpu_count() or 1),
+    "io": 8,  # blocking network/disk I/O such as boto3 uploads
+}
+
+
+def _summarize(samples: deque) -> Dict[str, Any]:
+    if not samples:
+        return {"avg": None, "p95": None, "max": None}
+    ordered = sorted(samples)
+    return {
+        "avg": round(sum(ordered) / len(ordered), 1),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+        "max": round(ordered[-1], 1),
+    }
+
+
+class DeviceExecutor:
+    """
+    A bounded thread pool for one device.
+
+    `await executor.run(fn, *args)` runs `fn` on a worker thread with the
+    caller's contextvars, waiting in a FIFO queue when all workers are busy.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-exec")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        self.wait_ms: deque = deque(maxlen=200)
+        self.run_ms: deque = deque(maxlen=200)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking callable off the event loop and await its result."""
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+
+        ctx = contextvars.copy_context()
+        # When the request is profiled, the call shows up as a span with its calls traced
+        if current_profile.get() is not None:
+            fn = traced(fn, f"{self.name}: {getattr(fn, '__qualname__', fn)}")
+        future = self._pool.submit(ctx.run, self._invoke, submitted, fn, args, kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Work that never started is dropped; running work can't be interrupted
+            if future.cancel():
+                with self._lock:
+                    self.queued -= 1
+            raise
+
+    def _invoke(self, submitted: float, fn: Callable, args: tuple, kwargs: dict) -> Any:
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_ms.append((started - submitted) * 1000)
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.run_ms.append((time.perf_counter() - started) * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "max_queue_depth": self.max_queue_depth,
+                "wait_ms": _summarize(self.wait_ms),
+                "run_ms": _summarize(self.run_ms),
+            }
+
+    def shutdown(self, wait: bool = False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+_executors: Dict[str, DeviceExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(device: str) -> DeviceExecutor:
+    """Get (or create) the executor for a device such as "cuda", "cuda:1" or "cpu"."""
+    key = device.split(":")[0].lower()
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            default = DEFAULT_CONCURRENCY.get(key, 1)
+            max_workers = int(os.getenv(f"EXECUTOR_CONCURRENCY_{key.upper()}", str(default)))
+            executor = DeviceExecutor(key, max(1, max_workers))
+            _executors[key] = executor
+            logger.info(f"Created {key} executor with {executor.max_workers} worker(s)")
+        return executor
+
+
+def executor_stats() -> Dict[str, Dict[str, Any]]:
+    """Queue depth and wait/run time summaries for every executor."""
+    with _executors_lock:
+        executors = list(_executors.values())
+    return {executor.name: executor.stats() for executor in executors}
+
+
+def shutdown_executors(wait: bool = False):
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
@@ -0,0 +1,432 @@
+"""
+In-process job queue for long-running GPU operations.
+
+Clients submit work with POST /jobs and get a job ID back immediately, then
+poll GET /jobs/{id}, follow GET /jobs/{id}/events (server-sent events) or
+cancel with DELETE /jobs/{id}. This keeps HTTP connections short for
+multi-minute video generations and tells clients whether work is queued or
+running.
+
+Pending jobs are ordered by FamilyScheduler: it keeps draining jobs of the
+model family that ran last (so the cached models stay hot) and only switches
+once that family has no work left, its burst limit is reached, or another job
+has waited longer than JOB_MAX_WAIT_SECONDS.
+
+Handlers report progress and honour cancellation through the `current_job`
+context variable, which follows the job into executor threads:
+- report_progress() updates the job and notifies event subscribers
+- check_cancelled() raises JobCancelled once cancellation was requested
+- diffusers_progress_callback() does both from a pipeline's
+  callback_on_step_end, so cancellation stops denoising between steps
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import contextvars
+from enum import Enum
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("gpu-worker.jobs")
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+JOB_MAX_RETAINED = int(os.getenv("JOB_MAX_RETAINED", "1000"))
+JOB_FAMILY_MAX_BURST = int(os.getenv("JOB_FAMILY_MAX_BURST", "8"))
+JOB_MAX_WAIT_SECONDS = float(os.getenv("JOB_MAX_WAIT_SECONDS", "300"))
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+TERMINAL_STATUSES = {JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED}
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once cancellation has been requested."""
+
+
+@dataclass
+class Job:
+    """A queued or running operation and its latest progress."""
+    operation: str
+    params: Dict[str, Any]
+    priority: int = 0
+    family: Optional[str] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = JobStatus.QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    progress: float = 0.0
+    stage: Optional[str] = None
+    step: Optional[int] = None
+    total_steps: Optional[int] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    _loop: Optional[asyncio.AbstractEventLoop] = field(default=None, repr=False)
+    _subscribers: List[asyncio.Queue] = field(default_factory=list, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "operation": self.operation,
+            "priority": self.priority,
+            "family": self.family,
+            "status": self.status.value,
+            "progress": round(self.progress, 4),
+            "stage": self.stage,
+            "step": self.step,
+            "total_steps": self.total_steps,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_seconds": round((self.started_at or time.time()) - self.created_at, 3),
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def publish(self):
+        """Push the current state to event subscribers (safe from any thread)."""
+        if self._loop is None or not self._subscribers:
+            return
+        snapshot = self.to_dict()
+        for queue in list(self._subscribers):
+            try:
+                self._loop.call_soon_threadsafe(queue.put_nowait, snapshot)
+            except RuntimeError:
+                pass  # loop closed
+
+
+current_job: contextvars.ContextVar[Optional[Job]] = contextvars.ContextVar("current_job", default=None)
+
+
+def report_progress(
+    fraction: Optional[float] = None,
+    stage: Optional[str] = None,
+    step: Optional[int] = None,
+    total_steps: Optional[int] = None,
+):
+    """Update the current job's progress; a no-op outside of a job."""
+    job = current_job.get()
+    if job is None:
+        return
+    if stage is not None:
+        job.stage = stage
+    if step is not None:
+        job.step = step
+    if total_steps is not None:
+        job.total_steps = total_steps
+    if fraction is not None:
+        job.progress = max(job.progress, min(1.0, fraction))
+    elif step is not None and total_steps:
+        job.progress = max(job.progress, min(1.0, step / total_steps))
+    job.publish()
+
+
+def check_cancelled():
+    """Raise JobCancelled if the current job was cancelled; a no-op outside of a job."""
+    job = current_job.get()
+    if job is not None and job.cancel_event.is_set():
+        raise JobCancelled(f"Job {job.id} cancelled")
+
+
+def diffusers_progress_callback(total_steps: int, stage: str = "denoising"):
+    """
+    A `callback_on_step_end` for diffusers pipelines that reports per-step
+    progress and aborts the pipeline between steps when the job is cancelled.
+    """
+    def callback(pipe, step: int, timestep, callback_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        report_progress(stage=stage, step=step + 1, total_steps=total_steps)
+        check_cancelled()
+        return callback_kwargs
+
+    return callback
+
+
+def _oldest(jobs: List[Job]) -> Job:
+    return min(jobs, key=lambda job: job.created_at)
+
+
+class FamilyScheduler:
+    """
+    Picks the next pending job so that jobs sharing a model family run back to back.
+
+    Rules, in order:
+    1. A job that has waited `max_wait` seconds runs first (oldest first).
+    2. Only jobs of the highest pending priority are considered.
+    3. Jobs of the current family, or with no family (no model needed), run
+       oldest first while fewer than `max_burst` same-family jobs ran in a row
+       or no other family is waiting.
+    4. Otherwise switch to the family with the oldest waiting job.
+
+    Family switches are counted alongside the switches the same jobs would
+    have caused in arrival order, which gives the swaps avoided.
+    """
+
+    def __init__(self, max_burst: int = JOB_FAMILY_MAX_BURST, max_wait: float = JOB_MAX_WAIT_SECONDS):
+        self.max_burst = max(1, max_burst)
+        self.max_wait = max_wait
+        self.current_family: Optional[str] = None
+        self.burst = 0
+        self.family_switches = 0
+        self.fifo_switches = 0
+        self.aged_promotions = 0
+        self._arrival_family: Optional[str] = None
+
+    def record_submit(self, job: Job):
+        """Track the family switches arrival order would have caused."""
+        if job.family is None:
+            return
+        if self._arrival_family is not None and job.family != self._arrival_family:
+            self.fifo_switches += 1
+        self._arrival_family = job.family
+
+    def select(self, pending: List[Job]) -> Job:
+        now = time.time()
+
+        aged = [job for job in pending if now - job.created_at >= self.max_wait]
+        if aged:
+            choice = _oldest(aged)
+            if choice.family not in (None, self.current_family):
+                self.aged_promotions += 1
+        else:
+            top = max(job.priority for job in pending)
+            candidates = [job for job in pending if job.priority == top]
+            same = [job for job in candidates if job.family in (None, self.current_family)]
+            others = [job for job in candidates if job.family not in (None, self.current_family)]
+            if same and (self.burst < self.max_burst or not others):
+                choice = _oldest(same)
+            else:
+                choice = _oldest(others or candidates)
+
+        self._record_run(choice)
+        return choice
+
+    def _record_run(self, job: Job):
+        if job.family is None:
+            return
+        if job.family == self.current_family:
+            self.burst += 1
+            return
+        if self.current_family is not None:
+            self.family_switches += 1
+        self.current_family = job.family
+        self.burst = 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "current_family": self.current_family,
+            "burst": self.burst,
+            "family_switches": self.family_switches,
+            "arrival_order_switches": self.fifo_switches,
+            "swaps_avoided": max(0, self.fifo_switches - self.family_switches),
+            "aged_promotions": self.aged_promotions,
+        }
+
+
+class JobQueue:
+    """
+    Priority queue of jobs drained by a fixed number of worker tasks.
+
+    `runner` is awaited as `runner(operation, params)` and returns the result
+    dict. `family_of(operation, params)` names the model family a job needs
+    (None if it needs no model); without it, jobs run by priority then in
+    submission order.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        workers: int = JOB_WORKERS,
+        family_of: Optional[Callable[[str, Dict[str, Any]], Optional[str]]] = None,
+        scheduler: Optional[FamilyScheduler] = None,
+    ):
+        self.runner = runner
+        self.family_of = family_of
+        self.scheduler = scheduler or FamilyScheduler()
+        self.worker_count = max(1, workers)
+        self.jobs: Dict[str, Job] = {}
+        self._pending: List[Job] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker(index), name=f"job-worker-{index}")
+            for index in range(self.worker_count)
+        ]
+        logger.info(f"Job queue started with {self.worker_count} worker(s)")
+
+    async def stop(self):
+        for job in list(self._pending):
+            self._finish(job, JobStatus.CANCELLED, error="Worker shutting down")
+        self._pending.clear()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, operation: str, params: Dict[str, Any], priority: int = 0) -> Job:
+        self._prune()
+        family = self.family_of(operation, params) if self.family_of else None
+        job = Job(operation=operation, params=params, priority=priority, family=family)
+        job._loop = asyncio.get_running_loop()
+        self.jobs[job.id] = job
+        self.scheduler.record_submit(job)
+        self._pending.append(job)
+        self._wakeup.set()
+        logger.info(f"Queued job {job.id} ({operation}, priority {priority}), depth {len(self._pending)}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancel a queued job immediately, or signal a running one to stop.
+
+        A running job is not interrupted: its executor work can't be, and the
+        worker must not pick up the next job while the device is still busy.
+        It stops at its next check_cancelled() (or runs to the end) and is
+        then finished as CANCELLED.
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.done:
+            return job
+        job.cancel_event.set()
+        if job in self._pending:
+            self._pending.remove(job)
+            self._finish(job, JobStatus.CANCELLED, error="Cancelled before start")
+        elif job.status == JobStatus.RUNNING:
+            job.stage = "cancelling"
+            job.publish()
+        return job
+
+    async def events(self, job: Job, keepalive: Optional[float] = None):
+        """
+        Yield job snapshots until the job reaches a terminal state.
+
+        With `keepalive`, yields None whenever no update arrived for that many
+        seconds so streaming responses can send a heartbeat.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        job._subscribers.append(queue)
+        terminal = {status.value for status in TERMINAL_STATUSES}
+        try:
+            snapshot = job.to_dict()
+            yield snapshot
+            while snapshot["status"] not in terminal:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield snapshot
+        finally:
+            job._subscribers.remove(queue)
+
+    def stats(self) -> Dict[str, Any]:
+        running = [job for job in self.jobs.values() if job.status == JobStatus.RUNNING]
+        oldest = min((job.created_at for job in self._pending), default=None)
+        return {
+            "workers": self.worker_count,
+            "queued": len(self._pending),
+            "running": len(running),
+            "oldest_queued_seconds": round(time.time() - oldest, 1) if oldest else None,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "queued_by_family": self._queued_by_family(),
+            "scheduler": self.scheduler.stats(),
+        }
+
+    def _queued_by_family(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for job in self._pending:
+            key = job.family or "none"
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    async def _worker(self, index: int):
+        while True:
+            while not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            job = self.scheduler.select(self._pending)
+            self._pending.remove(job)
+            await self._run(job)
+
+    async def _run(self, job: Job):
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        job.stage = "running"
+        job.publish()
+
+        token = current_job.set(job)
+        try:
+            result = await self.runner(job.operation, job.params)
+        except JobCancelled as e:
+            self._finish(job, JobStatus.CANCELLED, error=str(e))
+            return
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            self._finish(job, JobStatus.FAILED, error=str(e))
+            return
+        finally:
+            current_job.reset(token)
+
+        if job.cancel_event.is_set():
+            self._finish(job, JobStatus.CANCELLED, error="Cancelled while running")
+        elif result.get("success", True):
+            self._finish(job, JobStatus.SUCCEEDED, result=result)
+        else:
+            self._finish(job, JobStatus.FAILED, result=result, error=result.get("error"))
+
+    def _finish(self, job: Job, status: JobStatus, result: Optional[Dict[str, Any]] = None,
+                error: Optional[str] = None):
+        job.status = status
+        job.finished_at = time.time()
+        job.result = result
+        job.error = error
+        if status == JobStatus.SUCCEEDED:
+            job.progress = 1.0
+            self.completed += 1
+        elif status == JobStatus.FAILED:
+            self.failed += 1
+        else:
+            self.cancelled += 1
+        job.stage = status.value
+        job.publish()
+        logger.info(f"Job {job.id} {status.value}")
+
+    def _prune(self):
+        """Forget finished jobs past their TTL, and the oldest beyond JOB_MAX_RETAINED."""
+        now = time.time()
+        finished = sorted(
+            (job for job in self.jobs.values() if job.done),
+            key=lambda job: job.finished_at or 0,
+        )
+        excess = max(0, len(self.jobs) - JOB_MAX_RETAINED)
+        for job in finished:
+            if excess > 0 or now - (job.finished_at or now) > JOB_RESULT_TTL_SECONDS:
+                del self.jobs[job.id]
+                excess -= 1
@@ -0,0 +1,301 @@
+"""
+Vectorized lens character effects.
+
+The whole effect chain runs on one float32 copy of the frame and is quantized
+back to uint8 once:
+
+    chromatic aberration -> highlight bokeh + flare -> vignette -> softness/contrast
+
+- Chromatic aberration scales the red and blue channels radially about the
+  optical centre (one affine warp per channel).
+- Bokeh and flare both start from the same highlight mask. It is computed once
+  per image at quarter resolution, convolved with the bokeh kernel (circular,
+  oval, hexagonal, swirly) and a glow/streak kernel, then upsampled and added.
+- Vignette masks depend only on (size, strength); the last two are cached,
+  which covers the quarter- and full-resolution masks of one request.
+
+Every per-pixel step works in full-image coordinates, so a large frame can be
+rendered as overlapping tiles (see tiling.py) with the same result.
+
+Works on HxWx3 uint8 RGB arrays; PIL images are converted by the caller.
+"""
+
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger("gpu-worker.lens-effects")
+
+BOKEH_SHAPES = ("circular", "oval", "hexagonal", "swirly")
+HIGHLIGHT_THRESHOLD = 0.8
+EFFECT_SCALE = 4  # bokeh/flare are computed at 1/EFFECT_SCALE resolution
+
+
+@dataclass(frozen=True)
+class LensProfile:
+    softness: float  # gaussian sigma in pixels at 1080p
+    contrast: float  # PIL ImageEnhance.Contrast factor
+    bokeh_amount: float  # highlight bloom added through the bokeh kernel
+    flare_tint: Tuple[float, float, float]
+    streak: bool  # anamorphic horizontal flare streak
+
+
+LENS_PROFILES = {
+    "vintage": LensProfile(softness=0.5, contrast=0.95, bokeh_amount=0.6, flare_tint=(1.0, 0.85, 0.65), streak=False),
+    "anamorphic": LensProfile(softness=0.0, contrast=1.0, bokeh_amount=0.5, flare_tint=(0.55, 0.75, 1.0), streak=True),
+    "modern": LensProfile(softness=0.0, contrast=1.02, bokeh_amount=0.3, flare_tint=(1.0, 1.0, 1.0), streak=False),
+    "classic": LensProfile(softness=0.3, contrast=0.97, bokeh_amount=0.45, flare_tint=(1.0, 0.92, 0.8), streak=False),
+}
+# Unknown lens types get no lens-specific character, only the requested effects
+NEUTRAL_PROFILE = LensProfile(softness=0.0, contrast=1.0, bokeh_amount=0.0, flare_tint=(1.0, 1.0, 1.0), streak=False)
+
+
+def _vignette(height: int, width: int, strength: float, y0: int, y1: int, x0: int, x1: int):
+    """Vignette multiplier for rows y0:y1, columns x0:x1 of a height x width frame."""
+    import numpy as np
+
+    y = np.linspace(-1, 1, height, dtype=np.float32)[y0:y1]
+    x = np.linspace(-1, 1, width, dtype=np.float32)[x0:x1]
+    mask = np.add.outer(y * y, x * x)  # broadcasted r^2, no meshgrid
+    np.sqrt(mask, out=mask)
+    mask *= -0.5 * strength
+    mask += 1.0
+    np.clip(mask, 0.0, 1.0, out=mask)
+    return mask[:, :, None]
+
+
+@lru_cache(maxsize=2)  # full-resolution masks are large (~33MB at 4K)
+def vignette_mask(height: int, width: int, strength: float):
+    """
+    Read-only float32 (H, W, 1) multiplier: 1 - r * strength / 2, clipped to [0, 1],
+    with r the distance from the centre in [-1, 1] normalized coordinates.
+    """
+    mask = _vignette(height, width, strength, 0, height, 0, width)
+    mask.setflags(write=False)
+    return mask
+
+
+@lru_cache(maxsize=32)
+def bokeh_kernel(shape: str, radius: int):
+    """Normalized float32 kernel whose footprint is the bokeh shape."""
+    import cv2
+    import numpy as np
+
+    size = 2 * radius + 1
+    y, x = np.mgrid[-radius:radius + 1, -radius:radius + 1].astype(np.float32) / max(radius, 1)
+    if shape == "circular":
+        kernel = (x * x + y * y <= 1.0).astype(np.float32)
+    elif shape == "oval":
+        # Anamorphic squeeze: twice as tall as wide
+        kernel = ((2 * x) ** 2 + y * y <= 1.0).astype(np.float32)
+    elif shape == "hexagonal":
+        kernel = np.zeros((size, size), dtype=np.float32)
+        angles = np.linspace(0, 2 * np.pi, 7)[:-1] + np.pi / 6
+        points = np.stack([np.cos(angles), np.sin(angles)], axis=1) * radius + radius
+        cv2.fillConvexPoly(kernel, np.round(points).astype(np.int32), 1.0)
+    elif shape == "swirly":
+        # Soap-bubble bokeh: bright rim, dim centre
+        r = np.sqrt(x * x + y * y)
+        kernel = np.where(r <= 1.0, 0.35 + 0.65 * np.clip((r - 0.6) / 0.4, 0, 1), 0).astype(np.float32)
+    else:
+        raise ValueError(f"Unknown bokeh shape: {shape}. Available: {list(BOKEH_SHAPES)}")
+    kernel /= kernel.sum()
+    return kernel
+
+
+@lru_cache(maxsize=8)
+def _streak_kernel(length: int):
+    import numpy as np
+
+    kernel = np.exp(-np.abs(np.linspace(-3, 3, length, dtype=np.float32)))[None, :]
+    return kernel / kernel.sum()
+
+
+def _chromatic_aberration(frame, strength: float, center: Tuple[float, float]):
+    """Scale red outward and blue inward about `center` (in frame pixels), in place."""
+    import cv2
+    import numpy as np
+
+    height, width = frame.shape[:2]
+    shift = 0.004 * strength  # ~0.4% radial misregistration at full strength
+    for channel, scale in ((0, 1.0 + shift), (2, 1.0 - shift)):
+        matrix = cv2.getRotationMatrix2D(center, 0.0, scale)
+        frame[:, :, channel] = cv2.warpAffine(
+            np.ascontiguousarray(frame[:, :, channel]), matrix, (width, height),
+            flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT,
+        )
+
+
+def _highlight_layer(small, profile: LensProfile, bokeh_shape: str, flare_intensity: float):
+    """Bokeh bloom plus flare glow/streak from a downscaled frame's highlights, at that scale."""
+    import cv2
+    import numpy as np
+
+    luma = small @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    weight = np.clip((luma - HIGHLIGHT_THRESHOLD) / (1.0 - HIGHLIGHT_THRESHOLD), 0.0, 1.0)
+    highlights = small * weight[:, :, None]
+
+    short_side = min(small.shape[:2])
+    added = np.zeros_like(highlights)
+    if profile.bokeh_amount > 0:
+        radius = max(2, int(short_side * 0.02))
+        added += profile.bokeh_amount * cv2.filter2D(highlights, -1, bokeh_kernel(bokeh_shape, radius))
+    if flare_intensity > 0:
+        flare = cv2.GaussianBlur(highlights, (0, 0), sigmaX=max(1.0, short_side * 0.03))
+        if profile.streak:
+            length = max(3, int(small.shape[1] * 0.25)) | 1
+            flare += 2.0 * cv2.filter2D(highlights, -1, _streak_kernel(length))
+        flare *= np.asarray(profile.flare_tint, dtype=np.float32) * flare_intensity
+        added += flare
+    return added
+
+
+class LensCharacter:
+    """
+    A lens profile prepared for one image.
+
+    Everything that needs the whole frame is computed once here, from a
+    1/EFFECT_SCALE copy: the highlight (bokeh + flare) layer and the mean
+    luminance for contrast. `render` then works on any region of the frame
+    in full-image coordinates, so tiles of a large image match the
+    whole-image result.
+    """
+
+    def __init__(self, rgb, lens_type: str = "vintage", bokeh_shape: str = "circular",
+                 aberration_strength: float = 0.0, flare_intensity: float = 0.0, vignette_strength: float = 0.0):
+        import cv2
+        import numpy as np
+
+        profile = LENS_PROFILES.get(lens_type)
+        if profile is None:
+            logger.warning(f"Unknown lens type {lens_type!r}, using a neutral lens. Available: {list(LENS_PROFILES)}")
+            profile = NEUTRAL_PROFILE
+        if bokeh_shape not in BOKEH_SHAPES:
+            logger.warning(f"Unknown bokeh shape {bokeh_shape!r}, using circular. Available: {list(BOKEH_SHAPES)}")
+            bokeh_shape = "circular"
+
+        self.profile = profile
+        self.height, self.width = rgb.shape[:2]
+        self.aberration_strength = aberration_strength
+        self.vignette_strength = round(vignette_strength, 3)
+        self.applied: List[str] = []
+
+        small_size = (max(1, self.width // EFFECT_SCALE), max(1, self.height // EFFECT_SCALE))
+        small = cv2.resize(np.asarray(rgb), small_size, interpolation=cv2.INTER_AREA).astype(np.float32)
+        small *= np.float32(1 / 255)
+
+        if aberration_strength > 0:
+            self.applied.append("chromatic_aberration")
+
+        self.highlights = None
+        if profile.bokeh_amount > 0 or flare_intensity > 0:
+            self.highlights = _highlight_layer(small, profile, bokeh_shape, flare_intensity)
+            small += self.highlights
+            self.applied.append(f"bokeh_{bokeh_shape}")
+            if flare_intensity > 0:
+                self.applied.append("anamorphic_flare" if profile.streak else "flare")
+
+        if self.vignette_strength > 0:
+            small *= vignette_mask(small_size[1], small_size[0], self.vignette_strength)
+            self.applied.append("vignette")
+
+        self.sigma = profile.softness * max(self.height, self.width) / 1920
+        self.soften = profile.softness > 0 and self.sigma >= 0.3
+        if self.soften:
+            self.applied.append("softness")
+
+        # ImageEnhance.Contrast blends towards the mean luminance of the whole frame
+        self.mean = float(cv2.mean(cv2.cvtColor(small, cv2.COLOR_RGB2GRAY))[0])
+        if profile.contrast != 1.0:
+            self.applied.append("contrast")
+
+    def render(self, region, y0: int = 0, x0: int = 0) -> "np.ndarray":
+        """
+        Apply the lens to `region`, the HxWx3 uint8 pixels at (y0, x0) of the
+        frame. Returns float32 in 0-255, not yet quantized.
+        """
+        import cv2
+        import numpy as np
+        from tiling import upsample_region
+
+        frame = np.asarray(region, dtype=np.float32) * np.float32(1 / 255)
+        height, width = frame.shape[:2]
+
+        if self.aberration_strength > 0:
+            center = ((self.width - 1) / 2 - x0, (self.height - 1) / 2 - y0)
+            _chromatic_aberration(frame, self.aberration_strength, center)
+
+        if self.highlights is not None:
+            frame += upsample_region(self.highlights, self.height, self.width, y0, y0 + height, x0, x0 + width)
+
+        if self.vignette_strength > 0:
+            if (height, width) == (self.height, self.width):
+                frame *= vignette_mask(height, width, self.vignette_strength)
+            else:
+                frame *= _vignette(self.height, self.width, self.vignette_strength,
+                                   y0, y0 + height, x0, x0 + width)
+
+        if self.soften:
+            frame = cv2.GaussianBlur(frame, (0, 0), sigmaX=self.sigma)
+
+        if self.profile.contrast != 1.0:
+            frame *= self.profile.contrast
+            frame += self.mean * (1.0 - self.profile.contrast)
+
+        frame *= 255.0
+        return frame
+
+
+def apply_lens_character(
+    rgb,
+    lens_type: str = "vintage",
+    bokeh_shape: str = "circular",
+    aberration_strength: float = 0.0,
+    flare_intensity: float = 0.0,
+    vignette_strength: float = 0.0,
+) -> Tuple["np.ndarray", List[str]]:
+    """
+    Apply a lens profile to an HxWx3 uint8 RGB array.
+
+    Returns the processed uint8 array and the names of the effects applied.
+    Large frames can instead be rendered tile by tile through LensCharacter.
+    """
+    import numpy as np
+
+    lens = LensCharacter(rgb, lens_type, bokeh_shape, aberration_strength, flare_intensity, vignette_strength)
+    frame = lens.render(rgb)
+    frame += 0.5
+    np.clip(frame, 0, 255, out=frame)
+    return frame.astype(np.uint8), lens.applied
+
+
+def sharpen(region, sharpness: float) -> "np.ndarray":
+    """
+    ImageEnhance.Sharpness on an HxWx3 uint8 array: extrapolate away from
+    PIL's SMOOTH-filtered image by `sharpness`.
+
+    Matches PIL exactly: the smoothed image is rounded to uint8, its edge
+    pixels are left unfiltered, and the blend is truncated. For a tile's
+    padded region the edges are either image edges or halo that is cropped
+    off, so tiled and whole-image results agree. Returns float32 holding
+    whole numbers in 0-255.
+    """
+    import cv2
+    import numpy as np
+
+    frame = region.astype(np.float32)
+    kernel = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+    smooth = cv2.filter2D(frame, -1, kernel, borderType=cv2.BORDER_REPLICATE)
+    np.floor(smooth + 0.5, out=smooth)
+    smooth[[0, -1]] = frame[[0, -1]]
+    smooth[:, [0, -1]] = frame[:, [0, -1]]
+    frame -= smooth
+    frame *= sharpness
+    frame += smooth
+    np.clip(frame, 0, 255, out=frame)
+    np.floor(frame, out=frame)
+    return frame
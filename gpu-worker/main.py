@@ -17,26 +17,110 @@ Deployment targets:
 import os
 import io
 import gc
+import json
+import asyncio
 import base64
 import logging
 import time
-from typing import Optional, Dict, Any
-from contextlib import asynccontextmanager
-
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+import sys
+import shutil
+import itertools
+import threading
+import importlib.util
+import subprocess
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Optional, Dict, Any, List
+from contextlib import asynccontextmanager, contextmanager
+
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
-import httpx
-import torch
+import anyio
 from PIL import Image
 
+from executors import get_executor, executor_stats, shutdown_executors
+from depth_batcher import DepthBatcher
+from depth_cache import DepthCache, depth_cache_key
+from warmup import FirstRequestTimer, Warmup, WARMUP_FORWARD, parse_preload_models
+from jobs import JobQueue, JobStatus, check_cancelled, diffusers_progress_callback, report_progress
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, labelled, record_model_load, registry as metrics_registry, stage_timer
+from output_stage import EncodedOutput, OutputStage, check_format, depth_finalizer, quantize_depth
+from profiling import Profile, ProfileMiddleware, current_profile, profiled, requested as profile_requested
+from storage import ArtifactStore, DataUrlWriter, FallbackWriter, ObjectUploader
+from video_encoder import FrameStreamEncoder
+
+if TYPE_CHECKING:
+    import httpx
+
+# torch, httpx, numpy, transformers and diffusers are imported where they are
+# first used. Importing torch alone takes seconds, and /live, /ready, /health,
+# /models and job routing must answer without it.
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("gpu-worker")
 
+
+def _nvidia_driver_present() -> bool:
+    """Cheap CUDA check that doesn't import torch: is the NVIDIA driver loaded?"""
+    if os.getenv("CUDA_VISIBLE_DEVICES", None) in ("", "-1"):
+        return False
+    return os.path.exists("/proc/driver/nvidia/version") or os.path.exists("/dev/nvidia0")
+
+
+def _cuda_available() -> bool:
+    """torch.cuda.is_available(), or False if torch hasn't been imported yet."""
+    torch = sys.modules.get("torch")
+    return torch is not None and torch.cuda.is_available()
+
+
+_gpu_info_cache: Optional[Dict[str, Any]] = None
+
+
+def _gpu_info() -> Optional[Dict[str, Any]]:
+    """
+    Name and total memory of GPU 0.
+
+    Uses torch once it is loaded, otherwise asks nvidia-smi (once), so health
+    checks on a cold worker don't pay for the torch import.
+    """
+    global _gpu_info_cache
+    if not DEVICE.startswith("cuda"):
+        return None
+    if _cuda_available():
+        torch = sys.modules["torch"]
+        props = torch.cuda.get_device_properties(0)
+        return {"name": props.name, "total_bytes": props.total_memory}
+    if _gpu_info_cache is None:
+        _gpu_info_cache = {}
+        binary = shutil.which("nvidia-smi")
+        if binary:
+            try:
+                output = subprocess.run(
+                    [binary, "--query-gpu=name,memory.total", "--format=csv,noheader,nounits", "-i", "0"],
+                    capture_output=True, text=True, timeout=10, check=True,
+                ).stdout
+                name, total_mib = (part.strip() for part in output.strip().split(","))
+                _gpu_info_cache = {"name": name, "total_bytes": int(total_mib) * 1024**2}
+            except (OSError, subprocess.SubprocessError, ValueError) as e:
+                logger.warning(f"nvidia-smi query failed: {e}")
+    return _gpu_info_cache or None
+
+
+def gpu_status() -> Dict[str, Any]:
+    """Device and GPU identity for health responses, without importing torch."""
+    gpu = _gpu_info()
+    return {
+        "device": DEVICE,
+        "gpu_available": gpu is not None,
+        "gpu_name": gpu.get("name") if gpu else None,
+    }
+
+
 # Environment configuration
-DEVICE = os.getenv("DEVICE", "cuda" if torch.cuda.is_available() else "cpu")
+DEVICE = os.getenv("DEVICE", "cuda" if _nvidia_driver_present() else "cpu")
 MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "/tmp/models")
 VIBEBOARD_BACKEND_URL = os.getenv("VIBEBOARD_BACKEND_URL", "http://localhost:3001")
 HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN", "")
@@ -46,55 +130,273 @@ R2_ACCOUNT_ID = os.getenv("R2_ACCOUNT_ID", "")
 R2_ACCESS_KEY = os.getenv("R2_ACCESS_KEY", "")
 R2_SECRET_KEY = os.getenv("R2_SECRET_KEY", "")
 R2_BUCKET = os.getenv("R2_BUCKET", "vibeboard-assets")
+R2_ENDPOINT_URL = os.getenv("R2_ENDPOINT_URL", "")  # e.g. a local MinIO; defaults to the R2 account endpoint
+R2_PUBLIC_URL = os.getenv("R2_PUBLIC_URL", "")  # public base URL for uploaded objects
+UPLOAD_PART_SIZE_MB = float(os.getenv("UPLOAD_PART_SIZE_MB", "8"))
+UPLOAD_MAX_CONCURRENCY = int(os.getenv("UPLOAD_MAX_CONCURRENCY", "4"))
+
+# Local artifact store, used when R2 isn't configured ("base64" restores data: URLs)
+ARTIFACT_FALLBACK = os.getenv("ARTIFACT_FALLBACK", "local").lower()
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "/tmp/artifacts")
+ARTIFACT_TTL_SECONDS = float(os.getenv("ARTIFACT_TTL_SECONDS", "3600"))
+ARTIFACT_MAX_GB = float(os.getenv("ARTIFACT_MAX_GB", "10"))
+ARTIFACT_CLEANUP_INTERVAL_SECONDS = float(os.getenv("ARTIFACT_CLEANUP_INTERVAL_SECONDS", "300"))
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", f"http://localhost:{os.getenv('PORT', '8000')}")
+
+# Outbound image fetches
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(64 * 1024**2)))
+FETCH_TIMEOUT_SECONDS = float(os.getenv("FETCH_TIMEOUT_SECONDS", "30"))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "32"))
+
+# Model cache budget (0 = 90% of VRAM on GPU, half of system RAM on CPU)
+MODEL_CACHE_BUDGET_GB = float(os.getenv("MODEL_CACHE_BUDGET_GB", "0"))
+
+# Expected footprint used to make room before a model's first load.
+# Replaced by the measured size once the model has been loaded.
+MODEL_SIZE_HINTS_GB = {
+    "midas": 1.4,
+    "depth_anything": 0.1,
+    "wan_t2v": 8.0,
+    "wan_i2v": 20.0,
+    "qwen_vl": 16.0,
+    "sam2": 4.0,
+}
+
+# Models stored in ModelManager.pipelines rather than ModelManager.models
+PIPELINE_MODELS = {"wan_t2v", "wan_i2v"}
+
+# Where evicted models go instead of being deleted: "host" (RAM), "disk" (snapshot)
+MODEL_OFFLOAD_TIERS = {
+    tier.strip() for tier in os.getenv("MODEL_OFFLOAD_TIERS", "host").split(",") if tier.strip()
+}
+MODEL_HOST_CACHE_GB = float(os.getenv("MODEL_HOST_CACHE_GB", "0"))  # 0 = 25% of system RAM
+MODEL_PIN_MEMORY = os.getenv("MODEL_PIN_MEMORY", "false").lower() == "true"
+MODEL_SNAPSHOT_DIR = os.getenv("MODEL_SNAPSHOT_DIR", os.path.join(MODEL_CACHE_DIR, "snapshots"))
 
 
 # ============================================================================
 # Model Manager - Dynamic VRAM Management
 # ============================================================================
 
+@dataclass
+class CacheEntry:
+    """A loaded model (and its companion objects, e.g. processors) held by the ModelManager."""
+    name: str
+    objects: Dict[str, Any]
+    is_pipeline: bool
+    size_bytes: int
+    loaded_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    hits: int = 0
+    leases: int = 0
+
+
+@dataclass
+class _PendingLoad:
+    """An in-flight load that concurrent callers for the same model wait on."""
+    event: threading.Event = field(default_factory=threading.Event)
+    error: Optional[BaseException] = None
+
+
+def _torch_modules(obj: Any):
+    """Yield the torch modules owned by a model or a diffusers pipeline."""
+    import torch
+
+    if isinstance(obj, torch.nn.Module):
+        yield obj
+    elif hasattr(obj, "components"):
+        for component in obj.components.values():
+            if isinstance(component, torch.nn.Module):
+                yield component
+
+
+def _system_memory_bytes() -> int:
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES"))
+    except (ValueError, OSError, AttributeError):
+        return 32 * 1024**3
+
+
+def _default_cache_budget() -> int:
+    """Resolve the model cache budget in bytes from env or the device capacity."""
+    if MODEL_CACHE_BUDGET_GB > 0:
+        return int(MODEL_CACHE_BUDGET_GB * 1024**3)
+    gpu = _gpu_info()
+    if gpu is None and DEVICE.startswith("cuda"):
+        import torch  # no nvidia-smi; ask torch
+        if torch.cuda.is_available():
+            gpu = {"total_bytes": torch.cuda.get_device_properties(0).total_memory}
+    if gpu:
+        return int(gpu["total_bytes"] * 0.9)
+    return int(_system_memory_bytes() * 0.5)
+
+
+def _default_host_budget() -> int:
+    """Resolve the host-RAM tier budget in bytes (0 disables the tier)."""
+    if "host" not in MODEL_OFFLOAD_TIERS:
+        return 0
+    if MODEL_HOST_CACHE_GB > 0:
+        return int(MODEL_HOST_CACHE_GB * 1024**3)
+    return int(_system_memory_bytes() * 0.25)
+
+
 class ModelManager:
     """
     Manages model loading/unloading for efficient VRAM usage.
 
     Strategy:
-    - Keep only one model family in VRAM at a time
     - Lazy load on first request
-    - Clear VRAM when switching model families
+    - Track the measured device footprint of every loaded model
+    - Keep models resident until a new load would exceed the cache budget,
+      then evict least-recently-used models until it fits
+    - Demote evicted models to host RAM, then to a local snapshot on disk,
+      so bringing them back costs a copy instead of a from_pretrained rebuild
+    - Single-flight loads and reference-counted leases, so concurrent requests
+      share one load and never lose a model mid-inference
     """
 
-    def __init__(self):
+    def __init__(self, budget_bytes: Optional[int] = None, host_budget_bytes: Optional[int] = None):
         self.current_model: Optional[str] = None
         self.models: Dict[str, Any] = {}
         self.pipelines: Dict[str, Any] = {}
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # Resolved on first use: sizing the GPU shouldn't slow down import
+        self._budget_bytes = budget_bytes
+        self.size_hints: Dict[str, int] = {
+            name: int(gb * 1024**3) for name, gb in MODEL_SIZE_HINTS_GB.items()
+        }
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Demotion tiers: host RAM (LRU, budgeted) and on-disk snapshots
+        self.host_entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.host_budget_bytes = (
+            host_budget_bytes if host_budget_bytes is not None else _default_host_budget()
+        )
+        self.snapshots: Dict[str, str] = {}
+        self.tier_timings: Dict[str, deque] = {}
+
+        # Guards all bookkeeping above; loads and demotions run outside it
+        self._lock = threading.RLock()
+        self._loading: Dict[str, _PendingLoad] = {}
+        # Models detached from a tier whose demotion is still running outside the lock
+        self._demoting: Dict[str, threading.Event] = {}
+        self.coalesced_loads = 0
+
+    @property
+    def budget_bytes(self) -> int:
+        if self._budget_bytes is None:
+            self._budget_bytes = _default_cache_budget()
+        return self._budget_bytes
+
+    @budget_bytes.setter
+    def budget_bytes(self, value: int):
+        self._budget_bytes = value
 
     def get_vram_usage(self) -> Dict[str, int]:
         """Get current VRAM usage in GB."""
-        if not torch.cuda.is_available():
-            return {"total": 0, "allocated": 0, "cached": 0}
+        if not _cuda_available():
+            # Nothing is allocated before torch loads; report capacity if known
+            gpu = _gpu_info()
+            return {"total": gpu["total_bytes"] // (1024**3) if gpu else 0, "allocated": 0, "cached": 0}
+        import torch
+
         return {
             "total": torch.cuda.get_device_properties(0).total_memory // (1024**3),
             "allocated": torch.cuda.memory_allocated(0) // (1024**3),
             "cached": torch.cuda.memory_reserved(0) // (1024**3),
         }
 
-    def clear_vram(self):
-        """Clear all models from VRAM."""
+    def used_bytes(self) -> int:
+        """Total measured footprint of all cached models."""
+        return sum(entry.size_bytes for entry in self.entries.values())
+
+    def host_used_bytes(self) -> int:
+        """Total footprint of models demoted to host RAM."""
+        return sum(entry.size_bytes for entry in self.host_entries.values())
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Cache occupancy, hit/miss/eviction counters and per-tier timings."""
+        with self._lock:
+            return self._cache_stats()
+
+    def _cache_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "budget_mb": self.budget_bytes // (1024**2),
+            "used_mb": self.used_bytes() // (1024**2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced_loads": self.coalesced_loads,
+            "loading": list(self._loading.keys()),
+            "demoting": list(self._demoting.keys()),
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "entries": [
+                {
+                    "name": entry.name,
+                    "size_mb": entry.size_bytes // (1024**2),
+                    "hits": entry.hits,
+                    "leases": entry.leases,
+                    "idle_seconds": round(time.time() - entry.last_used, 1),
+                }
+                for entry in self.entries.values()
+            ],
+            "host": {
+                "budget_mb": self.host_budget_bytes // (1024**2),
+                "used_mb": self.host_used_bytes() // (1024**2),
+                "pinned": MODEL_PIN_MEMORY and _cuda_available(),
+                "entries": list(self.host_entries.keys()),
+            },
+            "disk": {
+                "enabled": "disk" in MODEL_OFFLOAD_TIERS,
+                "snapshots": list(self.snapshots.keys()),
+            },
+            "timings_ms": {
+                name: {
+                    "count": len(samples),
+                    "last": round(samples[-1], 1),
+                    "avg": round(sum(samples) / len(samples), 1),
+                }
+                for name, samples in self.tier_timings.items()
+                if samples
+            },
+        }
+
+    def clear_vram(self, demote: bool = True):
+        """
+        Clear all models from VRAM.
+
+        With `demote`, models move down the offload tiers so they can be
+        re-promoted cheaply; otherwise every tier is dropped. Models leased
+        by an in-flight request stay loaded until their lease is released.
+        """
         logger.info("Clearing VRAM...")
-        for name in list(self.models.keys()):
-            del self.models[name]
-        for name in list(self.pipelines.keys()):
-            del self.pipelines[name]
-        self.models.clear()
-        self.pipelines.clear()
-        self.current_model = None
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        with self._lock:
+            victims = [
+                self._detach(name)
+                for name, entry in list(self.entries.items())
+                if not entry.leases
+            ]
+            in_use = list(self.entries.keys())
+            if not demote:
+                for name in self.host_entries:
+                    self._mark_demoting(name)
+                victims.extend(self.host_entries.values())
+                self.host_entries.clear()
+        if in_use:
+            logger.info(f"Keeping leased models loaded: {in_use}")
+        self._retire(victims, demote=demote)
         logger.info(f"VRAM after clear: {self.get_vram_usage()}")
 
     def ensure_model(self, model_name: str) -> Any:
         """
-        Ensure a model is loaded, unloading others if necessary.
+        Ensure a model is loaded, evicting least-recently-used models if the
+        new load would not fit in the cache budget.
+
+        The model is not leased, so it may be evicted as soon as this returns;
+        request handlers should use `lease()` instead.
 
         Model families:
         - depth: MiDaS, ZoeDepth, Depth Anything
@@ -102,21 +404,323 @@ class ModelManager:
         - edit: Qwen-VL, SDXL Inpaint
         - video: Wan 2.1
         """
-        model_family = self._get_model_family(model_name)
-        current_family = self._get_model_family(self.current_model) if self.current_model else None
+        objects = self.acquire(model_name)
+        self.release(model_name)
+        return objects.get(model_name)
+
+    @contextmanager
+    def lease(self, model_name: str):
+        """
+        Hold a model for the duration of a block, yielding its cached objects
+        (e.g. `{"midas": model, "midas_processor": processor}`).
+
+        A leased model is never evicted or demoted, so inference can't have its
+        weights pulled out from under it by a concurrent load or clear_vram().
+        """
+        objects = self.acquire(model_name)
+        try:
+            yield objects
+        finally:
+            self.release(model_name)
+
+    def acquire(self, model_name: str) -> Dict[str, Any]:
+        """
+        Load (or promote) a model and take a lease on it.
+
+        Loading is single-flight: concurrent callers for the same model wait
+        for the first caller's load instead of starting their own. A model
+        that is being demoted is waited for too, then promoted from the tier
+        it landed in.
+        """
+        while True:
+            with self._lock:
+                entry = self.entries.get(model_name)
+                if entry is not None:
+                    self.entries.move_to_end(model_name)
+                    entry.last_used = time.time()
+                    entry.hits += 1
+                    entry.leases += 1
+                    self.hits += 1
+                    self.current_model = model_name
+                    return entry.objects
+
+                demoting = self._demoting.get(model_name)
+                pending = self._loading.get(model_name) if demoting is None else None
+                if demoting is None and pending is None:
+                    pending = _PendingLoad()
+                    self._loading[model_name] = pending
+                    self.misses += 1
+                    # Take the model out of the host tier now, so demoting the victims
+                    # below can't spill it to disk (or drop it) before it is promoted
+                    host_entry = self.host_entries.pop(model_name, None)
+                    victims = self._make_room(self.size_hints.get(model_name, 0))
+                    break
+                if pending is not None:
+                    self.coalesced_loads += 1
+
+            if demoting is not None:
+                # Not in any tier until its demotion finishes; a cold load now would duplicate it
+                demoting.wait()
+                continue
+
+            # Another caller is loading this model; wait for it and retry
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+
+        try:
+            self._retire(victims)
+            objects = self._promote(model_name, host_entry)
+            if objects is None:
+                logger.info(f"Loading model: {model_name}")
+                started = time.perf_counter()
+                objects = self._load_model(model_name)
+                self._record_timing("cold_load", started)
+                record_model_load(model_name, "cold", time.perf_counter() - started)
+            if not objects:
+                return {}
+            with self._lock:
+                entry = self._register(model_name, objects)
+                entry.leases += 1
+                self.current_model = model_name
+                victims = self._make_room(0, keep=model_name)
+            self._retire(victims)
+            return entry.objects
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(model_name, None)
+            pending.event.set()
+
+    def release(self, model_name: str):
+        """Drop a lease taken by acquire(), trimming the cache if it ran over budget."""
+        with self._lock:
+            entry = self.entries.get(model_name)
+            if entry is not None and entry.leases > 0:
+                entry.leases -= 1
+            # Loads that happened while everything was leased may have overshot
+            victims = self._make_room(0)
+        self._retire(victims)
+
+    def _make_room(self, needed_bytes: int, keep: Optional[str] = None) -> List[CacheEntry]:
+        """
+        Detach unleased LRU entries until `needed_bytes` more fit in the budget.
+
+        Caller holds the lock; the detached entries must be passed to _retire()
+        after the lock is released.
+        """
+        victims = []
+        for name, entry in list(self.entries.items()):
+            if self.used_bytes() + needed_bytes <= self.budget_bytes:
+                break
+            if name == keep or entry.leases:
+                continue
+            victims.append(self._detach(name))
+        if self.used_bytes() + needed_bytes > self.budget_bytes and needed_bytes:
+            logger.warning(f"Cache budget exceeded: remaining models are leased "
+                           f"({[e.name for e in self.entries.values() if e.leases]})")
+        return victims
+
+    def _register(self, model_name: str, objects: Dict[str, Any]) -> CacheEntry:
+        """Record a freshly loaded model and publish it to models/pipelines (lock held)."""
+        is_pipeline = model_name in PIPELINE_MODELS
+        size_bytes = self._measure_bytes(objects)
+        entry = CacheEntry(
+            name=model_name,
+            objects=objects,
+            is_pipeline=is_pipeline,
+            size_bytes=size_bytes,
+        )
+        self.entries[model_name] = entry
+        self.size_hints[model_name] = size_bytes
+        (self.pipelines if is_pipeline else self.models).update(objects)
+        logger.info(f"Cached {model_name}: {size_bytes / 1024**2:.0f}MB "
+                    f"({self.used_bytes() / 1024**2:.0f}/{self.budget_bytes / 1024**2:.0f}MB used)")
+        return entry
+
+    def _detach(self, model_name: str) -> CacheEntry:
+        """Remove a model from the device tier and the public dicts (lock held)."""
+        entry = self.entries.pop(model_name)
+        store = self.pipelines if entry.is_pipeline else self.models
+        for key in entry.objects:
+            store.pop(key, None)
+        self.evictions += 1
+        self._mark_demoting(model_name)
+        if self.current_model == model_name:
+            self.current_model = None
+        logger.info(f"Evicted {model_name} ({entry.size_bytes / 1024**2:.0f}MB)")
+        return entry
+
+    def _retire(self, victims: List[CacheEntry], demote: bool = True):
+        """Demote or drop detached entries, then reclaim their memory (lock not held)."""
+        if not victims:
+            return
+        for entry in victims:
+            try:
+                if demote:
+                    self._demote(entry)
+                else:
+                    entry.objects.clear()
+            finally:
+                self._finish_demoting(entry.name)
+        self._release_memory()
+
+    def _mark_demoting(self, model_name: str):
+        """Record that a detached model is on its way down the tiers (lock held)."""
+        self._demoting.setdefault(model_name, threading.Event())
+
+    def _finish_demoting(self, model_name: str):
+        """Wake acquire() callers waiting for a model's demotion to finish."""
+        with self._lock:
+            event = self._demoting.pop(model_name, None)
+        if event is not None:
+            event.set()
+
+    def _demote(self, entry: CacheEntry):
+        """Move an evicted entry to host RAM, falling back to a disk snapshot."""
+        if self.host_budget_bytes > 0:
+            movable = self._is_movable(entry.objects)
+            # Hooked models (device_map/offload) can't be moved; keep them only
+            # if they hold no device memory already, e.g. CPU-offloaded pipelines.
+            if movable or self._measure_bytes(entry.objects) == 0:
+                started = time.perf_counter()
+                if movable:
+                    self._move_objects(entry.objects, "cpu")
+                    if MODEL_PIN_MEMORY and _cuda_available():
+                        self._pin_objects(entry.objects)
+                self._record_timing("demote_host", started)
+                entry.size_bytes = self._measure_bytes(entry.objects, device_type="cpu")
+                with self._lock:
+                    self.host_entries[entry.name] = entry
+                    overflow = []
+                    while self.host_entries and self.host_used_bytes() > self.host_budget_bytes:
+                        spilled = self.host_entries.popitem(last=False)[1]
+                        self._mark_demoting(spilled.name)
+                        overflow.append(spilled)
+                for spilled in overflow:
+                    try:
+                        self._demote_to_disk(spilled)
+                    finally:
+                        self._finish_demoting(spilled.name)
+                return
+        self._demote_to_disk(entry)
+
+    def _demote_to_disk(self, entry: CacheEntry):
+        """
+        Snapshot a model to MODEL_SNAPSHOT_DIR and drop it from memory.
+
+        Pipelines are simply dropped: their from_pretrained weights are already
+        on local disk and a pickled pipeline would carry its offload hooks.
+        Snapshots are written once per process, since inference never changes weights.
+        """
+        can_snapshot = (
+            "disk" in MODEL_OFFLOAD_TIERS
+            and not entry.is_pipeline
+            and self._is_movable(entry.objects)
+        )
+        if can_snapshot and entry.name not in self.snapshots:
+            import torch
+
+            started = time.perf_counter()
+            try:
+                os.makedirs(MODEL_SNAPSHOT_DIR, exist_ok=True)
+                path = os.path.join(MODEL_SNAPSHOT_DIR, f"{entry.name}.pt")
+                torch.save(entry.objects, f"{path}.tmp")
+                os.replace(f"{path}.tmp", path)
+                self.snapshots[entry.name] = path
+                self._record_timing("demote_disk", started)
+            except Exception as e:
+                logger.warning(f"Snapshot of {entry.name} failed, dropping instead: {e}")
+        entry.objects.clear()
+
+    def _promote(self, model_name: str, entry: Optional[CacheEntry] = None) -> Optional[Dict[str, Any]]:
+        """
+        Bring a demoted model back to DEVICE, or return None if it needs a cold load.
+
+        `entry` is the model's host-tier entry, already removed from
+        host_entries by the caller.
+        """
+        if entry is not None:
+            started = time.perf_counter()
+            if self._is_movable(entry.objects):
+                self._move_objects(entry.objects, DEVICE)
+            self._record_timing("promote_host", started)
+            record_model_load(model_name, "host", time.perf_counter() - started)
+            logger.info(f"Promoted {model_name} from host RAM")
+            return entry.objects
+
+        path = self.snapshots.get(model_name)
+        if path and os.path.exists(path):
+            import torch
+
+            started = time.perf_counter()
+            try:
+                objects = torch.load(path, map_location="cpu", weights_only=False, mmap=True)
+            except Exception as e:
+                logger.warning(f"Loading snapshot of {model_name} failed: {e}")
+                self.snapshots.pop(model_name, None)
+                return None
+            self._move_objects(objects, DEVICE)
+            self._record_timing("promote_disk", started)
+            record_model_load(model_name, "disk", time.perf_counter() - started)
+            logger.info(f"Promoted {model_name} from disk snapshot")
+            return objects
+
+        return None
+
+    def _is_movable(self, objects: Dict[str, Any]) -> bool:
+        """False if any module carries accelerate hooks (device_map or CPU offload)."""
+        return not any(
+            hasattr(module, "_hf_hook")
+            for obj in objects.values()
+            for root in _torch_modules(obj)
+            for module in root.modules()
+        )
+
+    def _move_objects(self, objects: Dict[str, Any], device: str):
+        import torch
+
+        for obj in objects.values():
+            if isinstance(obj, torch.nn.Module) or hasattr(obj, "components"):
+                obj.to(device)
+        self._synchronize()
+
+    def _pin_objects(self, objects: Dict[str, Any]):
+        """Page-lock host copies so re-promotion is a fast async DMA."""
+        for obj in objects.values():
+            for module in _torch_modules(obj):
+                for tensor in itertools.chain(module.parameters(), module.buffers()):
+                    if tensor.device.type == "cpu" and not tensor.is_pinned():
+                        tensor.data = tensor.data.pin_memory()
 
-        # If switching families, clear VRAM first
-        if current_family and current_family != model_family:
-            logger.info(f"Switching model family: {current_family} -> {model_family}")
-            self.clear_vram()
+    def _synchronize(self):
+        if _cuda_available():
+            sys.modules["torch"].cuda.synchronize()
 
-        # Load model if not already loaded
-        if model_name not in self.models:
-            logger.info(f"Loading model: {model_name}")
-            self._load_model(model_name)
+    def _record_timing(self, name: str, started: float):
+        samples = self.tier_timings.setdefault(name, deque(maxlen=100))
+        samples.append((time.perf_counter() - started) * 1000)
 
-        self.current_model = model_name
-        return self.models.get(model_name) or self.pipelines.get(model_name)
+    def _release_memory(self):
+        gc.collect()
+        if _cuda_available():
+            sys.modules["torch"].cuda.empty_cache()
+
+    def _measure_bytes(self, objects: Dict[str, Any], device_type: Optional[str] = None) -> int:
+        """Bytes of parameters and buffers that live on `device_type` (default: DEVICE)."""
+        device_type = device_type or DEVICE.split(":")[0]
+        seen = set()
+        total = 0
+        for obj in objects.values():
+            for module in _torch_modules(obj):
+                for tensor in itertools.chain(module.parameters(), module.buffers()):
+                    if tensor.device.type != device_type or id(tensor) in seen:
+                        continue
+                    seen.add(id(tensor))
+                    total += tensor.numel() * tensor.element_size()
+        return total
 
     def _get_model_family(self, model_name: Optional[str]) -> Optional[str]:
         """Determine model family for VRAM management."""
@@ -136,29 +740,30 @@ class ModelManager:
                 return family
         return "other"
 
-    def _load_model(self, model_name: str):
-        """Load a specific model into VRAM."""
+    def _load_model(self, model_name: str) -> Dict[str, Any]:
+        """Load a specific model into VRAM, returning the objects to cache."""
         try:
             if model_name == "midas":
-                self._load_midas()
+                return self._load_midas()
             elif model_name == "depth_anything":
-                self._load_depth_anything()
+                return self._load_depth_anything()
             elif model_name == "wan_t2v":
-                self._load_wan_t2v()
+                return self._load_wan_t2v()
             elif model_name == "wan_i2v":
-                self._load_wan_i2v()
+                return self._load_wan_i2v()
             elif model_name == "qwen_vl":
-                self._load_qwen_vl()
+                return self._load_qwen_vl()
             elif model_name == "sam2":
-                self._load_sam2()
+                return self._load_sam2()
             else:
                 logger.warning(f"Unknown model: {model_name}")
+                return {}
 
         except Exception as e:
             logger.error(f"Failed to load model {model_name}: {e}")
             raise
 
-    def _load_midas(self):
+    def _load_midas(self) -> Dict[str, Any]:
         """Load MiDaS depth estimation model."""
         from transformers import DPTForDepthEstimation, DPTImageProcessor
 
@@ -171,11 +776,10 @@ class ModelManager:
             cache_dir=MODEL_CACHE_DIR,
         )
 
-        self.models["midas"] = model
-        self.models["midas_processor"] = processor
         logger.info("MiDaS loaded successfully")
+        return {"midas": model, "midas_processor": processor}
 
-    def _load_depth_anything(self):
+    def _load_depth_anything(self) -> Dict[str, Any]:
         """Load Depth Anything V2 model."""
         from transformers import AutoImageProcessor, AutoModelForDepthEstimation
 
@@ -188,12 +792,12 @@ class ModelManager:
             cache_dir=MODEL_CACHE_DIR,
         )
 
-        self.models["depth_anything"] = model
-        self.models["depth_anything_processor"] = processor
         logger.info("Depth Anything V2 loaded successfully")
+        return {"depth_anything": model, "depth_anything_processor": processor}
 
-    def _load_wan_t2v(self):
+    def _load_wan_t2v(self) -> Dict[str, Any]:
         """Load Wan 2.1 Text-to-Video pipeline."""
+        import torch
         from diffusers import WanPipeline
 
         pipe = WanPipeline.from_pretrained(
@@ -205,11 +809,12 @@ class ModelManager:
         # Enable memory optimizations
         pipe.enable_model_cpu_offload()
 
-        self.pipelines["wan_t2v"] = pipe
         logger.info("Wan 2.1 T2V loaded successfully")
+        return {"wan_t2v": pipe}
 
-    def _load_wan_i2v(self):
+    def _load_wan_i2v(self) -> Dict[str, Any]:
         """Load Wan 2.1 Image-to-Video pipeline."""
+        import torch
         from diffusers import WanImageToVideoPipeline
 
         pipe = WanImageToVideoPipeline.from_pretrained(
@@ -220,11 +825,12 @@ class ModelManager:
 
         pipe.enable_model_cpu_offload()
 
-        self.pipelines["wan_i2v"] = pipe
         logger.info("Wan 2.1 I2V loaded successfully")
+        return {"wan_i2v": pipe}
 
-    def _load_qwen_vl(self):
+    def _load_qwen_vl(self) -> Dict[str, Any]:
         """Load Qwen2-VL for vision-language tasks."""
+        import torch
         from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
 
         model = Qwen2VLForConditionalGeneration.from_pretrained(
@@ -238,73 +844,260 @@ class ModelManager:
             cache_dir=MODEL_CACHE_DIR,
         )
 
-        self.models["qwen_vl"] = model
-        self.models["qwen_vl_processor"] = processor
         logger.info("Qwen2-VL loaded successfully")
+        return {"qwen_vl": model, "qwen_vl_processor": processor}
 
-    def _load_sam2(self):
+    def _load_sam2(self) -> Dict[str, Any]:
         """Load SAM2 for segmentation."""
         # SAM2 requires specific setup - placeholder for now
         logger.warning("SAM2 loading not yet implemented - using placeholder")
-        self.models["sam2"] = None
+        return {"sam2": None}
 
 
 # Global model manager
 model_manager = ModelManager()
 
+LOADABLE_MODELS = ("depth_anything", "midas", "wan_t2v", "wan_i2v", "qwen_vl", "sam2")
+
+
+def _warmup_forward(model_name: str):
+    """Run one small dummy inference so kernel selection happens before real traffic."""
+    if model_name in DEPTH_MODELS:
+        _predict_depth_batch(model_name, [Image.new("RGB", (512, 512))])
+    elif model_name in PIPELINE_MODELS:
+        with model_manager.lease(model_name) as loaded:
+            kwargs = {"prompt": "warmup", "num_frames": 5, "num_inference_steps": 1, "output_type": "np"}
+            if model_name == "wan_i2v":
+                kwargs["image"] = Image.new("RGB", (256, 256))
+            else:
+                kwargs.update(height=256, width=256)
+            loaded[model_name](**kwargs)
+    # Other models only need loading until their handlers run inference
+
+
+warmup = Warmup(
+    parse_preload_models(os.getenv("PRELOAD_MODELS", "false"), LOADABLE_MODELS),
+    load=model_manager.ensure_model,
+    forward=_warmup_forward if WARMUP_FORWARD else None,
+)
+
 
 # ============================================================================
 # Storage Utilities
 # ============================================================================
 
+def _create_uploader() -> Optional[ObjectUploader]:
+    """Shared R2/S3 uploader, or None if storage isn't configured."""
+    if not ((R2_ACCOUNT_ID or R2_ENDPOINT_URL) and R2_ACCESS_KEY):
+        return None
+    return ObjectUploader(
+        endpoint_url=R2_ENDPOINT_URL or f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
+        access_key=R2_ACCESS_KEY,
+        secret_key=R2_SECRET_KEY,
+        bucket=R2_BUCKET,
+        # Public URL (requires bucket to be public)
+        public_url_base=R2_PUBLIC_URL or f"https://{R2_BUCKET}.{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
+        part_size=int(UPLOAD_PART_SIZE_MB * 1024**2),
+        max_concurrency=UPLOAD_MAX_CONCURRENCY,
+    )
+
+
+object_uploader = _create_uploader()
+artifact_store = ArtifactStore(
+    ARTIFACT_DIR,
+    ttl_seconds=ARTIFACT_TTL_SECONDS,
+    max_bytes=int(ARTIFACT_MAX_GB * 1024**3),
+    url_base=f"{PUBLIC_BASE_URL.rstrip('/')}/artifacts",
+)
+
+
+def storage_key(filename: str) -> str:
+    return f"gpu-worker/{int(time.time())}/{filename}"
+
+
 async def upload_to_storage(data: bytes, filename: str, content_type: str = "image/png") -> str:
     """
     Upload file to R2/S3 storage and return public URL.
-    Falls back to base64 encoding if storage not configured.
+    Falls back to the local artifact store (served from /artifacts/{id}) if
+    storage is not configured, and to base64 if that is disabled or fails.
     """
-    if R2_ACCOUNT_ID and R2_ACCESS_KEY:
-        try:
-            import boto3
-            from botocore.config import Config
-
-            s3 = boto3.client(
-                "s3",
-                endpoint_url=f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
-                aws_access_key_id=R2_ACCESS_KEY,
-                aws_secret_access_key=R2_SECRET_KEY,
-                config=Config(signature_version="s3v4"),
-            )
-
-            key = f"gpu-worker/{int(time.time())}/{filename}"
-            s3.put_object(
-                Bucket=R2_BUCKET,
-                Key=key,
-                Body=data,
-                ContentType=content_type,
-            )
+    with stage_timer("upload"):
+        return await _upload_to_storage(data, filename, content_type)
 
-            # Return public URL (requires bucket to be public)
-            return f"https://{R2_BUCKET}.{R2_ACCOUNT_ID}.r2.cloudflarestorage.com/{key}"
 
+async def _upload_to_storage(data: bytes, filename: str, content_type: str) -> str:
+    if object_uploader is not None:
+        try:
+            return await object_uploader.upload(data, storage_key(filename), content_type)
         except Exception as e:
             logger.error(f"R2 upload failed: {e}")
 
+    if ARTIFACT_FALLBACK == "local":
+        try:
+            return artifact_store.public_url(await artifact_store.store(data, filename))
+        except OSError as e:
+            logger.error(f"Local artifact write failed: {e}")
+
     # Fallback to base64
     return f"data:{content_type};base64,{base64.b64encode(data).decode()}"
 
 
+def open_output_stream(filename: str, content_type: str):
+    """
+    Writer for an output that is produced incrementally (e.g. encoded video).
+
+    Same destinations and fallbacks as upload_to_storage, but fed chunk by
+    chunk: `write()` as data is produced, `close()` returns the URL,
+    `abort()` discards. If R2 or the local store fails mid-stream, the output
+    is replayed into the next destination.
+    """
+    factories = []
+    if object_uploader is not None:
+        factories.append(lambda: object_uploader.open_stream(storage_key(filename), content_type))
+    if ARTIFACT_FALLBACK == "local":
+        factories.append(lambda: artifact_store.open_writer(filename))
+    if not factories:
+        return DataUrlWriter(content_type)
+    factories.append(lambda: DataUrlWriter(content_type))
+    return FallbackWriter(factories)
+
+
+# ============================================================================
+# Profiling
+# ============================================================================
+
+async def store_profile(profile: Profile) -> Dict[str, Any]:
+    """
+    Stop a profile and store its Chrome trace, with the same fallbacks as
+    upload_to_storage.
+
+    Returns the response metadata fields. `profile_url` is where the trace
+    can be fetched. `profile_artifact_id` is the R2 object key, or the
+    /artifacts ID when stored locally. For a base64 data: URL it is None.
+    """
+    try:
+        data = await get_executor("io").run(profile.stop)
+    except Exception as e:
+        logger.error(f"Stopping profile {profile.id} failed: {e}")
+        return {"profile_error": str(e)}
+
+    filename = f"profile_{profile.id}.json"
+    artifact_id = url = None
+    if object_uploader is not None:
+        try:
+            key = storage_key(filename)
+            url = await object_uploader.upload(data, key, "application/json")
+            artifact_id = key
+        except Exception as e:
+            logger.error(f"R2 upload of profile {profile.id} failed: {e}")
+    if url is None and ARTIFACT_FALLBACK == "local":
+        try:
+            artifact_id = await artifact_store.store(data, filename)
+            url = artifact_store.public_url(artifact_id)
+        except OSError as e:
+            logger.error(f"Local write of profile {profile.id} failed: {e}")
+    if url is None:
+        url = f"data:application/json;base64,{base64.b64encode(data).decode()}"
+    return {
+        "profile_artifact_id": artifact_id,
+        "profile_url": url,
+        "profile_events": profile.event_count,
+        "profile_torch": profile.torch_status,
+    }
+
+
+async def run_profiled(name: str, handler_fn, request) -> Dict[str, Any]:
+    """Run a handler under a new profile; the stored trace is added to the response metadata."""
+    profile = Profile(name)
+    token = current_profile.set(profile)
+    profile.start()
+    try:
+        result = (await handler_fn(request)).model_dump()
+    finally:
+        current_profile.reset(token)
+        info = await store_profile(profile)
+    result["metadata"] = {**(result.get("metadata") or {}), **info}
+    return result
+
+
+_http_client: Optional["httpx.AsyncClient"] = None
+_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_http_client() -> "httpx.AsyncClient":
+    """
+    Shared keep-alive client for outbound fetches (HTTP/2 when `h2` is installed).
+
+    httpx pools are bound to the event loop that first uses them, so a new
+    client is created if the running loop changed.
+    """
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        import httpx
+
+        _http_client = httpx.AsyncClient(
+            http2=importlib.util.find_spec("h2") is not None,
+            follow_redirects=True,
+            timeout=httpx.Timeout(FETCH_TIMEOUT_SECONDS, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=FETCH_MAX_CONNECTIONS,
+                max_keepalive_connections=FETCH_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+        )
+        _http_client_loop = loop
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None and _http_client_loop is asyncio.get_running_loop():
+        await _http_client.aclose()
+    _http_client = None
+
+
 async def fetch_image(url: str) -> Image.Image:
-    """Fetch image from URL."""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        response.raise_for_status()
-        return Image.open(io.BytesIO(response.content)).convert("RGB")
+    """
+    Fetch image from URL.
+
+    The body is streamed into a buffer capped at FETCH_MAX_BYTES (larger
+    downloads are aborted) and decoded once on the CPU executor, so no
+    decoding runs on the event loop.
+    """
+    with stage_timer("fetch"):
+        async with get_http_client().stream("GET", url) as response:
+            response.raise_for_status()
+
+            declared = response.headers.get("content-length")
+            if declared and declared.isdigit() and int(declared) > FETCH_MAX_BYTES:
+                raise ValueError(f"Image too large: {declared} bytes (max {FETCH_MAX_BYTES})")
+
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                if len(body) + len(chunk) > FETCH_MAX_BYTES:
+                    raise ValueError(f"Image too large: over {FETCH_MAX_BYTES} bytes")
+                body += chunk
+
+    return await get_executor("cpu").run(_decode_image, body)
 
 
 # ============================================================================
 # FastAPI App Setup
 # ============================================================================
 
+async def _artifact_cleanup_loop():
+    """Periodically expire local artifacts so the disk stays bounded."""
+    while True:
+        await asyncio.sleep(ARTIFACT_CLEANUP_INTERVAL_SECONDS)
+        try:
+            removed = await get_executor("io").run(artifact_store.cleanup)
+            if removed:
+                logger.info(f"Removed {removed} expired artifacts")
+        except Exception as e:
+            logger.warning(f"Artifact cleanup failed: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan handler for model loading/unloading."""
@@ -312,16 +1105,24 @@ async def lifespan(app: FastAPI):
     logger.info(f"Model cache directory: {MODEL_CACHE_DIR}")
     logger.info(f"VRAM status: {model_manager.get_vram_usage()}")
 
-    # Preload models if in production mode
-    if os.getenv("PRELOAD_MODELS", "false").lower() == "true":
-        logger.info("Preloading models...")
-        # Models will be loaded on first request to save cold start time
+    # Warm up PRELOAD_MODELS in the background; /ready reports 503 until done
+    warmup_task = asyncio.create_task(warmup.run(get_executor(DEVICE)))
+
+    cleanup_task = asyncio.create_task(_artifact_cleanup_loop())
+    await job_queue.start()
 
     yield
 
     # Cleanup
+    warmup_task.cancel()
+    cleanup_task.cancel()
+    await job_queue.stop()
     logger.info("GPU Worker shutting down, releasing models...")
-    model_manager.clear_vram()
+    model_manager.clear_vram(demote=False)
+    await close_http_client()
+    if object_uploader is not None:
+        object_uploader.shutdown()
+    shutdown_executors()
 
 
 app = FastAPI(
@@ -331,6 +1132,10 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Requests sent with X-Profile: 1 are traced (see profiling.py)
+app.add_middleware(ProfileMiddleware, finish=store_profile)
+app.add_middleware(FirstRequestTimer, warmup=warmup)
+
 # CORS for development
 app.add_middleware(
     CORSMiddleware,
@@ -345,23 +1150,108 @@ app.add_middleware(
 # Health & Status Endpoints
 # ============================================================================
 
+@app.get("/live")
+async def liveness():
+    """Liveness probe: the process is up and its event loop is responsive."""
+    return {"status": "alive"}
+
+
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 503 until the warmup plan (PRELOAD_MODELS) has finished."""
+    body = {"ready": warmup.ready, "warmup": warmup.stats()}
+    return JSONResponse(body, status_code=200 if warmup.ready else 503)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint for load balancers and orchestrators."""
-    gpu_available = torch.cuda.is_available()
-    gpu_name = torch.cuda.get_device_name(0) if gpu_available else None
-
     return {
         "status": "healthy",
-        "device": DEVICE,
-        "gpu_available": gpu_available,
-        "gpu_name": gpu_name,
+        **gpu_status(),
         "gpu_memory_gb": model_manager.get_vram_usage(),
         "current_model": model_manager.current_model,
         "loaded_models": list(model_manager.models.keys()) + list(model_manager.pipelines.keys()),
+        "model_cache": model_manager.cache_stats(),
+        "executors": executor_stats(),
+        "depth_batching": depth_batcher.stats(),
+        "depth_cache": depth_cache.stats(),
+        "output": output_stage.stats(),
+        "artifacts": artifact_store.stats() if ARTIFACT_FALLBACK == "local" else None,
+        "jobs": job_queue.stats(),
+        "warmup": warmup.stats(),
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, model loads, caches, queues and memory."""
+    return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def _vram_samples():
+    """Device memory by kind; only capacity is known until torch is loaded."""
+    if _cuda_available():
+        torch = sys.modules["torch"]
+        return labelled({
+            "total": torch.cuda.get_device_properties(0).total_memory,
+            "allocated": torch.cuda.memory_allocated(0),
+            "reserved": torch.cuda.memory_reserved(0),
+        })
+    gpu = _gpu_info()
+    return labelled({"total": gpu["total_bytes"]}) if gpu else None
+
+
+def _cache_samples(field: str):
+    model, depth = model_manager.cache_stats(), depth_cache.stats()
+    if field == "hits":
+        return labelled({"model": model["hits"], "depth": depth["memory_hits"] + depth["disk_hits"]})
+    return labelled({"model": model[field], "depth": depth[field]})
+
+
+def _executor_samples(field: str):
+    return labelled({name: stats[field] for name, stats in executor_stats().items()})
+
+
+metrics_registry.gauge_callback("gpu_worker_vram_bytes", "GPU memory", _vram_samples, ("kind",))
+metrics_registry.gauge_callback(
+    "gpu_worker_model_cache_bytes", "Measured footprint of cached models per tier",
+    lambda: labelled({"device": model_manager.used_bytes(), "host": model_manager.host_used_bytes()}), ("tier",),
+)
+metrics_registry.counter_callback(
+    "gpu_worker_cache_hits_total", "Cache hits", lambda: _cache_samples("hits"), ("cache",)
+)
+metrics_registry.counter_callback(
+    "gpu_worker_cache_misses_total", "Cache misses", lambda: _cache_samples("misses"), ("cache",)
+)
+metrics_registry.gauge_callback(
+    "gpu_worker_cache_hit_ratio", "Cache hit ratio since start", lambda: _cache_samples("hit_ratio"), ("cache",)
+)
+metrics_registry.counter_callback(
+    "gpu_worker_model_evictions_total", "Models evicted from the device cache",
+    lambda: model_manager.cache_stats()["evictions"],
+)
+metrics_registry.gauge_callback(
+    "gpu_worker_jobs", "Background jobs by state",
+    lambda: labelled({state: job_queue.stats()[state] for state in ("queued", "running")}), ("state",),
+)
+metrics_registry.gauge_callback(
+    "gpu_worker_executor_queue_depth", "Calls waiting for an executor thread",
+    lambda: _executor_samples("queued"), ("executor",),
+)
+metrics_registry.gauge_callback(
+    "gpu_worker_executor_running", "Calls running on an executor", lambda: _executor_samples("running"), ("executor",),
+)
+metrics_registry.counter_callback(
+    "gpu_worker_depth_batches_total", "Batched depth forward passes", lambda: depth_batcher.stats()["batches"],
+)
+metrics_registry.counter_callback(
+    "gpu_worker_depth_batch_images_total", "Images run through batched depth forwards",
+    lambda: depth_batcher.stats()["images"],
+)
+metrics_registry.gauge_callback("gpu_worker_ready", "1 once the warmup plan has finished", lambda: int(warmup.ready))
+
+
 @app.get("/models")
 async def list_models():
     """List available and loaded models."""
@@ -376,6 +1266,7 @@ async def list_models():
         ],
         "loaded": list(model_manager.models.keys()) + list(model_manager.pipelines.keys()),
         "vram": model_manager.get_vram_usage(),
+        "model_cache": model_manager.cache_stats(),
     }
 
 
@@ -386,6 +1277,114 @@ async def unload_models():
     return {"success": True, "vram": model_manager.get_vram_usage()}
 
 
+# ============================================================================
+# Artifact Downloads
+# ============================================================================
+
+class RangeFileResponse(Response):
+    """
+    Sends `length` bytes of a file starting at `offset`.
+
+    Uses the ASGI zero-copy send extension (sendfile) when the server offers
+    it, otherwise streams the file in chunks without loading it into memory.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, path: str, offset: int, length: int, status_code: int,
+                 headers: Dict[str, str], media_type: str):
+        super().__init__(
+            status_code=status_code,
+            headers={**headers, "content-length": str(length)},
+            media_type=media_type,
+        )
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.offset,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+
+        remaining = self.length
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.offset)
+            while remaining > 0:
+                chunk = await f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Parse a single `bytes=` Range header into an inclusive (start, end).
+
+    Returns None when the header should be ignored (other units, multiple
+    ranges, malformed), and raises ValueError when it is unsatisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    if not start_text:
+        # Suffix range: the last N bytes
+        if not end_text.isdigit():
+            return None
+        suffix = int(end_text)
+        if suffix == 0 or size == 0:
+            raise ValueError("unsatisfiable range")
+        return max(0, size - suffix), size - 1
+    if not start_text.isdigit() or (end_text and not end_text.isdigit()):
+        return None
+    start = int(start_text)
+    end = min(int(end_text), size - 1) if end_text else size - 1
+    if start >= size or start > end:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+
+@app.api_route("/artifacts/{artifact_id}", methods=["GET", "HEAD"])
+async def get_artifact(artifact_id: str, request: Request):
+    """Download a locally stored output, with HTTP Range support for video seeking."""
+    found = artifact_store.resolve(artifact_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Artifact not found or expired")
+    path, size, content_type = found
+
+    headers = {"accept-ranges": "bytes", "cache-control": "private, max-age=3600"}
+    start, end, status_code = 0, size - 1, 200
+
+    range_header = request.headers.get("range")
+    if range_header:
+        try:
+            requested = _parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+        if requested is not None:
+            start, end = requested
+            status_code = 206
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+    return RangeFileResponse(path, start, end - start + 1, status_code, headers, content_type)
+
+
 # ============================================================================
 # Request/Response Models
 # ============================================================================
@@ -395,8 +1394,8 @@ class RackFocusRequest(BaseModel):
     image_url: str = Field(..., description="URL of the source image")
     focus_point_start: tuple[float, float] = Field(..., description="Starting focus point (x, y) normalized 0-1")
     focus_point_end: tuple[float, float] = Field(..., description="Ending focus point (x, y) normalized 0-1")
-    duration_seconds: float = Field(default=2.0, description="Duration of the rack focus in seconds")
-    fps: int = Field(default=24, description="Output video frame rate")
+    duration_seconds: float = Field(default=2.0, gt=0, le=60.0, description="Duration of the rack focus in seconds")
+    fps: int = Field(default=24, gt=0, le=120, description="Output video frame rate")
     blur_strength: float = Field(default=1.0, ge=0.1, le=3.0, description="Depth of field blur intensity")
 
 
@@ -408,6 +1407,7 @@ class LensCharacterRequest(BaseModel):
     aberration_strength: float = Field(default=0.5, ge=0.0, le=1.0, description="Chromatic aberration intensity")
     flare_intensity: float = Field(default=0.3, ge=0.0, le=1.0, description="Lens flare intensity")
     vignette_strength: float = Field(default=0.2, ge=0.0, le=1.0, description="Vignette darkness")
+    output_format: str = Field(default="png", description="Output encoding: png or webp")
 
 
 class FocusRescueRequest(BaseModel):
@@ -415,6 +1415,7 @@ class FocusRescueRequest(BaseModel):
     image_url: str = Field(..., description="URL of the slightly out-of-focus image")
     sharpness_target: float = Field(default=0.7, ge=0.0, le=1.0, description="Target sharpness level")
     preserve_bokeh: bool = Field(default=True, description="Preserve intentional background blur")
+    output_format: str = Field(default="png", description="Output encoding: png or webp")
 
 
 class DirectorEditRequest(BaseModel):
@@ -425,12 +1426,19 @@ class DirectorEditRequest(BaseModel):
     strength: float = Field(default=0.7, ge=0.1, le=1.0, description="Edit strength")
 
 
+class DepthEstimateRequest(BaseModel):
+    """Request model for depth estimation of an image fetched by URL."""
+    image_url: str = Field(..., description="URL of the source image")
+    model: str = Field(default="depth_anything", description="Depth model: depth_anything or midas")
+    output_format: str = Field(default="png", description="Output encoding: png, webp, png16 or npy (float16)")
+
+
 class VideoGenerationRequest(BaseModel):
     """Request model for video generation."""
     prompt: str = Field(..., description="Video generation prompt")
     image_url: Optional[str] = Field(None, description="Source image for I2V")
     duration_seconds: float = Field(default=4.0, ge=1.0, le=10.0, description="Video duration")
-    fps: int = Field(default=24, description="Output frame rate")
+    fps: int = Field(default=24, gt=0, le=60, description="Output frame rate")
     width: int = Field(default=1280, description="Video width")
     height: int = Field(default=720, description="Video height")
     guidance_scale: float = Field(default=7.5, description="CFG scale")
@@ -448,6 +1456,289 @@ class ProcessingResponse(BaseModel):
     error: Optional[str] = None
 
 
+class JobSubmitRequest(BaseModel):
+    """Request model for submitting a background job."""
+    operation: str = Field(..., description="Operation name, e.g. video_generate or rack_focus")
+    params: Dict[str, Any] = Field(default_factory=dict, description="Request body for the operation; add \"profile\": true to trace it")
+    priority: int = Field(default=0, description="Higher runs first; ties run in submission order")
+
+
+# ============================================================================
+# Compute Sections (run on executors, never on the event loop)
+# ============================================================================
+
+DEPTH_MODELS = ("depth_anything", "midas")
+
+
+def _decode_image(data: bytes) -> Image.Image:
+    """Decode image bytes to RGB."""
+    with stage_timer("decode"):
+        return Image.open(io.BytesIO(data)).convert("RGB")
+
+
+def _predict_depth_batch(model: str, images: list) -> list:
+    """
+    Run a depth model over a batch of images, returning raw depth at the
+    model's resolution for each image, in order.
+
+    Processors keep aspect ratio, so differently sized inputs produce different
+    tensor shapes; images are grouped by processed shape and each group runs as
+    one forward pass.
+    """
+    import torch
+
+    with model_manager.lease(model) as loaded:
+        depth_model = loaded[model]
+        processor = loaded[f"{model}_processor"]
+
+        groups: Dict[tuple, list] = {}
+        for index, image in enumerate(images):
+            pixel_values = processor(images=image, return_tensors="pt")["pixel_values"]
+            groups.setdefault(tuple(pixel_values.shape[1:]), []).append((index, pixel_values))
+
+        results: list = [None] * len(images)
+        with torch.no_grad(), stage_timer("inference"):
+            for members in groups.values():
+                batch = torch.cat([pixel_values for _, pixel_values in members]).to(DEVICE)
+                predicted_depth = depth_model(pixel_values=batch).predicted_depth
+                for (index, _), depth in zip(members, predicted_depth.cpu().numpy()):
+                    results[index] = depth
+        return results
+
+
+depth_batcher = DepthBatcher(_predict_depth_batch, executor=lambda: get_executor(DEVICE))
+
+
+depth_cache = DepthCache()
+
+
+output_stage = OutputStage()
+
+
+@profiled("predict_depth")
+async def predict_depth(image: Image.Image, model: str = "depth_anything", key: Optional[str] = None):
+    """
+    Raw depth for one image (read-only float32 array at the model's resolution).
+
+    Served from the content-addressed depth cache when this image was seen
+    before; otherwise coalesced with concurrent requests into batched forwards.
+    `key` is the image's depth_cache_key, if the caller already has it.
+    """
+    if model not in DEPTH_MODELS:
+        raise ValueError(f"Unknown depth model: {model}")
+
+    cpu = get_executor("cpu")
+    if key is None:
+        key = await cpu.run(depth_cache_key, image, model)
+    depth = await cpu.run(depth_cache.get, key)
+    if depth is None:
+        depth = await depth_batcher.predict(model, image)
+        await cpu.run(depth_cache.put, key, depth)
+    return depth
+
+
+@profiled("encode_depth_output")
+async def encode_depth_output(depth, size: tuple[int, int], output_format: str) -> EncodedOutput:
+    """
+    Normalize, resize and quantize raw depth, then encode it.
+
+    On a GPU with torch loaded, the quantization runs on the device executor
+    so only the final array is copied to the host. Encoding runs on the CPU
+    executor.
+    """
+    cpu = get_executor("cpu")
+    if DEVICE != "cpu" and _cuda_available():
+        quantized = await get_executor(DEVICE).run(quantize_depth, depth, size, output_format, DEVICE)
+    else:
+        quantized = await cpu.run(quantize_depth, depth, size, output_format)
+    return await cpu.run(output_stage.encode, quantized, output_format)
+
+
+@profiled("predict_depth_tiled")
+async def predict_depth_tiled(image: Image.Image, model: str, depth, output_format: str) -> tuple[EncodedOutput, int]:
+    """
+    Full-resolution depth output for a large image, from overlapping tiles
+    run through the model at its native resolution. `depth` is the
+    whole-image prediction the tiles are aligned to. Returns (output, tile count).
+
+    Tiles are cropped, predicted and merged one band (row of tiles) at a
+    time, so apart from the output, memory is bounded by one band whatever
+    the image size. Tiles skip the depth cache: one-off crops would only
+    evict whole-image entries.
+    """
+    from tiling import DEPTH_TILE_OVERLAP, DEPTH_TILE_SIZE, DepthTileMerger, plan_tiles
+
+    cpu = get_executor("cpu")
+    bands = plan_tiles(image.height, image.width, DEPTH_TILE_SIZE, DEPTH_TILE_OVERLAP, halo=0)
+    finalize, dtype = depth_finalizer(float(depth.min()), float(depth.max()), output_format)
+    merger = DepthTileMerger(depth, bands, finalize, dtype)
+    for band in bands:
+        crops = await cpu.run(_crop_tiles, image, band)
+        # A band's tiles coalesce into batched forwards in the depth batcher
+        predictions = await asyncio.gather(*(depth_batcher.predict(model, crop) for crop in crops))
+        del crops
+        await cpu.run(merger.add_band, predictions)
+    encoded = await cpu.run(output_stage.encode, merger.output, output_format)
+    return encoded, sum(len(band) for band in bands)
+
+
+def _crop_tiles(image: Image.Image, tiles: list) -> list:
+    return [image.crop((tile.x0, tile.y0, tile.x1, tile.y1)) for tile in tiles]
+
+
+def _run_video_pipeline(request: "VideoGenerationRequest", source_image: Optional[Image.Image]):
+    """
+    Run Wan 2.1 T2V (no source image) or I2V.
+
+    Returns the frames as one float array (frames, height, width, 3) in [0, 1],
+    which the encoder quantizes frame by frame without PIL round trips.
+    """
+    import torch
+
+    model_name = "wan_i2v" if source_image is not None else "wan_t2v"
+
+    report_progress(stage="loading_model")
+    with model_manager.lease(model_name) as loaded:
+        pipe = loaded[model_name]
+        check_cancelled()
+
+        generator = torch.Generator(device=DEVICE)
+        if request.seed:
+            generator.manual_seed(request.seed)
+
+        num_frames = min(int(request.duration_seconds * request.fps), 97)  # Wan 2.1 max frames
+
+        with stage_timer("inference"):
+            if source_image is not None:
+                output = pipe(
+                    image=source_image,
+                    prompt=request.prompt,
+                    num_frames=num_frames,
+                    guidance_scale=request.guidance_scale,
+                    num_inference_steps=request.num_inference_steps,
+                    generator=generator,
+                    output_type="np",
+                    callback_on_step_end=diffusers_progress_callback(request.num_inference_steps),
+                )
+            else:
+                output = pipe(
+                    prompt=request.prompt,
+                    num_frames=num_frames,
+                    height=request.height,
+                    width=request.width,
+                    guidance_scale=request.guidance_scale,
+                    num_inference_steps=request.num_inference_steps,
+                    generator=generator,
+                    output_type="np",
+                    callback_on_step_end=diffusers_progress_callback(request.num_inference_steps),
+                )
+
+    return output.frames[0]
+
+
+def _encode_video(frames, fps: int, filename: str) -> str:
+    """
+    Stream frames through ffmpeg straight into the output destination.
+
+    `frames` is any iterable of PIL images or HxWx3 arrays; each frame is
+    written as soon as it is available. Returns the output URL.
+    """
+    frames = iter(frames)
+    first = next(frames)
+    if hasattr(first, "shape"):
+        height, width = first.shape[:2]
+    else:
+        width, height = first.size
+
+    sink = open_output_stream(filename, "video/mp4")
+    try:
+        # Frames are produced lazily, so for rendered video this includes rendering
+        with stage_timer("encode"), FrameStreamEncoder(width, height, fps, sink) as encoder:
+            encoder.write_frame(first)
+            for frame in frames:
+                check_cancelled()
+                encoder.write_frame(frame)
+        return sink.close()
+    except BaseException:
+        sink.abort()
+        raise
+
+
+def _render_rack_focus(source_image: Image.Image, depth, request: "RackFocusRequest", filename: str) -> Dict[str, Any]:
+    """
+    Render the focus pull and stream it through the encoder into storage.
+
+    Blur levels are precomputed once; each frame only blends between them,
+    and is handed to ffmpeg as soon as it is synthesized.
+    """
+    import numpy as np
+    from rack_focus_renderer import (
+        RackFocusRenderer, prepare_inputs, rack_focus_frame_count, sample_focus_depth,
+    )
+
+    num_frames = rack_focus_frame_count(request.duration_seconds, request.fps)
+    rgb, depth01 = prepare_inputs(np.asarray(source_image.convert("RGB")), depth)
+    start_depth = sample_focus_depth(depth01, request.focus_point_start)
+    end_depth = sample_focus_depth(depth01, request.focus_point_end)
+
+    report_progress(stage="rendering")
+    with stage_timer("render"):
+        renderer = RackFocusRenderer(rgb, depth01, blur_strength=request.blur_strength)
+    output_url = _encode_video(renderer.frames(start_depth, end_depth, num_frames), request.fps, filename)
+    return {
+        "output_url": output_url,
+        "frames": num_frames,
+        "resolution": f"{renderer.width}x{renderer.height}",
+        "focus_depth_start": round(start_depth, 3),
+        "focus_depth_end": round(end_depth, 3),
+    }
+
+
+def _render_lens_character(source_image: Image.Image, request: "LensCharacterRequest") -> tuple[EncodedOutput, list]:
+    """
+    Apply the lens profile (lens_effects.py) and encode; returns (output, effects applied).
+
+    Images above TILE_MIN_EDGE are rendered as blended tiles in parallel.
+    """
+    import numpy as np
+    from lens_effects import LensCharacter, apply_lens_character
+    from tiling import run_tiled, should_tile, to_uint8
+
+    rgb = np.asarray(source_image.convert("RGB"))
+    options = dict(
+        lens_type=request.lens_type,
+        bokeh_shape=request.bokeh_shape,
+        aberration_strength=request.aberration_strength,
+        flare_intensity=request.flare_intensity,
+        vignette_strength=request.vignette_strength,
+    )
+    with stage_timer("render"):
+        if not should_tile(*rgb.shape[:2]):
+            result, applied = apply_lens_character(rgb, **options)
+        else:
+            lens = LensCharacter(rgb, **options)
+            result = run_tiled(rgb, lambda region, tile: lens.render(region, tile.py0, tile.px0), to_uint8, np.uint8)
+            applied = lens.applied
+    return output_stage.encode(result, request.output_format), applied
+
+
+def _render_focus_rescue(source_image: Image.Image, sharpness: float, output_format: str) -> EncodedOutput:
+    """Sharpen an image and encode it; images above TILE_MIN_EDGE are sharpened in tiles."""
+    from PIL import ImageEnhance
+    from tiling import run_tiled, should_tile, to_uint8
+
+    with stage_timer("render"):
+        if not should_tile(source_image.height, source_image.width):
+            result = ImageEnhance.Sharpness(source_image).enhance(sharpness)
+        else:
+            import numpy as np
+            from lens_effects import sharpen
+
+            rgb = np.asarray(source_image.convert("RGB"))
+            result = run_tiled(rgb, lambda region, tile: sharpen(region, sharpness), to_uint8, np.uint8)
+    return output_stage.encode(result, output_format)
+
+
 # ============================================================================
 # Depth Estimation Endpoints
 # ============================================================================
@@ -456,6 +1747,7 @@ class ProcessingResponse(BaseModel):
 async def estimate_depth(
     image: UploadFile = File(...),
     model: str = Form(default="depth_anything"),
+    output_format: str = Form(default="png"),
 ):
     """
     Generate a depth map from an image.
@@ -463,59 +1755,64 @@ async def estimate_depth(
     Supports:
     - depth_anything: Depth Anything V2 (recommended)
     - midas: MiDaS depth estimation
+
+    output_format: png (default), webp, png16 (16-bit) or npy (float16).
     """
     start_time = time.time()
 
     try:
-        # Load image
         contents = await image.read()
-        pil_image = Image.open(io.BytesIO(contents)).convert("RGB")
-
-        if model == "depth_anything":
-            # Load Depth Anything
-            model_manager.ensure_model("depth_anything")
-            depth_model = model_manager.models["depth_anything"]
-            processor = model_manager.models["depth_anything_processor"]
-
-            # Process
-            inputs = processor(images=pil_image, return_tensors="pt").to(DEVICE)
-            with torch.no_grad():
-                outputs = depth_model(**inputs)
-                predicted_depth = outputs.predicted_depth
-
-            # Normalize to 0-255
-            depth = predicted_depth.squeeze().cpu().numpy()
-            depth = (depth - depth.min()) / (depth.max() - depth.min()) * 255
-            depth_image = Image.fromarray(depth.astype("uint8"))
-
-        elif model == "midas":
-            # Load MiDaS
-            model_manager.ensure_model("midas")
-            midas = model_manager.models["midas"]
-            processor = model_manager.models["midas_processor"]
-
-            inputs = processor(images=pil_image, return_tensors="pt").to(DEVICE)
-            with torch.no_grad():
-                outputs = midas(**inputs)
-                predicted_depth = outputs.predicted_depth
-
-            depth = predicted_depth.squeeze().cpu().numpy()
-            depth = (depth - depth.min()) / (depth.max() - depth.min()) * 255
-            depth_image = Image.fromarray(depth.astype("uint8"))
+        pil_image = await get_executor("cpu").run(_decode_image, contents)
+    except Exception as e:
+        logger.error(f"Depth estimation failed: {e}")
+        return ProcessingResponse(
+            success=False,
+            processing_time_ms=int((time.time() - start_time) * 1000),
+            error=str(e),
+        )
 
-        else:
-            raise ValueError(f"Unknown depth model: {model}")
+    return await _depth_response(pil_image, model, start_time, output_format)
+
+
+@app.post("/depth/estimate-url", response_model=ProcessingResponse)
+async def estimate_depth_from_url(request: DepthEstimateRequest):
+    """Generate a depth map for an image fetched from a URL (JSON variant of /depth/estimate)."""
+    start_time = time.time()
+
+    try:
+        pil_image = await fetch_image(request.image_url)
+    except Exception as e:
+        logger.error(f"Depth estimation failed: {e}")
+        return ProcessingResponse(
+            success=False,
+            processing_time_ms=int((time.time() - start_time) * 1000),
+            error=str(e),
+        )
+
+    return await _depth_response(pil_image, request.model, start_time, request.output_format)
 
-        # Resize to match input
-        depth_image = depth_image.resize(pil_image.size, Image.Resampling.BILINEAR)
 
-        # Convert to bytes
-        buffer = io.BytesIO()
-        depth_image.save(buffer, format="PNG")
-        depth_bytes = buffer.getvalue()
+async def _depth_response(pil_image: Image.Image, model: str, start_time: float,
+                          output_format: str = "png") -> ProcessingResponse:
+    """Estimate, encode and store a depth map for a decoded image."""
+    try:
+        from tiling import should_tile
+
+        check_format(output_format, depth=True)
+
+        # Batched inference on the device executor, then the shared output stage
+        key = await get_executor("cpu").run(depth_cache_key, pil_image, model)
+        depth = await predict_depth(pil_image, model, key)
+        tiles = 1
+        if should_tile(pil_image.height, pil_image.width):
+            encoded, tiles = await predict_depth_tiled(pil_image, model, depth, output_format)
+        else:
+            encoded = await encode_depth_output(depth, pil_image.size, output_format)
 
         # Upload to storage
-        output_url = await upload_to_storage(depth_bytes, f"depth_{int(time.time())}.png")
+        output_url = await upload_to_storage(
+            encoded.data, encoded.filename(f"depth_{int(time.time())}"), encoded.content_type
+        )
 
         processing_time = int((time.time() - start_time) * 1000)
 
@@ -527,6 +1824,10 @@ async def estimate_depth(
                 "model": model,
                 "input_size": list(pil_image.size),
                 "device": DEVICE,
+                "tiles": tiles,
+                "output_format": output_format,
+                "output_bytes": len(encoded.data),
+                "encode_ms": encoded.encode_ms,
             }
         )
 
@@ -555,75 +1856,22 @@ async def generate_video(request: VideoGenerationRequest):
     start_time = time.time()
 
     try:
+        source_image = None
         if request.image_url:
-            # Image-to-Video mode
-            model_manager.ensure_model("wan_i2v")
-            pipe = model_manager.pipelines["wan_i2v"]
-
-            # Fetch source image
+            # Image-to-Video mode: fetch the source image before queueing for the device
+            report_progress(stage="fetching")
             source_image = await fetch_image(request.image_url)
-            source_image = source_image.resize((request.width, request.height))
-
-            # Generate
-            generator = torch.Generator(device=DEVICE)
-            if request.seed:
-                generator.manual_seed(request.seed)
-
-            num_frames = int(request.duration_seconds * request.fps)
-
-            output = pipe(
-                image=source_image,
-                prompt=request.prompt,
-                num_frames=min(num_frames, 97),  # Wan 2.1 max frames
-                guidance_scale=request.guidance_scale,
-                num_inference_steps=request.num_inference_steps,
-                generator=generator,
+            source_image = await get_executor("cpu").run(
+                source_image.resize, (request.width, request.height)
             )
 
-        else:
-            # Text-to-Video mode
-            model_manager.ensure_model("wan_t2v")
-            pipe = model_manager.pipelines["wan_t2v"]
-
-            generator = torch.Generator(device=DEVICE)
-            if request.seed:
-                generator.manual_seed(request.seed)
-
-            num_frames = int(request.duration_seconds * request.fps)
-
-            output = pipe(
-                prompt=request.prompt,
-                num_frames=min(num_frames, 97),
-                height=request.height,
-                width=request.width,
-                guidance_scale=request.guidance_scale,
-                num_inference_steps=request.num_inference_steps,
-                generator=generator,
-            )
-
-        # Export video
-        frames = output.frames[0]  # List of PIL Images
-
-        # Use moviepy to create video
-        import tempfile
-        from moviepy.editor import ImageSequenceClip
-        import numpy as np
-
-        frame_arrays = [np.array(f) for f in frames]
-        clip = ImageSequenceClip(frame_arrays, fps=request.fps)
-
-        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as f:
-            temp_path = f.name
+        frames = await get_executor(DEVICE).run(_run_video_pipeline, request, source_image)
 
-        clip.write_videofile(temp_path, codec="libx264", audio=False, verbose=False, logger=None)
-
-        with open(temp_path, "rb") as f:
-            video_bytes = f.read()
-
-        os.unlink(temp_path)
-
-        # Upload to storage
-        output_url = await upload_to_storage(video_bytes, f"video_{int(time.time())}.mp4", "video/mp4")
+        # Encode and upload in one pass: ffmpeg output streams into storage
+        report_progress(stage="encoding")
+        output_url = await get_executor("cpu").run(
+            _encode_video, frames, request.fps, f"video_{int(time.time())}.mp4"
+        )
 
         processing_time = int((time.time() - start_time) * 1000)
 
@@ -661,8 +1909,9 @@ async def rack_focus(request: RackFocusRequest):
     """
     Simulate cinematic rack focus effect using depth-based blur.
 
-    This uses depth estimation + blur simulation rather than Learn2Refocus
-    (which isn't publicly available yet).
+    This uses depth estimation + a layered blur renderer
+    (rack_focus_renderer.py) rather than Learn2Refocus (which isn't publicly
+    available yet). Returns an MP4 of the focus pull.
     """
     start_time = time.time()
 
@@ -671,40 +1920,28 @@ async def rack_focus(request: RackFocusRequest):
         source_image = await fetch_image(request.image_url)
 
         # Get depth map
-        model_manager.ensure_model("depth_anything")
-        depth_model = model_manager.models["depth_anything"]
-        processor = model_manager.models["depth_anything_processor"]
+        depth = await predict_depth(source_image, "depth_anything")
 
-        inputs = processor(images=source_image, return_tensors="pt").to(DEVICE)
-        with torch.no_grad():
-            outputs = depth_model(**inputs)
-            depth = outputs.predicted_depth.squeeze().cpu().numpy()
-
-        # Normalize depth
-        depth = (depth - depth.min()) / (depth.max() - depth.min())
-
-        # TODO: Implement rack focus animation using depth-based blur
-        # For now, return depth map as proof of concept
-
-        depth_image = Image.fromarray((depth * 255).astype("uint8"))
-        depth_image = depth_image.resize(source_image.size, Image.Resampling.BILINEAR)
-
-        buffer = io.BytesIO()
-        depth_image.save(buffer, format="PNG")
-
-        output_url = await upload_to_storage(buffer.getvalue(), f"depth_{int(time.time())}.png")
+        # Render frames and encode/upload them in one streaming pass
+        rendered = await get_executor("cpu").run(
+            _render_rack_focus, source_image, depth, request, f"rack_focus_{int(time.time())}.mp4"
+        )
 
         processing_time = int((time.time() - start_time) * 1000)
 
         return ProcessingResponse(
             success=True,
-            output_url=output_url,
+            output_url=rendered["output_url"],
             processing_time_ms=processing_time,
             metadata={
                 "model": "depth_anything",
                 "focus_start": request.focus_point_start,
                 "focus_end": request.focus_point_end,
-                "note": "Returning depth map - full rack focus animation coming soon",
+                "focus_depth_start": rendered["focus_depth_start"],
+                "focus_depth_end": rendered["focus_depth_end"],
+                "frames": rendered["frames"],
+                "fps": request.fps,
+                "resolution": rendered["resolution"],
             },
         )
 
@@ -722,44 +1959,23 @@ async def lens_character(request: LensCharacterRequest):
     """
     Apply cinematic lens character to an image.
 
-    Currently uses basic image processing. GenFocus integration planned.
+    Lens profile softness/contrast, highlight bokeh in the requested shape,
+    chromatic aberration, flare and vignette, as vectorized array ops.
+    GenFocus integration planned.
     """
     start_time = time.time()
 
     try:
+        check_format(request.output_format)
         source_image = await fetch_image(request.image_url)
 
-        # Basic lens effects using PIL
-        import numpy as np
-        from PIL import ImageFilter, ImageEnhance
-
-        result = source_image.copy()
-
-        # Vignette effect
-        if request.vignette_strength > 0:
-            width, height = result.size
-            x = np.linspace(-1, 1, width)
-            y = np.linspace(-1, 1, height)
-            X, Y = np.meshgrid(x, y)
-            R = np.sqrt(X**2 + Y**2)
-            vignette = 1 - (R * request.vignette_strength * 0.5)
-            vignette = np.clip(vignette, 0, 1)
-
-            result_array = np.array(result).astype(float)
-            for c in range(3):
-                result_array[:, :, c] *= vignette
-            result = Image.fromarray(result_array.astype("uint8"))
-
-        # Slight blur for "vintage" feel
-        if request.lens_type == "vintage":
-            result = result.filter(ImageFilter.GaussianBlur(radius=0.5))
-            enhancer = ImageEnhance.Contrast(result)
-            result = enhancer.enhance(0.95)
-
-        buffer = io.BytesIO()
-        result.save(buffer, format="PNG")
+        encoded, effects_applied = await get_executor("cpu").run(
+            _render_lens_character, source_image, request
+        )
 
-        output_url = await upload_to_storage(buffer.getvalue(), f"lens_{int(time.time())}.png")
+        output_url = await upload_to_storage(
+            encoded.data, encoded.filename(f"lens_{int(time.time())}"), encoded.content_type
+        )
 
         processing_time = int((time.time() - start_time) * 1000)
 
@@ -770,7 +1986,10 @@ async def lens_character(request: LensCharacterRequest):
             metadata={
                 "lens_type": request.lens_type,
                 "bokeh_shape": request.bokeh_shape,
-                "effects_applied": ["vignette", "vintage_filter"],
+                "effects_applied": effects_applied,
+                "output_format": request.output_format,
+                "output_bytes": len(encoded.data),
+                "encode_ms": encoded.encode_ms,
             },
         )
 
@@ -793,19 +2012,18 @@ async def rescue_focus(request: FocusRescueRequest):
     start_time = time.time()
 
     try:
+        check_format(request.output_format)
         source_image = await fetch_image(request.image_url)
 
-        from PIL import ImageFilter, ImageEnhance
-
         # Apply unsharp mask
         sharpness = 1.0 + (request.sharpness_target * 2)
-        enhancer = ImageEnhance.Sharpness(source_image)
-        result = enhancer.enhance(sharpness)
-
-        buffer = io.BytesIO()
-        result.save(buffer, format="PNG")
+        encoded = await get_executor("cpu").run(
+            _render_focus_rescue, source_image, sharpness, request.output_format
+        )
 
-        output_url = await upload_to_storage(buffer.getvalue(), f"sharp_{int(time.time())}.png")
+        output_url = await upload_to_storage(
+            encoded.data, encoded.filename(f"sharp_{int(time.time())}"), encoded.content_type
+        )
 
         processing_time = int((time.time() - start_time) * 1000)
 
@@ -816,6 +2034,9 @@ async def rescue_focus(request: FocusRescueRequest):
             metadata={
                 "sharpness_applied": sharpness,
                 "preserve_bokeh": request.preserve_bokeh,
+                "output_format": request.output_format,
+                "output_bytes": len(encoded.data),
+                "encode_ms": encoded.encode_ms,
             },
         )
 
@@ -869,6 +2090,129 @@ async def director_edit(request: DirectorEditRequest):
         )
 
 
+# ============================================================================
+# Job Queue Endpoints
+# ============================================================================
+
+JOB_OPERATIONS = {
+    "depth_estimate": (estimate_depth_from_url, DepthEstimateRequest),
+    "video_generate": (generate_video, VideoGenerationRequest),
+    "rack_focus": (rack_focus, RackFocusRequest),
+    "lens_character": (lens_character, LensCharacterRequest),
+    "rescue_focus": (rescue_focus, FocusRescueRequest),
+    "director_edit": (director_edit, DirectorEditRequest),
+}
+
+
+async def run_job_operation(operation: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate params for an operation, run its handler and return the response as a dict."""
+    handler_fn, request_model = JOB_OPERATIONS[operation]
+    if profile_requested(params.get("profile")):
+        return await run_profiled(f"job {operation}", handler_fn, request_model(**params))
+    result = await handler_fn(request_model(**params))
+    return result.model_dump()
+
+
+# Model each operation needs, so the scheduler can group jobs by model family
+JOB_OPERATION_MODELS = {
+    "rack_focus": "depth_anything",
+}
+
+
+def job_model_family(operation: str, params: Dict[str, Any]) -> Optional[str]:
+    """Model family a queued job will load, or None if it runs without a model."""
+    if operation.startswith("video_"):
+        model_name = "wan_i2v" if params.get("image_url") else "wan_t2v"
+    elif operation == "depth_estimate":
+        model_name = params.get("model", "depth_anything")
+    else:
+        model_name = JOB_OPERATION_MODELS.get(operation)
+    return model_manager._get_model_family(model_name)
+
+
+job_queue = JobQueue(run_job_operation, family_of=job_model_family)
+
+
+def _get_job_or_404(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobSubmitRequest):
+    """
+    Queue an operation and return its job ID immediately.
+
+    Poll GET /jobs/{id} or follow GET /jobs/{id}/events for progress; the
+    final ProcessingResponse is in the job's `result`.
+    """
+    if request.operation not in JOB_OPERATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown operation: {request.operation}. Available: {list(JOB_OPERATIONS)}",
+        )
+    _, request_model = JOB_OPERATIONS[request.operation]
+    try:
+        request_model(**request.params)
+    except ValueError as e:
+        # Reject invalid params now rather than failing the job later
+        raise HTTPException(status_code=422, detail=str(e))
+
+    job = job_queue.submit(request.operation, request.params, request.priority)
+    return job.to_dict()
+
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[JobStatus] = None):
+    """List retained jobs, newest first, plus queue stats."""
+    jobs = sorted(job_queue.jobs.values(), key=lambda job: job.created_at, reverse=True)
+    if status is not None:
+        jobs = [job for job in jobs if job.status == status]
+    return {"queue": job_queue.stats(), "jobs": [job.to_dict() for job in jobs]}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Current status, progress and (once finished) result of a job."""
+    return _get_job_or_404(job_id).to_dict()
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancel a job.
+
+    Queued jobs are dropped immediately. Running jobs are asked to stop:
+    video jobs stop at the next denoising step, other operations run to the
+    end. The job reports `cancelled` once its work has actually stopped.
+    """
+    _get_job_or_404(job_id)
+    return job_queue.cancel(job_id).to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-sent events stream of job snapshots until the job finishes."""
+    job = _get_job_or_404(job_id)
+
+    async def stream():
+        async for snapshot in job_queue.events(job, keepalive=15):
+            if snapshot is None:
+                if await request.is_disconnected():
+                    return
+                yield ": keepalive\n\n"  # keeps proxies from closing an idle stream
+                continue
+            yield f"event: {snapshot['status']}\ndata: {json.dumps(snapshot)}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # ============================================================================
 # Utility Endpoints
 # ============================================================================
@@ -882,7 +2226,7 @@ async def generate_depth_map(
     Generate a depth map from an image (legacy endpoint).
     Redirects to /depth/estimate.
     """
-    return await estimate_depth(image, model)
+    return await estimate_depth(image, model, output_format="png")
 
 
 @app.post("/utils/segment")
@@ -0,0 +1,242 @@
+"""
+Prometheus metrics in the text exposition format, without a client library.
+
+Three kinds of metric:
+- Counter / Histogram: updated where the work happens (thread-safe)
+- Callback metrics: read from existing stats (model cache, depth cache, job
+  queue, executors, memory) when /metrics is scraped, so the hot paths keep
+  their own counters and nothing is counted twice
+
+Request stages are timed into one histogram, labelled by stage:
+
+    with stage_timer("fetch"):
+        ...
+
+Stages: fetch, decode, model_load, inference, render, encode, upload.
+Profiled requests (see profiling.py) also get each stage as a trace span.
+"""
+
+import os
+import time
+import math
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from profiling import span as profile_span
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+LOAD_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def lines(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = STAGE_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (non-cumulative, last is +Inf), sum]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        lines = []
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    A gauge or counter whose samples come from `fn()` at scrape time, as
+    (label values, value) pairs; a bare number is one unlabelled sample.
+    """
+
+    def __init__(self, name: str, help: str, type: str, labelnames: Sequence[str],
+                 fn: Callable[[], object]):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self.fn = fn
+
+    def lines(self) -> List[str]:
+        samples = self.fn()
+        if samples is None:
+            return []
+        if isinstance(samples, (int, float)):
+            samples = [((), samples)]
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(float(value))}"
+                for key, value in samples if value is not None]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: "Dict[str, _Metric]" = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = STAGE_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge_callback(self, name: str, help: str, fn: Callable[[], object], labelnames: Sequence[str] = ()):
+        return self._add(CallbackMetric(name, help, "gauge", labelnames, fn))
+
+    def counter_callback(self, name: str, help: str, fn: Callable[[], object], labelnames: Sequence[str] = ()):
+        return self._add(CallbackMetric(name, help, "counter", labelnames, fn))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format. A failing callback only drops its own samples."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            try:
+                samples = metric.lines()
+            except Exception as e:
+                samples = [f"# {metric.name} collection failed: {_escape(e)}"]
+            lines.extend(metric.header())
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def process_rss_bytes() -> Optional[int]:
+    """Current resident set size of this process (Linux), or None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "gpu_worker_stage_seconds", "Time spent in each request stage", ("stage",)
+)
+MODEL_LOADS = registry.counter(
+    "gpu_worker_model_loads_total", "Model loads by source (cold, host, disk)", ("model", "source")
+)
+MODEL_LOAD_SECONDS = registry.histogram(
+    "gpu_worker_model_load_seconds", "Model load duration by source", ("model", "source"), buckets=LOAD_BUCKETS
+)
+registry.gauge_callback("gpu_worker_process_rss_bytes", "Resident set size of the worker process", process_rss_bytes)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time one stage into gpu_worker_stage_seconds (and a span, if the request is profiled)."""
+    with STAGE_SECONDS.time(stage=stage), profile_span(stage, "stage"):
+        yield
+
+
+def record_model_load(model: str, source: str, seconds: float):
+    """Count a model load (source: cold, host or disk) and time it, also as the model_load stage."""
+    MODEL_LOADS.inc(model=model, source=source)
+    MODEL_LOAD_SECONDS.observe(seconds, model=model, source=source)
+    STAGE_SECONDS.observe(seconds, stage="model_load")
+
+
+def labelled(values: Dict[str, Optional[float]]) -> Iterable[Tuple[Labels, Optional[float]]]:
+    """{label value: value} as callback samples for a metric with one label."""
+    return [((name,), value) for name, value in values.items()]
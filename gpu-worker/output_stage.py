@@ -0,0 +1,201 @@
+"""
+Shared output stage: depth/image arrays to encoded bytes.
+
+Depth leaves the model as raw float. When torch is already loaded on a GPU,
+it is normalized, resized to the output size and quantized on the device,
+so only the final uint8/uint16/float16 array is transferred. Without a GPU
+the same steps run in place on one float32 array.
+
+Formats:
+- png:   8-bit PNG, zlib level OUTPUT_PNG_COMPRESS_LEVEL
+- webp:  WebP at OUTPUT_WEBP_QUALITY (100 = lossless)
+- png16: 16-bit grayscale PNG (depth only)
+- npy:   raw float16 .npy in [0, 1] (depth only)
+
+Encoding is blocking and meant for the CPU executor. OutputStage records the
+count, output size and encode time per format.
+"""
+
+import io
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+from metrics import STAGE_SECONDS
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger("gpu-worker.output")
+
+OUTPUT_PNG_COMPRESS_LEVEL = int(os.getenv("OUTPUT_PNG_COMPRESS_LEVEL", "3"))
+OUTPUT_WEBP_QUALITY = int(os.getenv("OUTPUT_WEBP_QUALITY", "90"))
+
+IMAGE_FORMATS = ("png", "webp")
+DEPTH_FORMATS = ("png", "webp", "png16", "npy")
+CONTENT_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "png16": "image/png",
+    "npy": "application/octet-stream",
+}
+EXTENSIONS = {"png": ".png", "webp": ".webp", "png16": ".png", "npy": ".npy"}
+
+
+@dataclass
+class EncodedOutput:
+    data: bytes
+    format: str
+    encode_ms: float
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES[self.format]
+
+    def filename(self, stem: str) -> str:
+        return f"{stem}{EXTENSIONS[self.format]}"
+
+
+def check_format(output_format: str, depth: bool = False):
+    """Raise ValueError if `output_format` isn't available for this kind of output."""
+    allowed = DEPTH_FORMATS if depth else IMAGE_FORMATS
+    if output_format not in allowed:
+        raise ValueError(f"Unsupported output format: {output_format}. Available: {list(allowed)}")
+
+
+def _depth_scale(output_format: str) -> Tuple[float, str]:
+    """Full-scale value and numpy dtype name a normalized depth is quantized to."""
+    if output_format == "png16":
+        return 65535.0, "uint16"
+    if output_format == "npy":
+        return 1.0, "float16"
+    return 255.0, "uint8"
+
+
+def depth_finalizer(low: float, high: float, output_format: str) -> Tuple[Callable[["np.ndarray"], "np.ndarray"], Any]:
+    """
+    (finalize, dtype) mapping raw depth in [low, high] to the quantized output
+    values, for outputs assembled piecewise (e.g. tiling.merge_depth_tiles).
+    `finalize` scales its float32 input in place.
+    """
+    import numpy as np
+
+    full_scale, dtype = _depth_scale(output_format)
+    scale = full_scale / (high - low) if high > low else 0.0
+    offset = 0.5 if dtype != "float16" else 0.0
+
+    def finalize(values):
+        values -= low
+        values *= scale
+        values += offset
+        np.clip(values, 0, full_scale, out=values)
+        return values.astype(dtype)
+
+    return finalize, np.dtype(dtype)
+
+
+def _quantize_depth_on_device(depth, size: Tuple[int, int], output_format: str, device: str):
+    import numpy as np
+    import torch
+    import torch.nn.functional as F
+
+    width, height = size
+    full_scale, dtype = _depth_scale(output_format)
+    with torch.no_grad():
+        # Cached depth is read-only; the writable copy is at model resolution, so it's small
+        tensor = torch.from_numpy(np.array(depth, dtype=np.float32)).to(device)[None, None]
+        tensor = F.interpolate(tensor, size=(height, width), mode="bilinear", align_corners=False)[0, 0]
+        low, high = tensor.min(), tensor.max()
+        tensor.sub_(low).div_((high - low).clamp_min(1e-12))
+        if dtype == "float16":
+            return tensor.half().cpu().numpy()
+        tensor.mul_(full_scale).add_(0.5).clamp_(0, full_scale)
+        if dtype == "uint8":
+            return tensor.to(torch.uint8).cpu().numpy()
+        # No uint16 transfers in torch: ship int16 offset by 32768 and flip the sign bit back in place
+        shifted = tensor.floor_().sub_(32768).to(torch.int16).cpu().numpy().view("uint16")
+        shifted ^= 0x8000
+        return shifted
+
+
+def quantize_depth(depth, size: Tuple[int, int], output_format: str, device: Optional[str] = None) -> "np.ndarray":
+    """
+    Normalize raw depth to [0, 1], bilinearly resize to `size` (width, height)
+    and quantize for `output_format`: uint8, uint16 (png16) or float16 (npy).
+
+    With a CUDA `device` all of it happens before the device-to-host copy.
+    """
+    if device is not None and device != "cpu":
+        return _quantize_depth_on_device(depth, size, output_format, device)
+
+    import cv2
+    import numpy as np
+
+    resized = cv2.resize(np.asarray(depth, dtype=np.float32), size, interpolation=cv2.INTER_LINEAR)
+    finalize, _ = depth_finalizer(float(resized.min()), float(resized.max()), output_format)
+    return finalize(resized)
+
+
+class OutputStage:
+    """Encodes arrays and PIL images to output bytes and keeps per-format metrics."""
+
+    def __init__(self, png_compress_level: int = OUTPUT_PNG_COMPRESS_LEVEL, webp_quality: int = OUTPUT_WEBP_QUALITY):
+        self.png_compress_level = png_compress_level
+        self.webp_quality = webp_quality
+        self._lock = threading.Lock()
+        self._formats: Dict[str, Dict[str, float]] = {}
+
+    def encode(self, image, output_format: str = "png") -> EncodedOutput:
+        """
+        Encode a PIL image or an array (HxWx3 / HxW uint8, HxW uint16 for
+        png16, float16 for npy). Contiguous arrays are wrapped, not copied.
+        """
+        from PIL import Image
+
+        started = time.perf_counter()
+        buffer = io.BytesIO()
+        if output_format == "npy":
+            import numpy as np
+
+            np.save(buffer, image, allow_pickle=False)
+        else:
+            if not isinstance(image, Image.Image):
+                image = Image.fromarray(image)
+            if output_format == "webp":
+                if self.webp_quality >= 100:
+                    image.save(buffer, format="WEBP", lossless=True)
+                else:
+                    image.save(buffer, format="WEBP", quality=self.webp_quality)
+            else:
+                image.save(buffer, format="PNG", compress_level=self.png_compress_level)
+        data = buffer.getvalue()
+        encode_ms = (time.perf_counter() - started) * 1000
+        self._record(output_format, len(data), encode_ms)
+        return EncodedOutput(data=data, format=output_format, encode_ms=round(encode_ms, 1))
+
+    def _record(self, output_format: str, size: int, encode_ms: float):
+        STAGE_SECONDS.observe(encode_ms / 1000, stage="encode")
+        with self._lock:
+            entry = self._formats.setdefault(output_format, {"count": 0, "bytes": 0, "encode_ms": 0.0})
+            entry["count"] += 1
+            entry["bytes"] += size
+            entry["encode_ms"] += encode_ms
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "png_compress_level": self.png_compress_level,
+                "webp_quality": self.webp_quality,
+                "formats": {
+                    name: {
+                        "count": entry["count"],
+                        "total_mb": round(entry["bytes"] / 1024**2, 2),
+                        "mean_kb": round(entry["bytes"] / entry["count"] / 1024, 1),
+                        "mean_encode_ms": round(entry["encode_ms"] / entry["count"], 1),
+                    }
+                    for name, entry in self._formats.items()
+                },
+            }
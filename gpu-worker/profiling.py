@@ -0,0 +1,405 @@
+"""
+Opt-in per-request profiling, exported as Chrome trace JSON.
+
+Profiling is off unless the worker runs with PROFILE_ENABLED=1. Any client
+can ask for a profile, and a profiled request runs several times slower and
+stores a trace artifact, so only enable it on workers you are investigating.
+
+When enabled, a request is profiled when it carries an `X-Profile: 1` header (HTTP) or a
+`"profile": true` param (jobs and RunPod). Open the trace in Perfetto or
+chrome://tracing. It combines:
+- spans for each request stage (stage_timer) and each executor call
+- Python and native (C) calls made by the request's work on executor and
+  tile threads, via sys.setprofile while that work runs; calls shorter than
+  PROFILE_MIN_US are dropped
+- torch.profiler operator and CUDA kernel events, when torch is loaded
+
+torch.profiler is process-wide. Its events cover everything the worker ran
+while the profile was open, including work for other concurrent requests,
+so the torch part of a trace is only clean when the request ran alone. Only
+one profile at a time records torch events; the others report
+`profile_torch: busy`.
+
+The active Profile lives in the `current_profile` context variable, which
+follows the request into executor threads. With profiling off, the cost is
+one context variable lookup per stage and executor call.
+
+The event loop thread is never traced with sys.setprofile, since it is
+shared with other requests; async work shows up as spans only.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import tempfile
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("gpu-worker.profiling")
+
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+PROFILE_MIN_US = float(os.getenv("PROFILE_MIN_US", "20"))
+PROFILE_MAX_EVENTS = int(os.getenv("PROFILE_MAX_EVENTS", "200000"))
+PROFILE_TORCH = os.getenv("PROFILE_TORCH", "1") == "1"
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ARTIFACT_HEADER = b"x-profile-artifact-id"
+
+_TRUE_VALUES = {"1", "true", "yes", "on"}
+
+# torch.profiler is process-wide; concurrent profiles get Python traces only
+_torch_lock = threading.Lock()
+
+
+def requested(value: Any) -> bool:
+    """Whether a header value or job param asks for profiling (and profiling is enabled)."""
+    return PROFILE_ENABLED and value is not None and str(value).strip().lower() in _TRUE_VALUES
+
+
+def _track() -> Tuple[int, str]:
+    """Trace track for the caller: its asyncio task on the event loop, else its thread."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return id(task), f"task {task.get_name()}"
+    thread = threading.current_thread()
+    return thread.ident, thread.name
+
+
+def _call_name(code_or_function: Any, native: bool) -> str:
+    if not native:
+        code = code_or_function
+        name = getattr(code, "co_qualname", code.co_name)
+        return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    function = code_or_function
+    name = getattr(function, "__qualname__", None) or getattr(function, "__name__", None) or repr(function)
+    module = getattr(function, "__module__", None)
+    return f"{module}.{name}" if module else name
+
+
+class Profile:
+    """
+    Trace events for one request.
+
+    start() begins the torch profile if possible; stop() ends it and returns
+    the Chrome trace as JSON bytes (blocking; run it on an executor).
+    """
+
+    def __init__(self, name: str, min_us: float = PROFILE_MIN_US, max_events: int = PROFILE_MAX_EVENTS):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.min_ns = int(min_us * 1000)
+        self.max_events = max_events
+        self.torch_status = "not loaded"
+        self.dropped = 0
+        self._stopped = False
+        self._torch = None
+        self._started_ns = 0
+        self._track: Tuple[int, str] = (0, "")
+        # perf_counter_ns -> wall clock, so torch events can be lined up
+        self._epoch_offset_ns = time.time_ns() - time.perf_counter_ns()
+        # (track id, start ns, duration ns, name, category, args)
+        self._spans: List[tuple] = []
+        # (thread id, start ns, duration ns, code or C function, native)
+        self._calls: List[tuple] = []
+        self._tracks: Dict[int, str] = {}
+
+    @property
+    def event_count(self) -> int:
+        return len(self._spans) + len(self._calls)
+
+    def start(self):
+        self._started_ns = time.perf_counter_ns()
+        self._track = _track()
+        self._tracks[self._track[0]] = self._track[1]
+        if not PROFILE_TORCH:
+            self.torch_status = "disabled"
+        elif "torch" in sys.modules:
+            self._start_torch()
+
+    def _start_torch(self):
+        if not _torch_lock.acquire(blocking=False):
+            self.torch_status = "busy"
+            return
+        try:
+            import torch
+            from torch.profiler import ProfilerActivity, profile
+
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+            self._torch = profile(activities=activities)
+            self._torch.start()
+            self.torch_status = "recording"
+        except Exception as e:
+            self._torch = None
+            self.torch_status = f"failed: {e}"
+            _torch_lock.release()
+
+    @contextmanager
+    def span(self, name: str, category: str = "span", **args):
+        """Record the enclosed block as one complete event on the caller's track."""
+        track, track_name = _track()
+        self._tracks[track] = track_name
+        started = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self._spans.append((track, started, time.perf_counter_ns() - started, name, category, args))
+
+    @contextmanager
+    def tracing(self):
+        """Trace Python and C calls on this thread for the enclosed block."""
+        if self._stopped or sys.getprofile() is not None:
+            # Already traced further up this thread's stack (or by another profiler)
+            yield
+            return
+        sys.setprofile(self._make_tracer())
+        try:
+            yield
+        finally:
+            sys.setprofile(None)
+
+    def _make_tracer(self) -> Callable:
+        thread = threading.current_thread()
+        self._tracks[thread.ident] = thread.name
+        tid = thread.ident
+        calls = self._calls
+        min_ns = self.min_ns
+        max_events = self.max_events
+        clock = time.perf_counter_ns
+        stack: list = []
+
+        def tracer(frame, event, arg):
+            if event == "call":
+                stack.append((clock(), frame.f_code, False))
+            elif event == "c_call":
+                stack.append((clock(), arg, True))
+            elif stack:
+                # return, c_return or c_exception; returns from frames entered before
+                # tracing started find the stack empty and are ignored
+                started, target, native = stack.pop()
+                duration = clock() - started
+                if duration >= min_ns:
+                    if len(calls) < max_events:
+                        calls.append((tid, started, duration, target, native))
+                    else:
+                        self.dropped += 1
+
+        return tracer
+
+    def stop(self) -> bytes:
+        """End the profile and return the Chrome trace JSON."""
+        if not self._stopped:
+            self._stopped = True
+            now = time.perf_counter_ns()
+            self._spans.append((self._track[0], self._started_ns, now - self._started_ns, self.name, "request", {}))
+        torch_events = self._stop_torch() if self._torch is not None else []
+
+        pid = os.getpid()
+        to_us = lambda ns: (ns + self._epoch_offset_ns) / 1000  # noqa: E731
+        events: List[Dict[str, Any]] = [
+            {"ph": "M", "name": "process_name", "pid": pid, "tid": 0, "args": {"name": "gpu-worker"}},
+        ]
+        events.extend(
+            {"ph": "M", "name": "thread_name", "pid": pid, "tid": track, "args": {"name": name}}
+            for track, name in list(self._tracks.items())
+        )
+        for track, started, duration, name, category, args in list(self._spans):
+            event = {"ph": "X", "name": name, "cat": category, "pid": pid, "tid": track,
+                     "ts": to_us(started), "dur": duration / 1000}
+            if args:
+                event["args"] = args
+            events.append(event)
+        names: Dict[Any, str] = {}
+        for tid, started, duration, target, native in list(self._calls):
+            name = names.get(target)
+            if name is None:
+                name = names[target] = _call_name(target, native)
+            events.append({"ph": "X", "name": name, "cat": "native" if native else "python", "pid": pid,
+                           "tid": tid, "ts": to_us(started), "dur": duration / 1000})
+        events.extend(torch_events)
+
+        return json.dumps({
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "profile_id": self.id,
+                "name": self.name,
+                "python_calls": len(self._calls),
+                "dropped_calls": self.dropped,
+                "min_call_us": self.min_ns / 1000,
+                "torch": self.torch_status,
+            },
+        }).encode()
+
+    def _stop_torch(self) -> List[Dict[str, Any]]:
+        profiler, self._torch = self._torch, None
+        path = None
+        try:
+            profiler.stop()
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+                path = f.name
+            profiler.export_chrome_trace(path)
+            with open(path) as f:
+                trace = json.load(f)
+        except Exception as e:
+            self.torch_status = f"failed: {e}"
+            return []
+        finally:
+            if path is not None and os.path.exists(path):
+                os.unlink(path)
+            _torch_lock.release()
+
+        self.torch_status = "recorded"
+        events = trace.get("traceEvents", [])
+        # Newer kineto writes timestamps relative to baseTimeNanoseconds
+        base_us = trace.get("baseTimeNanoseconds", 0) / 1000
+        if base_us:
+            for event in events:
+                if "ts" in event:
+                    event["ts"] = float(event["ts"]) + base_us
+        return events
+
+
+current_profile: contextvars.ContextVar[Optional[Profile]] = contextvars.ContextVar("current_profile", default=None)
+
+
+@contextmanager
+def span(name: str, category: str = "span", **args):
+    """Profile span around a block when the current request is profiled; otherwise a no-op."""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.span(name, category, **args):
+        yield
+
+
+def traced(fn: Callable, name: Optional[str] = None) -> Callable:
+    """
+    `fn` bound to the current profile: run on any thread, it records a span
+    and traces its calls. Returns `fn` itself when nothing is being profiled.
+
+    The profile is captured when traced() is called, so this also covers
+    thread pools that don't copy contextvars (e.g. the tile pool).
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return fn
+    label = name or getattr(fn, "__qualname__", None) or repr(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = current_profile.set(profile)
+        try:
+            with profile.span(label, "call"), profile.tracing():
+                return fn(*args, **kwargs)
+        finally:
+            current_profile.reset(token)
+
+    return wrapper
+
+
+def profiled(name: Optional[str] = None):
+    """
+    Decorator recording a function as a span when its request is profiled.
+
+    Sync functions also get their calls traced; coroutines get a span only,
+    since they run on the shared event loop thread.
+    """
+    def decorate(fn: Callable) -> Callable:
+        label = name or fn.__qualname__
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(label):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return traced(fn, label)(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+class ProfileMiddleware:
+    """
+    ASGI middleware that profiles requests sent with `X-Profile: 1`.
+
+    `finish(profile)` stops and stores the profile and returns fields such
+    as `profile_artifact_id`. They are merged into the `metadata` of JSON
+    responses shaped like ProcessingResponse, and the artifact ID is always
+    sent as an `X-Profile-Artifact-Id` header. Only JSON responses are
+    buffered; streaming responses pass through and the ID is only logged.
+    Requests without the header pass straight through.
+    """
+
+    def __init__(self, app, finish: Callable[[Profile], Awaitable[Dict[str, Any]]]):
+        self.app = app
+        self.finish = finish
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILE_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        value = next((v for k, v in scope.get("headers", ()) if k == PROFILE_HEADER), None)
+        if value is None or not requested(value.decode("latin-1")):
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(f"{scope['method']} {scope['path']}")
+        start_message: Optional[dict] = None
+        body: List[bytes] = []
+        buffering = False
+
+        async def capture(message):
+            nonlocal start_message, buffering
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", ()))
+                buffering = headers.get(b"content-type", b"").startswith(b"application/json")
+                if buffering:
+                    start_message = message
+                    return
+            elif message["type"] == "http.response.body" and buffering:
+                body.append(message.get("body", b""))
+                return
+            await send(message)
+
+        token = current_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            current_profile.reset(token)
+            info = await self.finish(profile)
+            logger.info(f"Profiled {profile.name}: {info}")
+
+        if start_message is None:
+            return
+        payload = b"".join(body)
+        try:
+            document = json.loads(payload)
+        except ValueError:
+            document = None
+        if isinstance(document, dict) and "success" in document:
+            document["metadata"] = {**(document.get("metadata") or {}), **info}
+            payload = json.dumps(document).encode()
+        headers = [(k, v) for k, v in start_message.get("headers", ()) if k != b"content-length"]
+        headers.append((b"content-length", str(len(payload)).encode()))
+        if info.get("profile_artifact_id"):
+            headers.append((PROFILE_ARTIFACT_HEADER, str(info["profile_artifact_id"]).encode("latin-1")))
+        await send({**start_message, "headers": headers})
+        await send({"type": "http.response.body", "body": payload})
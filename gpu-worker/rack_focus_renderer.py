@@ -0,0 +1,147 @@
+"""
+Depth-layered rack focus renderer.
+
+Turns one image plus its depth map into a focus pull from one point to
+another, frame by frame, without re-blurring anything per frame:
+
+1. Precompute once: a stack of RACK_FOCUS_BLUR_LEVELS gaussian blurs of the
+   image (level 0 is sharp, the last is the widest circle of confusion), and
+   the depth map quantized into RACK_FOCUS_DEPTH_LAYERS layers.
+2. Per frame: the focus depth moves along an eased path. Every layer gets a
+   blur amount from its distance to the focus depth, expressed as a
+   fractional position in the stack. Each pixel blends the two nearest
+   levels by its layer's weights, so a frame costs a few multiply-adds per
+   pixel and grows linearly with the frame count.
+
+Depth Anything predicts relative inverse depth (disparity). The circle of
+confusion of a thin lens is proportional to |1/z - 1/z_focus|, so the
+normalized disparity difference is used directly.
+
+Frames are yielded as uint8 arrays so they can stream into the encoder.
+"""
+
+import os
+import logging
+from typing import TYPE_CHECKING, Iterator, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger("gpu-worker.rack-focus")
+
+RACK_FOCUS_BLUR_LEVELS = int(os.getenv("RACK_FOCUS_BLUR_LEVELS", "6"))
+RACK_FOCUS_DEPTH_LAYERS = int(os.getenv("RACK_FOCUS_DEPTH_LAYERS", "32"))
+RACK_FOCUS_MAX_EDGE = int(os.getenv("RACK_FOCUS_MAX_EDGE", "1920"))
+RACK_FOCUS_MAX_FRAMES = int(os.getenv("RACK_FOCUS_MAX_FRAMES", "1200"))
+MAX_BLUR_FRACTION = 0.02  # widest blur radius at blur_strength=1, as a fraction of the short side
+
+
+def _ease(t: float) -> float:
+    """Smoothstep: focus pulls start and land gently, like a follow-focus."""
+    return t * t * (3.0 - 2.0 * t)
+
+
+def prepare_inputs(rgb, depth, max_edge: int = RACK_FOCUS_MAX_EDGE) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Downscale the image to `max_edge` if needed and resize raw depth to match,
+    normalized to [0, 1] with 1 nearest.
+    """
+    import cv2
+    import numpy as np
+
+    height, width = rgb.shape[:2]
+    scale = min(1.0, max_edge / max(height, width))
+    if scale < 1.0:
+        width, height = max(2, int(width * scale)), max(2, int(height * scale))
+        rgb = cv2.resize(rgb, (width, height), interpolation=cv2.INTER_AREA)
+
+    depth = cv2.resize(np.asarray(depth, dtype=np.float32), (width, height), interpolation=cv2.INTER_LINEAR)
+    low, high = float(depth.min()), float(depth.max())
+    depth = (depth - low) / (high - low) if high > low else np.zeros_like(depth)
+    return np.ascontiguousarray(rgb), depth
+
+
+def sample_focus_depth(depth, point: Tuple[float, float]) -> float:
+    """Median normalized depth in a small window around a normalized (x, y) point."""
+    import numpy as np
+
+    height, width = depth.shape
+    x = min(width - 1, max(0, int(point[0] * (width - 1))))
+    y = min(height - 1, max(0, int(point[1] * (height - 1))))
+    radius = max(1, int(min(height, width) * 0.02))
+    window = depth[max(0, y - radius):y + radius + 1, max(0, x - radius):x + radius + 1]
+    return float(np.median(window))
+
+
+class RackFocusRenderer:
+    """
+    Precomputed blur stack and depth layers for one image.
+
+        renderer = RackFocusRenderer(rgb, depth01, blur_strength=1.0)
+        for frame in renderer.frames(start_depth, end_depth, num_frames):
+            encoder.write_frame(frame)
+    """
+
+    def __init__(self, rgb, depth, blur_strength: float = 1.0,
+                 levels: int = RACK_FOCUS_BLUR_LEVELS, layers: int = RACK_FOCUS_DEPTH_LAYERS):
+        import cv2
+        import numpy as np
+
+        self.height, self.width = rgb.shape[:2]
+        self.levels = max(2, levels)
+        self.layers = max(2, min(256, layers))
+        self.max_radius = blur_strength * MAX_BLUR_FRACTION * min(self.height, self.width)
+
+        # Level k blurs with radius max_radius * k / (levels - 1); sigma ~ radius / 2
+        source = rgb.astype(np.float32)
+        self.stack = [source]
+        for level in range(1, self.levels):
+            sigma = max(0.3, self.max_radius * level / (self.levels - 1) / 2)
+            self.stack.append(cv2.GaussianBlur(source, (0, 0), sigmaX=sigma))
+
+        # Quantized depth: per-pixel layer index, and each layer's centre depth
+        # Clip before the narrow cast: depth 1.0 * 256 layers would wrap to layer 0
+        self.layer_index = np.clip(depth * self.layers, 0, self.layers - 1).astype(np.uint8)
+        self.layer_depth = (np.arange(self.layers, dtype=np.float32) + 0.5) / self.layers
+
+        self._accumulator = np.empty((self.height, self.width, 3), dtype=np.float32)
+        self._scratch = np.empty_like(self._accumulator)
+
+    def level_weights(self, focus_depth: float) -> "np.ndarray":
+        """(levels, layers) blend weights: a hat function around each layer's stack position."""
+        import numpy as np
+
+        # Circle of confusion in [0, 1] of the widest level, per layer
+        position = np.clip(np.abs(self.layer_depth - focus_depth) * 2.0, 0.0, 1.0) * (self.levels - 1)
+        levels = np.arange(self.levels, dtype=np.float32)[:, None]
+        return np.clip(1.0 - np.abs(position[None, :] - levels), 0.0, 1.0).astype(np.float32)
+
+    def render(self, focus_depth: float) -> "np.ndarray":
+        """One frame focused at a normalized depth, as HxWx3 uint8."""
+        import numpy as np
+
+        weights = self.level_weights(focus_depth)
+        out = self._accumulator
+        out.fill(0.0)
+        for level, layer_weights in enumerate(weights):
+            if not layer_weights.any():
+                continue  # no layer uses this level in this frame
+            pixel_weights = layer_weights[self.layer_index]  # gather: layers -> pixels
+            np.multiply(self.stack[level], pixel_weights[:, :, None], out=self._scratch)
+            out += self._scratch
+        np.add(out, 0.5, out=out)
+        np.clip(out, 0, 255, out=out)
+        return out.astype(np.uint8)
+
+    def frames(self, start_depth: float, end_depth: float, num_frames: int) -> Iterator["np.ndarray"]:
+        """Yield the focus pull from `start_depth` to `end_depth` over `num_frames` frames."""
+        for index in range(num_frames):
+            t = _ease(index / max(1, num_frames - 1))
+            yield self.render(start_depth + (end_depth - start_depth) * t)
+
+
+def rack_focus_frame_count(duration_seconds: float, fps: int) -> int:
+    num_frames = max(2, int(round(duration_seconds * fps)))
+    if num_frames > RACK_FOCUS_MAX_FRAMES:
+        raise ValueError(f"Rack focus of {num_frames} frames exceeds RACK_FOCUS_MAX_FRAMES={RACK_FOCUS_MAX_FRAMES}")
+    return num_frames
@@ -7,16 +7,28 @@ It wraps the FastAPI endpoints for serverless execution.
 Usage:
     Deploy this with the Dockerfile to RunPod Serverless.
     The handler will receive jobs and route them to the appropriate endpoint.
+
+The handler is a coroutine, so runpod awaits every job on its own long-lived
+event loop. Pooled HTTP clients, the depth batcher and other loop-bound state
+stay warm across jobs. Up to RUNPOD_CONCURRENCY jobs are taken at once: their
+fetches, uploads and encodes overlap, and device work still queues on the
+bounded executors.
 """
 
 import os
 import runpod
+import asyncio
 import logging
 import time
+from typing import Any, Dict, List
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("runpod-handler")
 
+# Serverless workers don't serve HTTP, so /artifacts URLs would be unreachable;
+# inline outputs as data: URLs unless R2 is configured.
+os.environ.setdefault("ARTIFACT_FALLBACK", "base64")
+
 # Import the FastAPI app for direct calls (more efficient than HTTP)
 from main import (
     rack_focus,
@@ -24,14 +36,29 @@ from main import (
     rescue_focus,
     director_edit,
     generate_video,
-    estimate_depth,
+    estimate_depth_from_url,
+    job_model_family,
+    gpu_status,
+    DepthEstimateRequest,
     RackFocusRequest,
     LensCharacterRequest,
     FocusRescueRequest,
     DirectorEditRequest,
     VideoGenerationRequest,
     model_manager,
+    run_profiled,
+    warmup,
 )
+from executors import get_executor, executor_stats
+from metrics import registry as metrics_registry
+from profiling import requested as profile_requested
+
+RUNPOD_CONCURRENCY = int(os.getenv("RUNPOD_CONCURRENCY", "4"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+
+# Probes and listings, which don't count as the first request (as on the HTTP side)
+UNTIMED_OPERATIONS = {"health", "metrics", "models"}
 
 # Operation handlers - mapping operation names to (handler_fn, request_model)
 HANDLERS = {
@@ -39,6 +66,7 @@ HANDLERS = {
     "lens_character": (lens_character, LensCharacterRequest),
     "rescue_focus": (rescue_focus, FocusRescueRequest),
     "director_edit": (director_edit, DirectorEditRequest),
+    "depth_estimate": (estimate_depth_from_url, DepthEstimateRequest),
     "video_generate": (generate_video, VideoGenerationRequest),
     "video_t2v": (generate_video, VideoGenerationRequest),
     "video_i2v": (generate_video, VideoGenerationRequest),
@@ -53,10 +81,13 @@ async def process_job_async(job: dict) -> dict:
     {
         "id": "job-uuid",
         "input": {
-            "operation": "rack_focus|lens_character|rescue_focus|director_edit|video_generate|health",
+            "operation": "rack_focus|lens_character|rescue_focus|director_edit|depth_estimate|video_generate|batch|health|metrics",
             "params": { ... operation-specific parameters ... }
         }
     }
+
+    Add "profile": true to params to get a Chrome trace of the operation;
+    its ID and URL come back in the result's metadata.
     """
     job_input = job.get("input", {})
     operation = job_input.get("operation")
@@ -66,17 +97,21 @@ async def process_job_async(job: dict) -> dict:
 
     # Health check - special case
     if operation == "health":
-        import torch
         return {
             "success": True,
             "status": "healthy",
-            "device": "cuda" if torch.cuda.is_available() else "cpu",
-            "gpu_available": torch.cuda.is_available(),
-            "gpu_name": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+            **gpu_status(),
             "gpu_memory_gb": model_manager.get_vram_usage(),
             "loaded_models": list(model_manager.models.keys()) + list(model_manager.pipelines.keys()),
+            "model_cache": model_manager.cache_stats(),
+            "executors": executor_stats(),
+            "warmup": warmup.stats(),
         }
 
+    # Prometheus text, for workers that can't be scraped over HTTP
+    if operation == "metrics":
+        return {"success": True, "metrics": metrics_registry.render()}
+
     # Models list - special case
     if operation == "models":
         return {
@@ -90,6 +125,7 @@ async def process_job_async(job: dict) -> dict:
             ],
             "loaded": list(model_manager.models.keys()) + list(model_manager.pipelines.keys()),
             "vram": model_manager.get_vram_usage(),
+            "model_cache": model_manager.cache_stats(),
         }
 
     # Unload models - special case
@@ -100,10 +136,18 @@ async def process_job_async(job: dict) -> dict:
             "vram": model_manager.get_vram_usage(),
         }
 
+    if operation == "batch":
+        return await process_batch(job, params)
+
+    return await run_operation(operation, params)
+
+
+async def run_operation(operation: str, params: dict) -> dict:
+    """Validate params and run one handler, returning its response as a dict."""
     if operation not in HANDLERS:
         return {
             "success": False,
-            "error": f"Unknown operation: {operation}. Available: {list(HANDLERS.keys()) + ['health', 'models', 'unload']}",
+            "error": f"Unknown operation: {operation}. Available: {list(HANDLERS.keys()) + ['health', 'metrics', 'models', 'unload', 'batch']}",
         }
 
     handler_fn, request_model = HANDLERS[operation]
@@ -112,6 +156,9 @@ async def process_job_async(job: dict) -> dict:
         # Validate and create request
         request = request_model(**params)
 
+        if profile_requested(params.get("profile")):
+            return await run_profiled(f"runpod {operation}", handler_fn, request)
+
         # Call the handler directly (it's an async function)
         result = await handler_fn(request)
 
@@ -128,21 +175,111 @@ async def process_job_async(job: dict) -> dict:
         }
 
 
-def handler(job: dict) -> dict:
+async def process_batch(job: dict, params: dict) -> dict:
     """
-    Synchronous wrapper for RunPod serverless.
-    RunPod expects a synchronous handler that returns a dict.
+    Run many sub-jobs in one invocation.
+
+    Params:
+    {
+        "items": [{"operation": "depth_estimate", "params": {...}}, ...],
+        "max_concurrency": 16,   # optional, items in flight at once
+        "stream": false          # optional, send each result as a runpod progress update
+    }
 
-    IMPORTANT: Always use asyncio.run() to create a fresh event loop.
-    Do NOT try to reuse an existing loop - it causes deadlocks with RunPod's worker.
+    Items are grouped by model family and the groups run one after another,
+    so each model is loaded once. Within a group items run concurrently:
+    depth requests coalesce into batched forward passes, and fetches and
+    uploads overlap. Results come back in input order, with per-item errors.
     """
-    import asyncio
+    start_time = time.time()
+    items = params.get("items")
+    if not isinstance(items, list) or not items:
+        return {"success": False, "error": "batch requires a non-empty 'items' list"}
+    if len(items) > BATCH_MAX_ITEMS:
+        return {"success": False, "error": f"batch has {len(items)} items; the limit is {BATCH_MAX_ITEMS}"}
+
+    try:
+        max_concurrency = int(params.get("max_concurrency", BATCH_MAX_CONCURRENCY))
+    except (TypeError, ValueError):
+        return {"success": False, "error": f"max_concurrency must be an integer, got {params.get('max_concurrency')!r}"}
+    # More slots than items would never be used
+    max_concurrency = min(max(1, max_concurrency), len(items))
+    stream = bool(params.get("stream", False))
+    slots = asyncio.Semaphore(max_concurrency)
+    results: List[Dict[str, Any]] = [None] * len(items)
+    completed = 0
+
+    async def run_item(index: int, item: Any):
+        nonlocal completed
+        if not isinstance(item, dict) or item.get("operation") not in HANDLERS:
+            operation = item.get("operation") if isinstance(item, dict) else None
+            result = {"success": False, "error": f"Unsupported batch operation: {operation}"}
+        else:
+            async with slots:
+                result = await run_operation(item["operation"], item.get("params", {}))
+        result = {"index": index, "operation": item.get("operation") if isinstance(item, dict) else None, **result}
+        results[index] = result
+        completed += 1
+        if stream:
+            await _send_progress(job, {"completed": completed, "total": len(items), "result": result})
+
+    # Group by model family, keeping families in order of first appearance
+    groups: Dict[Any, List[int]] = {}
+    for index, item in enumerate(items):
+        family = None
+        if isinstance(item, dict) and item.get("operation") in HANDLERS and isinstance(item.get("params", {}), dict):
+            family = job_model_family(item["operation"], item.get("params", {}))
+        groups.setdefault(family, []).append(index)
+
+    for family, indices in groups.items():
+        logger.info(f"Batch {job.get('id')}: running {len(indices)} item(s) for family {family}")
+        await asyncio.gather(*(run_item(index, items[index]) for index in indices))
+
+    failed = sum(1 for result in results if not result.get("success"))
+    return {
+        "success": True,
+        "total": len(items),
+        "succeeded": len(items) - failed,
+        "failed": failed,
+        "processing_time_ms": int((time.time() - start_time) * 1000),
+        "results": results,
+    }
+
+
+async def _send_progress(job: dict, update: dict):
+    """Publish a partial result through runpod's progress updates (a blocking HTTP call)."""
+    try:
+        await get_executor("io").run(runpod.serverless.progress_update, job, update)
+    except Exception as e:
+        logger.warning(f"Progress update failed: {e}")
+
+
+async def handler(job: dict) -> dict:
+    """
+    Async entry point for RunPod serverless.
+
+    runpod awaits this on its worker loop. Blocking compute runs on the
+    executors, so the loop is never blocked; there is no nested asyncio.run()
+    or run_until_complete() that could deadlock against runpod's own loop.
+    """
+    operation = (job.get("input") or {}).get("operation")
+    if warmup.first_request_at is not None or operation in UNTIMED_OPERATIONS:
+        return await process_job_async(job)
+    started = time.time()
+    try:
+        return await process_job_async(job)
+    finally:
+        warmup.mark_first_request(started, time.time())
+
 
-    # Always create a fresh event loop - RunPod's internal loop should not be reused
-    return asyncio.run(process_job_async(job))
+def concurrency_modifier(current_concurrency: int) -> int:
+    """How many jobs runpod may hand this worker at once."""
+    return max(1, RUNPOD_CONCURRENCY)
 
 
 if __name__ == "__main__":
     # Start the RunPod serverless worker
-    logger.info("Starting RunPod serverless worker...")
-    runpod.serverless.start({"handler": handler})
+    # Warm PRELOAD_MODELS before taking jobs; runpod only sends work once start() runs
+    warmup.run_blocking()
+    logger.info(f"Starting RunPod serverless worker (concurrency {RUNPOD_CONCURRENCY})...")
+    runpod.serverless.start({"handler": handler, "concurrency_modifier": concurrency_modifier})
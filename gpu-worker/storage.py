@@ -0,0 +1,522 @@
+"""
+Object storage uploads for GPU worker outputs (Cloudflare R2 or any S3-compatible store).
+
+One long-lived boto3 client is shared by all uploads; boto3 clients are
+thread-safe and keep their own connection pool. Uploads run on the "io"
+executor so multi-hundred-MB videos never block the event loop.
+
+- Small objects: a single put_object.
+- Large objects: boto3 managed transfer with concurrent multipart parts.
+- Outputs still being produced: `open_stream()` returns a writer that uploads
+  each part as soon as it fills, so the upload overlaps with encoding.
+
+Point R2_ENDPOINT_URL at MinIO or moto to run against a local stand-in.
+
+Without object storage, outputs go to a local ArtifactStore and are served
+by the worker itself instead of being inlined as base64 data URLs.
+"""
+
+import io
+import os
+import base64
+import re
+import time
+import uuid
+import logging
+import mimetypes
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from executors import get_executor
+
+logger = logging.getLogger("gpu-worker.storage")
+
+MIN_PART_SIZE = 5 * 1024**2  # S3 minimum for every part except the last
+
+
+class StreamingUpload:
+    """
+    File-like writer that multipart-uploads data while it is being written.
+
+    Parts are uploaded on the uploader's part pool as soon as `part_size`
+    bytes are buffered; at most `max_concurrency` parts are held in memory.
+    Outputs that never fill a part are sent with a single put_object on close.
+    """
+
+    def __init__(self, uploader: "ObjectUploader", key: str, content_type: str):
+        self.uploader = uploader
+        self.key = key
+        self.content_type = content_type
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[Future] = []
+        self._slots = threading.Semaphore(uploader.max_concurrency)
+        self._closed = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._closed:
+            raise ValueError("write to closed upload stream")
+        self._buffer += data
+        self.bytes_written += len(data)
+        part_size = self.uploader.part_size
+        while len(self._buffer) >= part_size:
+            part = bytes(self._buffer[:part_size])
+            del self._buffer[:part_size]
+            self._submit_part(part)
+        return len(data)
+
+    def close(self) -> str:
+        """Finish the upload and return the object's public URL."""
+        if self._closed:
+            return self.uploader.public_url(self.key)
+        self._closed = True
+        client = self.uploader.client
+        try:
+            if self._upload_id is None:
+                client.put_object(
+                    Bucket=self.uploader.bucket,
+                    Key=self.key,
+                    Body=bytes(self._buffer),
+                    ContentType=self.content_type,
+                )
+            else:
+                if self._buffer:
+                    self._submit_part(bytes(self._buffer))
+                parts = [future.result() for future in self._parts]
+                client.complete_multipart_upload(
+                    Bucket=self.uploader.bucket,
+                    Key=self.key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+        return self.uploader.public_url(self.key)
+
+    def abort(self):
+        """Discard any uploaded parts."""
+        self._closed = True
+        if self._upload_id is None:
+            return
+        for future in self._parts:
+            future.cancel()
+        try:
+            self.uploader.client.abort_multipart_upload(
+                Bucket=self.uploader.bucket, Key=self.key, UploadId=self._upload_id
+            )
+        except Exception as e:
+            logger.warning(f"Aborting multipart upload {self.key} failed: {e}")
+        self._upload_id = None
+
+    def __enter__(self) -> "StreamingUpload":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def _submit_part(self, data: bytes):
+        if self._upload_id is None:
+            response = self.uploader.client.create_multipart_upload(
+                Bucket=self.uploader.bucket, Key=self.key, ContentType=self.content_type
+            )
+            self._upload_id = response["UploadId"]
+        # Backpressure: block the producer while max_concurrency parts are pending
+        self._slots.acquire()
+        part_number = len(self._parts) + 1
+        try:
+            future = self.uploader.part_pool.submit(self._upload_part, part_number, data)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Done callbacks also run for parts cancelled before they started
+        future.add_done_callback(lambda _: self._slots.release())
+        self._parts.append(future)
+
+    def _upload_part(self, part_number: int, data: bytes) -> Dict[str, Any]:
+        response = self.uploader.client.upload_part(
+            Bucket=self.uploader.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+
+class ObjectUploader:
+    """Long-lived S3/R2 client with off-loop, multipart-capable uploads."""
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        access_key: str,
+        secret_key: str,
+        bucket: str,
+        public_url_base: str,
+        part_size: int = 8 * 1024**2,
+        max_concurrency: int = 4,
+    ):
+        self.endpoint_url = endpoint_url
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket = bucket
+        self.public_url_base = public_url_base.rstrip("/")
+        self.part_size = max(MIN_PART_SIZE, part_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.part_pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="upload-part")
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The shared boto3 client, created on first use."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import boto3
+                    from botocore.config import Config
+
+                    self._client = boto3.client(
+                        "s3",
+                        endpoint_url=self.endpoint_url,
+                        aws_access_key_id=self.access_key,
+                        aws_secret_access_key=self.secret_key,
+                        config=Config(
+                            signature_version="s3v4",
+                            max_pool_connections=self.max_concurrency * 2 + 4,
+                            retries={"max_attempts": 3, "mode": "standard"},
+                        ),
+                    )
+        return self._client
+
+    def public_url(self, key: str) -> str:
+        return f"{self.public_url_base}/{key}"
+
+    def put_bytes(self, data: bytes, key: str, content_type: str) -> str:
+        """Blocking upload of a complete object; multipart with concurrent parts when large."""
+        if len(data) < self.part_size:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+        else:
+            from boto3.s3.transfer import TransferConfig
+
+            self.client.upload_fileobj(
+                io.BytesIO(data),
+                self.bucket,
+                key,
+                ExtraArgs={"ContentType": content_type},
+                Config=TransferConfig(
+                    multipart_threshold=self.part_size,
+                    multipart_chunksize=self.part_size,
+                    max_concurrency=self.max_concurrency,
+                ),
+            )
+        return self.public_url(key)
+
+    async def upload(self, data: bytes, key: str, content_type: str) -> str:
+        """Upload a complete object on the io executor and return its public URL."""
+        return await get_executor("io").run(self.put_bytes, data, key, content_type)
+
+    def open_stream(self, key: str, content_type: str) -> StreamingUpload:
+        """Start an upload that is fed incrementally with write() and finished with close()."""
+        return StreamingUpload(self, key, content_type)
+
+    def shutdown(self):
+        self.part_pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ArtifactStore:
+    """
+    Local disk store for outputs when object storage isn't configured.
+
+    Artifacts are written once and served by GET /artifacts/{id}. IDs are a
+    random hex token plus the file extension, so the content type can be
+    recovered without a sidecar. Files older than `ttl_seconds` are deleted,
+    and the oldest files go first when the store exceeds `max_bytes`.
+
+    cleanup() scans the directory, so writes don't call it each time: they
+    add to a running size estimate and only trigger a scan once it passes
+    `max_bytes`. A size-triggered cleanup trims down to CLEANUP_LOW_WATER of
+    `max_bytes`, so a full store isn't rescanned on every write. Expiry runs
+    on the caller's timer.
+    """
+
+    CLEANUP_LOW_WATER = 0.9
+
+    ID_PATTERN = re.compile(r"^[0-9a-f]{32}\.[a-z0-9]{1,8}$")
+
+    def __init__(self, root: str, ttl_seconds: float, max_bytes: int, url_base: str = ""):
+        self.root = root
+        self.url_base = url_base.rstrip("/")
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.removed = 0
+        self.scans = 0
+        # Store size as of the last scan plus bytes written since; None until the first scan
+        self._estimated_bytes: Optional[int] = None
+
+    def save(self, data: bytes, filename: str) -> str:
+        """Blocking write of a complete artifact; returns its ID."""
+        artifact_id = self._new_id(filename)
+        path = self.path_for(artifact_id)
+        os.makedirs(self.root, exist_ok=True)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+        self.added(len(data))
+        return artifact_id
+
+    async def store(self, data: bytes, filename: str) -> str:
+        """Write an artifact on the io executor and return its ID."""
+        return await get_executor("io").run(self.save, data, filename)
+
+    def open_writer(self, filename: str) -> "ArtifactWriter":
+        """Start an artifact that is written incrementally; close() returns its URL."""
+        os.makedirs(self.root, exist_ok=True)
+        return ArtifactWriter(self, self._new_id(filename))
+
+    def path_for(self, artifact_id: str) -> str:
+        return os.path.join(self.root, artifact_id)
+
+    def public_url(self, artifact_id: str) -> str:
+        return f"{self.url_base}/{artifact_id}"
+
+    def resolve(self, artifact_id: str) -> Optional[Tuple[str, int, str]]:
+        """(path, size, content type) of a live artifact, or None if unknown or expired."""
+        if not self.ID_PATTERN.match(artifact_id):
+            return None
+        path = self.path_for(artifact_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if self.ttl_seconds and time.time() - stat.st_mtime > self.ttl_seconds:
+            return None
+        content_type = mimetypes.guess_type(artifact_id)[0] or "application/octet-stream"
+        return path, stat.st_size, content_type
+
+    def added(self, size: int):
+        """Account for a newly written artifact, cleaning up only if the store may be over max_bytes."""
+        if not self.max_bytes:
+            return
+        with self._lock:
+            if self._estimated_bytes is not None:
+                self._estimated_bytes += size
+            over = self._estimated_bytes is None or self._estimated_bytes > self.max_bytes
+        if over:
+            self.cleanup()
+
+    def cleanup(self) -> int:
+        """Delete expired artifacts, then the oldest until under max_bytes (low water if it was over)."""
+        with self._lock:
+            self.scans += 1
+            try:
+                entries = [entry for entry in os.scandir(self.root)
+                           if entry.is_file() and self.ID_PATTERN.match(entry.name)]
+            except FileNotFoundError:
+                self._estimated_bytes = 0
+                return 0
+            files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries)
+            now = time.time()
+            total = sum(size for _, size, _ in files)
+            limit = self.max_bytes
+            if self.max_bytes and total > self.max_bytes:
+                limit = int(self.max_bytes * self.CLEANUP_LOW_WATER)
+            removed = 0
+            for mtime, size, path in files:
+                expired = self.ttl_seconds and now - mtime > self.ttl_seconds
+                if not expired and (not self.max_bytes or total <= limit):
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self.removed += removed
+            self._estimated_bytes = total
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            files = [entry.stat().st_size for entry in os.scandir(self.root) if entry.is_file()]
+        except FileNotFoundError:
+            files = []
+        return {
+            "root": self.root,
+            "artifacts": len(files),
+            "size_mb": round(sum(files) / 1024**2, 1),
+            "max_mb": self.max_bytes // 1024**2,
+            "ttl_seconds": self.ttl_seconds,
+            "removed": self.removed,
+            "scans": self.scans,
+        }
+
+    def _new_id(self, filename: str) -> str:
+        extension = os.path.splitext(filename)[1].lower().lstrip(".") or "bin"
+        if not re.fullmatch(r"[a-z0-9]{1,8}", extension):
+            extension = "bin"
+        return f"{uuid.uuid4().hex}.{extension}"
+
+
+class ArtifactWriter:
+    """Incremental writer for one artifact; invisible to readers until close()."""
+
+    def __init__(self, store: ArtifactStore, artifact_id: str):
+        self.store = store
+        self.artifact_id = artifact_id
+        self._path = store.path_for(artifact_id)
+        self._file = open(f"{self._path}.tmp", "wb")
+
+    def write(self, data) -> int:
+        return self._file.write(data)
+
+    def close(self) -> str:
+        if not self._file.closed:
+            self._file.close()
+            os.replace(f"{self._path}.tmp", self._path)
+            self.store.added(os.path.getsize(self._path))
+        return self.store.public_url(self.artifact_id)
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.unlink(f"{self._path}.tmp")
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "ArtifactWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class DataUrlWriter:
+    """In-memory sink that returns a base64 data: URL, for when no storage is available."""
+
+    def __init__(self, content_type: str):
+        self.content_type = content_type
+        self._buffer = io.BytesIO()
+
+    def write(self, data) -> int:
+        return self._buffer.write(data)
+
+    def close(self) -> str:
+        encoded = base64.b64encode(self._buffer.getbuffer()).decode()
+        return f"data:{self.content_type};base64,{encoded}"
+
+    def abort(self):
+        self._buffer = io.BytesIO()
+
+    def __enter__(self) -> "DataUrlWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+
+
+class FallbackWriter:
+    """
+    Output writer that falls back down a list of destinations, like
+    upload_to_storage does for whole outputs.
+
+    Data goes to the first writer `factories` opens. If a write or close
+    fails, that writer is aborted and everything written so far is replayed
+    into the next one. The replay comes from a temporary spool file, which
+    is kept only while a fallback remains.
+    """
+
+    def __init__(self, factories: List[Callable[[], Any]]):
+        self._factories = list(factories)
+        self._spool = tempfile.TemporaryFile()
+        self._writer: Any = None
+        self._open_next(None)
+
+    def write(self, data) -> int:
+        if self._spool is not None:
+            self._spool.write(data)
+        try:
+            self._writer.write(data)
+        except Exception as e:
+            self._fail(e)
+        return len(data)
+
+    def close(self) -> str:
+        while True:
+            try:
+                url = self._writer.close()
+                break
+            except Exception as e:
+                self._fail(e)
+        self._close_spool()
+        return url
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.abort()
+        self._close_spool()
+
+    def __enter__(self) -> "FallbackWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def _fail(self, error: Exception):
+        logger.error(f"Output stream failed, falling back: {error}")
+        try:
+            self._writer.abort()
+        except Exception as e:
+            logger.warning(f"Aborting failed output stream: {e}")
+        self._writer = None
+        self._open_next(error)
+
+    def _open_next(self, error: Optional[Exception]):
+        """Open the next writer and replay the spool into it; raise if none is left."""
+        while self._factories:
+            writer = None
+            try:
+                writer = self._factories.pop(0)()
+                if self._spool is not None:
+                    self._spool.seek(0)
+                    for chunk in iter(lambda: self._spool.read(1 << 20), b""):
+                        writer.write(chunk)
+            except Exception as e:
+                logger.error(f"Fallback output stream failed: {e}")
+                if writer is not None:
+                    writer.abort()
+                error = e
+                continue
+            self._writer = writer
+            if not self._factories:
+                # The last writer has nothing to fall back to
+                self._close_spool()
+            return
+        self._close_spool()
+        raise error
+
+    def _close_spool(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
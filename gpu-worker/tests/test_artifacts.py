@@ -0,0 +1,92 @@
+import os
+import time
+
+import pytest
+
+from main import _parse_range
+from storage import ArtifactStore
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("BYTES = 0-0", (0, 0)),
+])
+def test_parse_range(header, expected):
+    assert _parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["items=0-1", "bytes=0-1,5-6", "bytes=a-b", "bytes=-", "bytes=1-x"])
+def test_parse_range_ignores_unsupported_headers(header):
+    assert _parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, size", [("bytes=1000-", 1000), ("bytes=5-4", 1000), ("bytes=-0", 1000), ("bytes=-1", 0)])
+def test_parse_range_rejects_unsatisfiable_ranges(header, size):
+    with pytest.raises(ValueError):
+        _parse_range(header, size)
+
+
+def age(store, artifact_id, seconds):
+    path = store.path_for(artifact_id)
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_ids_keep_the_extension_and_resolve_to_the_file(tmp_path):
+    store = ArtifactStore(str(tmp_path), ttl_seconds=3600, max_bytes=0, url_base="/artifacts")
+    artifact_id = store.save(b"mp4", "Clip.MP4")
+
+    assert artifact_id.endswith(".mp4")
+    assert store.public_url(artifact_id) == f"/artifacts/{artifact_id}"
+    assert store.resolve(artifact_id) == (store.path_for(artifact_id), 3, "video/mp4")
+    assert store.save(b"?", "weird.name!!").endswith(".bin")
+
+
+@pytest.mark.parametrize("artifact_id", ["../etc/passwd", "abc.png", "0" * 32 + ".png/..", "0" * 32 + ".png"])
+def test_unknown_or_malformed_ids_do_not_resolve(tmp_path, artifact_id):
+    store = ArtifactStore(str(tmp_path), ttl_seconds=3600, max_bytes=0)
+    assert store.resolve(artifact_id) is None
+
+
+def test_expired_artifacts_stop_resolving_and_are_cleaned_up(tmp_path):
+    store = ArtifactStore(str(tmp_path), ttl_seconds=60, max_bytes=0)
+    old, new = store.save(b"old", "a.png"), store.save(b"new", "b.png")
+    age(store, old, 120)
+
+    assert store.resolve(old) is None
+    assert store.cleanup() == 1
+    assert sorted(os.listdir(tmp_path)) == [new]
+
+
+def test_writer_is_invisible_until_closed(tmp_path):
+    store = ArtifactStore(str(tmp_path), ttl_seconds=3600, max_bytes=0)
+    writer = store.open_writer("video.mp4")
+    writer.write(b"frames")
+
+    assert store.resolve(writer.artifact_id) is None
+    writer.close()
+    assert store.resolve(writer.artifact_id)[1] == 6
+
+
+def test_over_budget_cleanup_removes_oldest_down_to_low_water(tmp_path):
+    store = ArtifactStore(str(tmp_path), ttl_seconds=0, max_bytes=1000)
+    ids = [store.save(b"x" * 100, f"{i}.png") for i in range(10)]
+    for i, artifact_id in enumerate(ids):
+        age(store, artifact_id, 100 - i)
+
+    newest = store.save(b"x" * 100, "new.png")  # 1100 bytes: trims to 900
+
+    assert sorted(os.listdir(tmp_path)) == sorted(ids[2:] + [newest])
+    assert store.removed == 2
+
+
+def test_writes_under_budget_do_not_rescan(tmp_path):
+    store = ArtifactStore(str(tmp_path), ttl_seconds=0, max_bytes=10_000)
+    for i in range(20):
+        store.save(b"x" * 100, f"{i}.png")
+
+    assert store.scans == 1  # the first write establishes the estimate
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+
+import pytest
+
+from depth_batcher import DepthBatcher
+from executors import DeviceExecutor
+
+
+@pytest.fixture
+def executor():
+    executor = DeviceExecutor("test", 1)
+    yield executor
+    executor.shutdown()
+
+
+def test_requests_within_the_window_share_one_batch(executor):
+    calls = []
+
+    def predict_batch(model, images):
+        calls.append((model, list(images)))
+        return [image * 10 for image in images]
+
+    batcher = DepthBatcher(predict_batch, lambda: executor, max_batch_size=8, max_wait_ms=20)
+
+    async def main():
+        return await asyncio.gather(*(batcher.predict("midas", i) for i in range(3)))
+
+    assert asyncio.run(main()) == [0, 10, 20]
+    assert calls == [("midas", [0, 1, 2])]
+    assert batcher.stats()["batch_size_histogram"] == {3: 1}
+
+
+def test_full_batch_flushes_without_waiting_and_models_batch_separately(executor):
+    calls = []
+
+    def predict_batch(model, images):
+        calls.append((model, list(images)))
+        return list(images)
+
+    batcher = DepthBatcher(predict_batch, lambda: executor, max_batch_size=2, max_wait_ms=10_000)
+
+    async def main():
+        return await asyncio.wait_for(
+            asyncio.gather(
+                batcher.predict("midas", 1),
+                batcher.predict("depth_anything", 2),
+                batcher.predict("midas", 3),
+                batcher.predict("depth_anything", 4),
+            ),
+            timeout=5,
+        )
+
+    assert asyncio.run(main()) == [1, 2, 3, 4]
+    assert sorted(calls) == [("depth_anything", [2, 4]), ("midas", [1, 3])]
+
+
+def test_failed_batch_fails_every_caller(executor):
+    def predict_batch(model, images):
+        raise RuntimeError("out of memory")
+
+    batcher = DepthBatcher(predict_batch, lambda: executor, max_batch_size=8, max_wait_ms=5)
+
+    async def main():
+        return await asyncio.gather(
+            batcher.predict("midas", 1), batcher.predict("midas", 2), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert [str(result) for result in results] == ["out of memory", "out of memory"]
+
+
+def test_short_result_list_does_not_strand_callers(executor):
+    batcher = DepthBatcher(lambda model, images: images[:1], lambda: executor, max_batch_size=2)
+
+    async def main():
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.predict("midas", 1), batcher.predict("midas", 2), return_exceptions=True),
+            timeout=5,
+        )
+
+    first, second = asyncio.run(main())
+    assert first == 1
+    assert isinstance(second, RuntimeError)
+
+
+def test_cancelled_batch_fails_its_callers_instead_of_hanging(executor):
+    started = threading.Event()
+    release = threading.Event()
+
+    def predict_batch(model, images):
+        started.set()
+        release.wait(5)
+        return images
+
+    batcher = DepthBatcher(predict_batch, lambda: executor, max_batch_size=1)
+
+    async def main():
+        caller = asyncio.ensure_future(batcher.predict("midas", 1))
+        while not batcher._tasks:
+            await asyncio.sleep(0)
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        for task in list(batcher._tasks):
+            task.cancel()
+        try:
+            return await asyncio.wait_for(caller, timeout=5)
+        finally:
+            release.set()
+
+    with pytest.raises(RuntimeError, match="ended without a result"):
+        asyncio.run(main())
+    assert not batcher._tasks
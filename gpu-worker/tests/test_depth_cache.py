@@ -0,0 +1,100 @@
+import os
+import threading
+
+import numpy as np
+
+from depth_cache import DepthCache, depth_cache_key
+
+
+def npy_files(root):
+    return sorted(name for _, _, files in os.walk(root) for name in files)
+
+
+def test_memory_lru_evicts_oldest_to_fit_budget():
+    depth = np.zeros((16, 16), dtype=np.float32)  # 1KB
+    cache = DepthCache(max_bytes=2 * depth.nbytes, disk_dir="")
+    for key in ("a", "b", "c"):
+        cache.put(key, depth)
+
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    assert cache.stats()["memory_entries"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_cached_arrays_are_read_only():
+    cache = DepthCache(max_bytes=1024**2, disk_dir="")
+    cache.put("a", np.ones((4, 4)))
+
+    depth = cache.get("a")
+    assert depth.dtype == np.float32
+    assert not depth.flags.writeable
+
+
+def test_disk_hits_are_mapped_and_not_charged_to_memory(tmp_path):
+    depth = np.arange(64, dtype=np.float32).reshape(8, 8)
+    DepthCache(max_bytes=1024**2, disk_dir=str(tmp_path)).put("ab12", depth)
+
+    cache = DepthCache(max_bytes=1024**2, disk_dir=str(tmp_path))
+    hit = cache.get("ab12")
+
+    assert isinstance(hit, np.memmap)
+    np.testing.assert_array_equal(hit, depth)
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_disk_accounting_uses_file_sizes(tmp_path):
+    cache = DepthCache(max_bytes=1024**2, disk_dir=str(tmp_path))
+    cache.put("ab12", np.zeros((8, 8), dtype=np.float32))
+    on_disk = sum(os.path.getsize(os.path.join(root, name))
+                  for root, _, files in os.walk(tmp_path) for name in files)
+
+    assert cache._disk_bytes == on_disk
+    assert DepthCache(max_bytes=1024**2, disk_dir=str(tmp_path))._disk_bytes == on_disk
+
+
+def test_concurrent_puts_of_one_key_write_and_count_it_once(tmp_path):
+    cache = DepthCache(max_bytes=0, disk_dir=str(tmp_path))
+    depth = np.ones((64, 64), dtype=np.float32)
+    barrier = threading.Barrier(8)
+
+    def put():
+        barrier.wait()
+        cache.put("ab12", depth)
+
+    threads = [threading.Thread(target=put) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert npy_files(tmp_path) == ["ab12.npy"]
+    assert list(cache._disk) == ["ab12"]
+    assert cache._disk_bytes == os.path.getsize(tmp_path / "ab" / "ab12.npy")
+    np.testing.assert_array_equal(cache.get("ab12"), depth)
+
+
+def test_disk_tier_trims_oldest_and_clears_stale_temp_files(tmp_path):
+    depth = np.zeros((32, 32), dtype=np.float32)
+    cache = DepthCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=int(2.5 * (depth.nbytes + 128)))
+    for key in ("aa01", "bb02", "cc03"):
+        cache.put(key, depth)
+    assert list(cache._disk) == ["bb02", "cc03"]
+
+    (tmp_path / "dd").mkdir()
+    (tmp_path / "dd" / ".dd04.x.tmp").write_bytes(b"partial")
+    DepthCache(max_bytes=0, disk_dir=str(tmp_path))
+    assert npy_files(tmp_path) == ["bb02.npy", "cc03.npy"]
+
+
+def test_keys_depend_on_pixels_and_model():
+    from PIL import Image
+
+    black = Image.new("RGB", (4, 4))
+    white = Image.new("RGB", (4, 4), "white")
+    key = depth_cache_key(black, "midas")
+
+    assert key == depth_cache_key(black.copy(), "midas")
+    assert key != depth_cache_key(white, "midas")
+    assert key != depth_cache_key(black, "depth_anything")
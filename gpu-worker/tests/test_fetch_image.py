@@ -0,0 +1,125 @@
+import io
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+from PIL import Image
+
+import main
+
+
+def png_bytes(size=(8, 6)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class ImageServer(ThreadingHTTPServer):
+    """Serves `routes` ({path: (status, body, headers)}) and records client ports."""
+
+    daemon_threads = True
+
+    def __init__(self, routes):
+        super().__init__(("127.0.0.1", 0), ImageHandler)
+        self.routes = routes
+        self.client_ports = []
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled connections are visible
+
+    def do_GET(self):
+        self.server.client_ports.append(self.client_address[1])
+        status, body, headers = self.server.routes.get(self.path, (404, b"not found", {}))
+        self.send_response(status)
+        for name, value in {"Content-Length": str(len(body)), **headers}.items():
+            if value is not None:
+                self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ImageServer({})
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(*urls):
+    """Fetch each URL in turn on one event loop; returns images or exceptions."""
+    async def run():
+        results, clients = [], []
+        try:
+            for url in urls:
+                clients.append(main.get_http_client())
+                try:
+                    results.append(await main.fetch_image(url))
+                except Exception as e:
+                    results.append(e)
+        finally:
+            await main.close_http_client()
+        return results, clients
+
+    return asyncio.run(run())
+
+
+def test_fetches_and_decodes_an_image(server):
+    server.routes["/a.png"] = (200, png_bytes(), {"Content-Type": "image/png"})
+
+    (image,), _ = fetch(server.url("/a.png"))
+
+    assert image.size == (8, 6)
+    assert image.mode == "RGB"
+
+
+def test_non_2xx_response_raises(server):
+    (error,), _ = fetch(server.url("/missing.png"))
+
+    assert isinstance(error, httpx.HTTPStatusError)
+    assert error.response.status_code == 404
+
+
+def test_body_over_the_byte_cap_is_rejected(server, monkeypatch):
+    monkeypatch.setattr(main, "FETCH_MAX_BYTES", 1024)
+    body = b"\0" * 4096
+    server.routes["/declared.png"] = (200, body, {})
+    # No Content-Length, so the cap is enforced while streaming
+    server.routes["/chunked.png"] = (200, body, {"Content-Length": None, "Connection": "close"})
+
+    (declared, streamed), _ = fetch(server.url("/declared.png"), server.url("/chunked.png"))
+
+    assert isinstance(declared, ValueError) and "4096 bytes" in str(declared)
+    assert isinstance(streamed, ValueError) and "over 1024 bytes" in str(streamed)
+
+
+def test_one_client_and_connection_serve_consecutive_fetches(server):
+    server.routes["/a.png"] = (200, png_bytes(), {})
+
+    results, clients = fetch(*[server.url("/a.png")] * 3)
+
+    assert all(isinstance(result, Image.Image) for result in results)
+    assert clients[0] is clients[1] is clients[2]
+    assert len(server.client_ports) == 3
+    assert len(set(server.client_ports)) == 1
+
+
+def test_a_new_event_loop_gets_a_new_client(server):
+    server.routes["/a.png"] = (200, png_bytes(), {})
+
+    _, (first,) = fetch(server.url("/a.png"))
+    _, (second,) = fetch(server.url("/a.png"))
+
+    assert first is not second
+    assert first.is_closed
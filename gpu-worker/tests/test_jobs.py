@@ -0,0 +1,176 @@
+import asyncio
+import threading
+
+import pytest
+
+from executors import DeviceExecutor
+from jobs import FamilyScheduler, Job, JobQueue, JobStatus, check_cancelled, report_progress
+
+
+@pytest.fixture
+def executor():
+    executor = DeviceExecutor("test", 1)
+    yield executor
+    executor.shutdown()
+
+
+async def wait_for(condition, timeout=5):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.005)
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_cancelled_running_job_holds_its_worker_until_the_step_finishes(executor):
+    step_started = threading.Event()
+    finish_step = threading.Event()
+    ran = []
+
+    def denoise_step(name):
+        ran.append(name)
+        if name == "first":
+            step_started.set()
+            assert finish_step.wait(5)
+        report_progress(step=1, total_steps=1)
+        check_cancelled()
+        return {"success": True}
+
+    async def runner(operation, params):
+        return await executor.run(denoise_step, params["name"])
+
+    async def main():
+        queue = JobQueue(runner, workers=1)
+        await queue.start()
+        try:
+            first = queue.submit("video_generate", {"name": "first"})
+            second = queue.submit("video_generate", {"name": "second"})
+            await asyncio.get_running_loop().run_in_executor(None, step_started.wait, 5)
+
+            queue.cancel(first.id)
+            await asyncio.sleep(0.05)
+            assert first.status == JobStatus.RUNNING
+            assert first.stage == "cancelling"
+            assert second.status == JobStatus.QUEUED
+
+            finish_step.set()
+            await wait_for(lambda: second.done)
+            assert first.status == JobStatus.CANCELLED
+            assert second.status == JobStatus.SUCCEEDED
+            assert ran == ["first", "second"]
+            assert first.finished_at <= second.started_at
+        finally:
+            finish_step.set()
+            await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_job_that_ignores_cancellation_is_reported_cancelled_when_it_returns():
+    async def main():
+        finished = asyncio.Event()
+
+        async def runner(operation, params):
+            await finished.wait()
+            return {"success": True}
+
+        queue = JobQueue(runner, workers=1)
+        await queue.start()
+        try:
+            job = queue.submit("depth_estimate", {})
+            await wait_for(lambda: job.status == JobStatus.RUNNING)
+            queue.cancel(job.id)
+            await asyncio.sleep(0.01)
+            assert job.status == JobStatus.RUNNING
+
+            finished.set()
+            await wait_for(lambda: job.done)
+            assert job.status == JobStatus.CANCELLED
+            assert queue.stats()["cancelled"] == 1
+        finally:
+            await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_queued_job_is_cancelled_immediately():
+    async def main():
+        blocker = asyncio.Event()
+
+        async def runner(operation, params):
+            await blocker.wait()
+            return {"success": True}
+
+        queue = JobQueue(runner, workers=1)
+        await queue.start()
+        try:
+            running = queue.submit("video_generate", {})
+            queued = queue.submit("video_generate", {})
+            await wait_for(lambda: running.status == JobStatus.RUNNING)
+
+            queue.cancel(queued.id)
+            assert queued.status == JobStatus.CANCELLED
+            assert queued.error == "Cancelled before start"
+
+            blocker.set()
+            await wait_for(lambda: running.done)
+            assert running.status == JobStatus.SUCCEEDED
+            assert queue.stats()["queued"] == 0
+        finally:
+            await queue.stop()
+
+    asyncio.run(main())
+
+
+def make_jobs(*specs, now=1000.0):
+    """Jobs from (family, priority) pairs, one second apart in that order."""
+    return [Job(operation=f"op{i}", params={}, family=family, priority=priority, created_at=now + i)
+            for i, (family, priority) in enumerate(specs)]
+
+
+def drain(scheduler, pending):
+    order = []
+    pending = list(pending)
+    while pending:
+        job = scheduler.select(pending)
+        pending.remove(job)
+        order.append(job.operation)
+    return order
+
+
+def test_scheduler_keeps_running_the_current_family(monkeypatch):
+    monkeypatch.setattr("jobs.time.time", lambda: 1010.0)
+    jobs = make_jobs(("wan", 0), ("depth", 0), ("wan", 0), ("depth", 0))
+    scheduler = FamilyScheduler(max_burst=8, max_wait=300)
+    for job in jobs:
+        scheduler.record_submit(job)
+
+    assert drain(scheduler, jobs) == ["op0", "op2", "op1", "op3"]
+    assert scheduler.stats()["family_switches"] == 1
+    assert scheduler.stats()["arrival_order_switches"] == 3
+    assert scheduler.stats()["swaps_avoided"] == 2
+
+
+def test_scheduler_switches_family_after_max_burst(monkeypatch):
+    monkeypatch.setattr("jobs.time.time", lambda: 1010.0)
+    jobs = make_jobs(("wan", 0), ("wan", 0), ("wan", 0), ("depth", 0))
+    scheduler = FamilyScheduler(max_burst=2, max_wait=300)
+
+    assert drain(scheduler, jobs) == ["op0", "op1", "op3", "op2"]
+
+
+def test_scheduler_prefers_higher_priority_over_family(monkeypatch):
+    monkeypatch.setattr("jobs.time.time", lambda: 1010.0)
+    jobs = make_jobs(("wan", 0), ("wan", 0), ("depth", 5))
+    scheduler = FamilyScheduler(max_burst=8, max_wait=300)
+
+    assert drain(scheduler, jobs) == ["op2", "op0", "op1"]
+
+
+def test_scheduler_runs_jobs_past_max_wait_first(monkeypatch):
+    monkeypatch.setattr("jobs.time.time", lambda: 1100.0)
+    jobs = make_jobs(("depth", 0), ("wan", 0), ("wan", 9))
+    scheduler = FamilyScheduler(max_burst=8, max_wait=50)
+    scheduler.current_family = "wan"
+
+    assert scheduler.select(jobs).operation == "op0"
+    assert scheduler.stats()["aged_promotions"] == 1
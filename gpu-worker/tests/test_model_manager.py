@@ -0,0 +1,82 @@
+import threading
+
+from main import ModelManager
+
+MODEL_BYTES = 100
+
+
+class FakeModelManager(ModelManager):
+    """ModelManager with torch replaced by fixed-size placeholder models."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.size_hints = {}
+        self.cold_loads = []
+        self.spilled = []
+
+    def _load_model(self, model_name):
+        self.cold_loads.append(model_name)
+        return {model_name: object()}
+
+    def _measure_bytes(self, objects, device_type=None):
+        return MODEL_BYTES if objects else 0
+
+    def _is_movable(self, objects):
+        return True
+
+    def _move_objects(self, objects, device):
+        pass
+
+    def _demote_to_disk(self, entry):
+        # Disk tier disabled: spilled models are dropped
+        self.spilled.append(entry.name)
+        entry.objects.clear()
+
+    def _release_memory(self):
+        pass
+
+
+def test_host_resident_model_is_promoted_when_its_victim_overflows_host():
+    manager = FakeModelManager(budget_bytes=MODEL_BYTES, host_budget_bytes=MODEL_BYTES)
+    manager.ensure_model("depth_anything")
+    manager.ensure_model("midas")  # depth_anything -> host
+    assert list(manager.host_entries) == ["depth_anything"]
+
+    # midas is evicted to a full host tier while depth_anything comes back from it
+    model = manager.ensure_model("depth_anything")
+
+    assert model is not None
+    assert manager.cold_loads == ["depth_anything", "midas"]
+    assert list(manager.entries) == ["depth_anything"]
+    assert list(manager.host_entries) == ["midas"]
+    assert manager.spilled == []
+
+
+def test_acquire_waits_for_a_running_demotion_instead_of_loading_twice():
+    demoting = threading.Event()
+    finish = threading.Event()
+
+    class SlowDiskManager(FakeModelManager):
+        def _demote_to_disk(self, entry):
+            if entry.name == "depth_anything":
+                demoting.set()
+                assert finish.wait(5)
+            super()._demote_to_disk(entry)
+
+    manager = SlowDiskManager(budget_bytes=MODEL_BYTES, host_budget_bytes=0)
+    manager.ensure_model("depth_anything")
+    evicting = threading.Thread(target=manager.ensure_model, args=("midas",))
+    evicting.start()
+    assert demoting.wait(5)
+
+    reloading = threading.Thread(target=manager.ensure_model, args=("depth_anything",))
+    reloading.start()
+    reloading.join(0.1)
+    assert reloading.is_alive()
+    assert manager.cold_loads == ["depth_anything", "midas"]
+
+    finish.set()
+    evicting.join(5)
+    reloading.join(5)
+    assert manager.cold_loads == ["depth_anything", "midas", "depth_anything"]
+    assert manager.spilled == ["depth_anything", "midas"]
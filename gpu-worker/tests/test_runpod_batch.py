@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("runpod")
+
+import runpod_handler  # noqa: E402
+
+
+@pytest.fixture
+def operations(monkeypatch):
+    """Replaces run_operation; records start order and peak concurrency."""
+    log = {"started": [], "running": 0, "peak": 0}
+
+    async def run_operation(operation, params):
+        log["started"].append(params["name"])
+        log["running"] += 1
+        log["peak"] = max(log["peak"], log["running"])
+        await asyncio.sleep(0.01)
+        log["running"] -= 1
+        if params.get("fail"):
+            return {"success": False, "error": "boom"}
+        return {"success": True, "output_url": params["name"]}
+
+    monkeypatch.setattr(runpod_handler, "run_operation", run_operation)
+    return log
+
+
+def batch(items, **params):
+    return asyncio.run(runpod_handler.process_batch({"id": "job"}, {"items": items, **params}))
+
+
+def item(operation, name, **params):
+    return {"operation": operation, "params": {"name": name, **params}}
+
+
+def test_batch_runs_families_in_groups_and_returns_input_order(operations):
+    items = [
+        item("depth_estimate", "depth-1", model="midas"),
+        item("video_generate", "video-1"),
+        item("depth_estimate", "depth-2", model="midas"),
+        item("video_generate", "video-2"),
+    ]
+
+    result = batch(items)
+
+    assert operations["started"][:2] == ["depth-1", "depth-2"]
+    assert sorted(operations["started"][2:]) == ["video-1", "video-2"]
+    assert [r["output_url"] for r in result["results"]] == ["depth-1", "video-1", "depth-2", "video-2"]
+    assert [r["index"] for r in result["results"]] == [0, 1, 2, 3]
+    assert result["succeeded"] == 4 and result["failed"] == 0
+
+
+def test_batch_reports_per_item_errors(operations):
+    items = [item("depth_estimate", "ok"), {"operation": "format_disk"}, "nonsense", item("rack_focus", "bad", fail=True)]
+
+    result = batch(items)
+
+    assert [r["success"] for r in result["results"]] == [True, False, False, False]
+    assert result["results"][1]["error"] == "Unsupported batch operation: format_disk"
+    assert result["results"][2]["operation"] is None
+    assert result["failed"] == 3
+    assert sorted(operations["started"]) == ["bad", "ok"]
+
+
+def test_batch_limits_items_in_flight(operations):
+    items = [item("depth_estimate", f"depth-{i}") for i in range(6)]
+
+    batch(items, max_concurrency=2)
+
+    assert operations["peak"] == 2
+
+
+@pytest.mark.parametrize("value", ["many", None, [2]])
+def test_batch_rejects_invalid_max_concurrency(operations, value):
+    result = batch([item("depth_estimate", "depth")], max_concurrency=value)
+
+    assert result["success"] is False
+    assert "max_concurrency" in result["error"]
+    assert operations["started"] == []
+
+
+@pytest.mark.parametrize("items", [[], None, "items"])
+def test_batch_requires_items(operations, items):
+    assert batch(items)["success"] is False
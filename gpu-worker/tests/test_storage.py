@@ -0,0 +1,170 @@
+import base64
+import threading
+
+import pytest
+
+from storage import MIN_PART_SIZE, DataUrlWriter, FallbackWriter, ObjectUploader
+
+
+class FakeS3:
+    """Records multipart calls; upload_part blocks until `release` is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+        self.parts = []
+        self.objects = {}
+        self.aborted = []
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        return {"UploadId": "upload-1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        assert self.release.wait(5)
+        self.parts.append((PartNumber, len(Body)))
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.objects[Key] = MultipartUpload["Parts"]
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[Key] = Body
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(Key)
+
+
+def make_uploader(max_concurrency=2):
+    uploader = ObjectUploader("http://r2.invalid", "key", "secret", "bucket", "https://cdn.invalid",
+                              part_size=MIN_PART_SIZE, max_concurrency=max_concurrency)
+    uploader._client = FakeS3()
+    return uploader
+
+
+def test_streamed_parts_are_completed_in_order():
+    uploader = make_uploader()
+    with uploader.open_stream("video.mp4", "video/mp4") as stream:
+        stream.write(b"\0" * (2 * MIN_PART_SIZE + 10))
+
+    assert uploader._client.objects["video.mp4"] == [
+        {"PartNumber": 1, "ETag": "etag-1"},
+        {"PartNumber": 2, "ETag": "etag-2"},
+        {"PartNumber": 3, "ETag": "etag-3"},
+    ]
+    uploader.shutdown()
+
+
+def test_small_stream_is_a_single_put():
+    uploader = make_uploader()
+    with uploader.open_stream("image.png", "image/png") as stream:
+        stream.write(b"png")
+
+    assert uploader._client.objects["image.png"] == b"png"
+    assert uploader._client.parts == []
+    uploader.shutdown()
+
+
+def test_parts_cancelled_before_running_give_back_their_slot():
+    uploader = make_uploader(max_concurrency=1)
+    client = uploader._client
+    client.release.clear()
+    # Another upload holds the only part worker, so this stream's part stays queued
+    uploader.part_pool.submit(client.release.wait, 5)
+
+    stream = uploader.open_stream("video.mp4", "video/mp4")
+    stream.write(b"\0" * MIN_PART_SIZE)
+    stream.abort()
+
+    assert stream._parts[0].cancelled()
+    assert stream._slots.acquire(timeout=1)
+    assert client.aborted == ["video.mp4"]
+    client.release.set()
+    uploader.shutdown()
+
+
+class FlakyWriter:
+    """Writer that fails after `fail_after` bytes, or on close."""
+
+    def __init__(self, name, log, fail_after=None, fail_close=False):
+        self.name = name
+        self.log = log
+        self.fail_after = fail_after
+        self.fail_close = fail_close
+        self.data = bytearray()
+        self.aborted = False
+
+    def write(self, data):
+        if self.fail_after is not None and len(self.data) + len(data) > self.fail_after:
+            raise OSError(f"{self.name} write failed")
+        self.data += data
+        return len(data)
+
+    def close(self):
+        if self.fail_close:
+            raise OSError(f"{self.name} close failed")
+        self.log.append((self.name, bytes(self.data)))
+        return self.name
+
+    def abort(self):
+        self.aborted = True
+
+
+def test_fallback_writer_uses_the_first_writer_when_it_works():
+    log = []
+    with FallbackWriter([lambda: FlakyWriter("r2", log), lambda: FlakyWriter("local", log)]) as writer:
+        writer.write(b"abc")
+        writer.write(b"def")
+
+    assert log == [("r2", b"abcdef")]
+
+
+def test_fallback_writer_replays_everything_after_a_failed_write():
+    log, writers = [], []
+
+    def factory(name, **kwargs):
+        def open_writer():
+            writers.append(FlakyWriter(name, log, **kwargs))
+            return writers[-1]
+        return open_writer
+
+    writer = FallbackWriter([factory("r2", fail_after=4), factory("local")])
+    for chunk in (b"abc", b"def", b"ghi"):
+        writer.write(chunk)
+
+    assert writer.close() == "local"
+    assert log == [("local", b"abcdefghi")]
+    assert writers[0].aborted
+
+
+def test_fallback_writer_replays_after_a_failed_close():
+    log = []
+    writer = FallbackWriter([
+        lambda: FlakyWriter("r2", log, fail_close=True),
+        lambda: FlakyWriter("local", log, fail_close=True),
+        lambda: DataUrlWriter("video/mp4"),
+    ])
+    writer.write(b"frames")
+
+    assert writer.close() == "data:video/mp4;base64," + base64.b64encode(b"frames").decode()
+    assert log == []
+
+
+def test_fallback_writer_skips_destinations_that_fail_to_open():
+    log = []
+
+    def unavailable():
+        raise OSError("no storage")
+
+    with FallbackWriter([unavailable, lambda: FlakyWriter("local", log)]) as writer:
+        writer.write(b"abc")
+
+    assert log == [("local", b"abc")]
+
+
+def test_fallback_writer_raises_when_every_destination_fails():
+    log = []
+    writer = FallbackWriter([lambda: FlakyWriter("r2", log, fail_after=0)])
+
+    with pytest.raises(OSError, match="r2 write failed"):
+        writer.write(b"abc")
+    assert writer._spool is None
@@ -0,0 +1,127 @@
+import io
+import asyncio
+
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance
+
+import main
+import tiling
+from depth_batcher import DepthBatcher
+from executors import DeviceExecutor
+from lens_effects import sharpen
+from output_stage import depth_finalizer
+from tiling import blend_tiles, merge_depth_tiles, plan_tiles, run_tiled, to_uint8
+
+
+def test_plan_tiles_covers_the_image_with_overlapping_tiles():
+    bands = plan_tiles(300, 500, tile=128, overlap=32, halo=8)
+    tiles = [tile for band in bands for tile in band]
+
+    covered = np.zeros((300, 500), dtype=int)
+    for tile in tiles:
+        covered[tile.y0:tile.y1, tile.x0:tile.x1] += 1
+        assert (tile.py0, tile.px0) == (max(0, tile.y0 - 8), max(0, tile.x0 - 8))
+        assert (tile.py1, tile.px1) == (min(300, tile.y1 + 8), min(500, tile.x1 + 8))
+    assert covered.min() >= 1
+
+    for band in bands:
+        assert len({(tile.y0, tile.y1) for tile in band}) == 1
+        for left, right in zip(band, band[1:]):
+            assert left.x1 - right.x0 >= 32
+    for upper, lower in zip(bands, bands[1:]):
+        assert upper[0].y1 - lower[0].y0 >= 32
+
+
+def test_plan_tiles_uses_one_tile_for_small_images():
+    (band,) = plan_tiles(100, 120, tile=128, overlap=32, halo=8)
+    (tile,) = band
+    assert (tile.y0, tile.y1, tile.x0, tile.x1) == (0, 100, 0, 120)
+
+
+def test_blending_identical_tiles_reproduces_the_image():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (333, 517, 3), dtype=np.uint8)
+
+    result = run_tiled(image, lambda region, tile: region, to_uint8, np.uint8, tile=128, overlap=32, halo=8)
+
+    np.testing.assert_array_equal(result, image)
+
+
+def test_blend_feathers_seams_between_tiles():
+    bands = plan_tiles(64, 200, tile=128, overlap=56, halo=0)
+    left, right = bands[0]
+    results = [np.zeros((64, left.x1 - left.x0)), np.full((64, right.x1 - right.x0), 100.0)]
+
+    row = blend_tiles(bands, results, lambda values: values.copy(), np.float32)[0]
+
+    assert row[0] == 0 and row[-1] == 100
+    seam = row[right.x0:left.x1]
+    assert np.all(np.diff(seam) > 0)
+
+
+def test_tiled_sharpen_matches_pil_on_the_whole_image():
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 256, (300, 400, 3), dtype=np.uint8)
+
+    for sharpness in (0.0, 0.5, 2.4):
+        expected = np.asarray(ImageEnhance.Sharpness(Image.fromarray(image)).enhance(sharpness))
+        tiled = run_tiled(image, lambda region, tile: sharpen(region, sharpness), to_uint8, np.uint8,
+                          tile=128, overlap=32, halo=8)
+        np.testing.assert_array_equal(tiled, expected)
+
+
+def test_depth_merge_consumes_predictions_one_band_at_a_time():
+    bands = plan_tiles(200, 300, tile=96, overlap=24, halo=0)
+    depth = np.linspace(0, 1, 40 * 60, dtype=np.float32).reshape(40, 60)
+    consumed = []
+    rows_finalized = []
+
+    def predictions():
+        for band in bands:
+            for tile in band:
+                consumed.append(tile)
+                yield np.full((32, 32), 0.5, dtype=np.float32)
+
+    finalize, dtype = depth_finalizer(0.0, 1.0, "png")
+
+    def tracking_finalize(values):
+        rows_finalized.append(len(consumed))
+        return finalize(values)
+
+    result = merge_depth_tiles(depth, predictions(), bands, tracking_finalize, dtype)
+
+    assert result.shape == (200, 300) and result.dtype == np.uint8
+    tiles_per_band = len(bands[0])
+    assert rows_finalized == [tiles_per_band * (index + 1) for index in range(len(bands))]
+
+
+@pytest.fixture
+def executor():
+    executor = DeviceExecutor("test", 1)
+    yield executor
+    executor.shutdown()
+
+
+def test_predict_depth_tiled_predicts_one_band_at_a_time(monkeypatch, executor):
+    monkeypatch.setattr(tiling, "DEPTH_TILE_SIZE", 96)
+    monkeypatch.setattr(tiling, "DEPTH_TILE_OVERLAP", 24)
+    batches = []
+
+    def predict_batch(model, images):
+        batches.append(len(images))
+        return [np.asarray(image.convert("L").resize((32, 32)), dtype=np.float32) / 255 for image in images]
+
+    monkeypatch.setattr(main, "depth_batcher", DepthBatcher(predict_batch, lambda: executor, max_batch_size=64))
+    gradient = np.tile(np.linspace(0, 255, 300, dtype=np.uint8), (200, 1))
+    image = Image.fromarray(np.stack([gradient] * 3, axis=2))
+    depth = np.asarray(image.convert("L").resize((60, 40)), dtype=np.float32) / 255
+
+    encoded, tiles = asyncio.run(main.predict_depth_tiled(image, "midas", depth, "png"))
+
+    bands = plan_tiles(200, 300, 96, 24, halo=0)
+    assert tiles == sum(len(band) for band in bands)
+    assert batches == [len(band) for band in bands]
+    output = np.asarray(Image.open(io.BytesIO(encoded.data)))
+    assert output.shape == (200, 300)
+    assert output[:, 0].mean() < 5 and output[:, -1].mean() > 250
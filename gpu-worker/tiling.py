@@ -0,0 +1,347 @@
+"""
+Tiled execution for high-resolution images.
+
+Large inputs are split into overlapping tiles that are processed in parallel
+and blended back with feathered weights:
+
+- Each tile is read with an extra `halo` of context on every side so
+  neighbourhood operations (blurs, warps) see real pixels at tile seams;
+  only the tile's own area is kept.
+- Overlapping tiles are weighted by a linear ramp across the overlap and
+  normalized, so seams fade smoothly whatever the tile layout.
+- Tiles are blended one row band at a time. Finished rows are converted to
+  the output dtype immediately, so apart from the output itself, peak memory
+  is one band of float32 accumulators plus one tile per worker.
+
+TILE_SIZE, TILE_OVERLAP and TILE_WORKERS tune the layout; images whose long
+edge exceeds TILE_MIN_EDGE are tiled by the endpoints.
+
+Per-tile model output (depth) is relative to each tile, so it is aligned to
+the whole-image result with a least-squares scale and shift before blending:
+the whole-image pass fixes the global structure, the tiles add detail.
+"""
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from profiling import traced
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger("gpu-worker.tiling")
+
+TILE_SIZE = int(os.getenv("TILE_SIZE", "1024"))
+TILE_OVERLAP = int(os.getenv("TILE_OVERLAP", "64"))
+TILE_HALO = int(os.getenv("TILE_HALO", "48"))
+TILE_MIN_EDGE = int(os.getenv("TILE_MIN_EDGE", "3072"))
+TILE_WORKERS = int(os.getenv("TILE_WORKERS", str(os.cpu_count() or 1)))
+DEPTH_TILE_SIZE = int(os.getenv("DEPTH_TILE_SIZE", "1024"))
+DEPTH_TILE_OVERLAP = int(os.getenv("DEPTH_TILE_OVERLAP", "128"))
+
+
+@dataclass(frozen=True)
+class Tile:
+    """
+    A tile in full-image pixel coordinates.
+
+    [y0:y1, x0:x1] is the area the tile contributes to the output;
+    [py0:py1, px0:px1] is that area plus the halo, clipped to the image.
+    """
+    y0: int
+    y1: int
+    x0: int
+    x1: int
+    py0: int
+    py1: int
+    px0: int
+    px1: int
+    image_height: int
+    image_width: int
+
+    @property
+    def crop(self) -> Tuple[slice, slice]:
+        """Slices that cut the tile's own area out of the padded region."""
+        return (slice(self.y0 - self.py0, self.y1 - self.py0), slice(self.x0 - self.px0, self.x1 - self.px0))
+
+
+def should_tile(height: int, width: int, min_edge: int = TILE_MIN_EDGE) -> bool:
+    return max(height, width) > min_edge
+
+
+def _spans(length: int, tile: int, overlap: int) -> List[Tuple[int, int]]:
+    """Evenly spaced [start, end) spans of `tile` pixels overlapping by at least `overlap`."""
+    if length <= tile:
+        return [(0, length)]
+    count = -(-(length - overlap) // (tile - overlap))  # ceil
+    step = (length - tile) / (count - 1)
+    return [(round(index * step), round(index * step) + tile) for index in range(count)]
+
+
+def plan_tiles(height: int, width: int, tile: int = TILE_SIZE, overlap: int = TILE_OVERLAP,
+               halo: int = TILE_HALO) -> List[List[Tile]]:
+    """Tiles grouped into row bands, in raster order."""
+    tile = max(tile, 2 * overlap + 1)
+    bands = []
+    for y0, y1 in _spans(height, tile, overlap):
+        bands.append([
+            Tile(y0, y1, x0, x1,
+                 max(0, y0 - halo), min(height, y1 + halo), max(0, x0 - halo), min(width, x1 + halo),
+                 height, width)
+            for x0, x1 in _spans(width, tile, overlap)
+        ])
+    return bands
+
+
+@lru_cache(maxsize=64)
+def _ramp(length: int, rise: int, fall: int):
+    """1-D weights: linear rise over `rise` pixels, flat, linear fall over `fall` pixels."""
+    import numpy as np
+
+    weights = np.ones(length, dtype=np.float32)
+    if rise > 0:
+        weights[:rise] = (np.arange(rise, dtype=np.float32) + 0.5) / rise
+    if fall > 0:
+        weights[length - fall:] = np.minimum(
+            weights[length - fall:], (np.arange(fall, 0, -1, dtype=np.float32) - 0.5) / fall
+        )
+    weights.setflags(write=False)
+    return weights
+
+
+def _overlaps(spans: List[Tuple[int, int]], index: int) -> Tuple[int, int]:
+    """Overlap of span `index` with its previous and next neighbours."""
+    rise = spans[index - 1][1] - spans[index][0] if index > 0 else 0
+    fall = spans[index][1] - spans[index + 1][0] if index + 1 < len(spans) else 0
+    return max(0, rise), max(0, fall)
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _tile_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, TILE_WORKERS), thread_name_prefix="tile")
+        return _pool
+
+
+def map_tiles(bands: List[List[Tile]], fn: Callable[[Tile], Any]) -> Iterator[Any]:
+    """`fn(tile)` for every tile in raster order, one band at a time in parallel."""
+    pool = _tile_pool()
+    # The tile pool doesn't copy contextvars, so bind a profiled request here
+    fn = traced(fn, "tile")
+    for band in bands:
+        yield from pool.map(fn, band)
+
+
+class TileBlender:
+    """
+    Feather-blends per-tile results into one image, one band at a time.
+
+    Bands must be added in order with `add_band`, each a list of results in
+    column order covering its tiles' own areas. Rows no later band reaches
+    are converted with `finalize` (float32 rows -> output values) as soon as
+    their band is added, so only one band of accumulators is kept.
+    """
+
+    def __init__(self, bands: List[List[Tile]], finalize: Callable[["np.ndarray"], "np.ndarray"], out_dtype: Any):
+        self.bands = bands
+        self.finalize = finalize
+        self.out_dtype = out_dtype
+        self.height, self.width = bands[0][0].image_height, bands[0][0].image_width
+        self.output: Optional["np.ndarray"] = None
+        self._row_spans = [(band[0].y0, band[0].y1) for band in bands]
+        self._col_spans = [(tile.x0, tile.x1) for tile in bands[0]]
+        self._next_band = 0
+        self._carry_values = self._carry_weights = None
+
+    @property
+    def next_band(self) -> List[Tile]:
+        """Tiles of the band `add_band` expects next."""
+        return self.bands[self._next_band]
+
+    def add_band(self, results: Iterable[Any]):
+        import numpy as np
+
+        band_index = self._next_band
+        band = self.bands[band_index]
+        y0, y1 = self._row_spans[band_index]
+        band_values = band_weights = None
+        rise_y, fall_y = _overlaps(self._row_spans, band_index)
+        weight_y = _ramp(y1 - y0, rise_y, fall_y)
+
+        for col_index, (tile, result) in enumerate(zip(band, results)):
+            result = np.asarray(result, dtype=np.float32)
+            if band_values is None:
+                channels = result.shape[2:]
+                band_values = np.zeros((y1 - y0, self.width) + channels, dtype=np.float32)
+                band_weights = np.zeros((y1 - y0, self.width), dtype=np.float32)
+                if self.output is None:
+                    self.output = np.empty((self.height, self.width) + channels, dtype=self.out_dtype)
+            rise_x, fall_x = _overlaps(self._col_spans, col_index)
+            weights = np.multiply.outer(weight_y, _ramp(tile.x1 - tile.x0, rise_x, fall_x))
+            weighted = result * (weights[:, :, None] if result.ndim == 3 else weights)
+            band_values[:, tile.x0:tile.x1] += weighted
+            band_weights[:, tile.x0:tile.x1] += weights
+
+        if self._carry_values is not None:
+            band_values[:len(self._carry_values)] += self._carry_values
+            band_weights[:len(self._carry_weights)] += self._carry_weights
+
+        # Rows the next band doesn't reach are final
+        last = band_index + 1 == len(self.bands)
+        done = (y1 if last else self._row_spans[band_index + 1][0]) - y0
+        weights = band_weights[:done]
+        values = band_values[:done] / (weights[:, :, None] if band_values.ndim == 3 else weights)
+        self.output[y0:y0 + done] = self.finalize(values)
+        self._carry_values, self._carry_weights = band_values[done:], band_weights[done:]
+        self._next_band += 1
+
+
+def blend_tiles(
+    bands: List[List[Tile]],
+    results: Iterable[Any],
+    finalize: Callable[["np.ndarray"], "np.ndarray"],
+    out_dtype: Any,
+) -> "np.ndarray":
+    """
+    Feather-blend per-tile results (in raster order, each covering its tile's
+    own area) into one image.
+
+    `finalize` converts blended float32 rows to the output values; it is
+    called once per finished group of rows.
+    """
+    blender = TileBlender(bands, finalize, out_dtype)
+    results = iter(results)
+    for band in bands:
+        blender.add_band([next(results) for _ in band])
+    return blender.output
+
+
+def run_tiled(
+    image: "np.ndarray",
+    fn: Callable[["np.ndarray", Tile], "np.ndarray"],
+    finalize: Callable[["np.ndarray"], "np.ndarray"],
+    out_dtype: Any,
+    tile: int = TILE_SIZE,
+    overlap: int = TILE_OVERLAP,
+    halo: int = TILE_HALO,
+) -> "np.ndarray":
+    """
+    Apply `fn(padded_region, tile)` to every tile of `image` in parallel and
+    blend the results.
+
+    `fn` gets the tile's region including its halo and must return an array
+    of the same height and width; the halo is cropped off before blending.
+    One band of tiles is in flight at a time.
+    """
+    height, width = image.shape[:2]
+    bands = plan_tiles(height, width, tile, overlap, halo)
+
+    def process(t: Tile):
+        return fn(image[t.py0:t.py1, t.px0:t.px1], t)[t.crop]
+
+    logger.info(f"Tiled {width}x{height} into {sum(len(band) for band in bands)} tiles")
+    return blend_tiles(bands, map_tiles(bands, process), finalize, out_dtype)
+
+
+def upsample_region(low: "np.ndarray", height: int, width: int, y0: int, y1: int, x0: int, x1: int) -> "np.ndarray":
+    """
+    The [y0:y1, x0:x1] region of `low` bilinearly resized to `height` x `width`,
+    without materializing the full-size image. Matches cv2.resize pixel centres.
+    """
+    import cv2
+    import numpy as np
+
+    scale_y, scale_x = low.shape[0] / height, low.shape[1] / width
+    matrix = np.float32([
+        [scale_x, 0, (x0 + 0.5) * scale_x - 0.5],
+        [0, scale_y, (y0 + 0.5) * scale_y - 0.5],
+    ])
+    return cv2.warpAffine(
+        np.asarray(low, dtype=np.float32), matrix, (x1 - x0, y1 - y0),
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def align_to_reference(detail: "np.ndarray", reference: "np.ndarray", stride: int = 4) -> "np.ndarray":
+    """
+    `detail * scale + shift`, with scale and shift fitted by least squares so
+    it matches `reference` (a coarse estimate of the same area).
+    """
+    import numpy as np
+
+    x = detail[::stride, ::stride].ravel().astype(np.float64)
+    y = reference[::stride, ::stride].ravel().astype(np.float64)
+    variance = x.var()
+    if variance < 1e-12:
+        return np.array(reference, dtype=np.float32)
+    scale = ((x - x.mean()) * (y - y.mean())).mean() / variance
+    shift = y.mean() - scale * x.mean()
+    return (detail * np.float32(scale) + np.float32(shift)).astype(np.float32, copy=False)
+
+
+def to_uint8(values: "np.ndarray") -> "np.ndarray":
+    """Finalizer for 0-255 float images."""
+    import numpy as np
+
+    return np.clip(values + 0.5, 0, 255).astype(np.uint8)
+
+
+class DepthTileMerger:
+    """
+    Full-resolution depth from per-tile predictions, fed one band at a time.
+
+    Each tile's depth is resized to the tile, aligned to the whole-image
+    `depth` over the same area and feather blended; `finalize` quantizes
+    rows as they are finished (see output_stage.depth_finalizer). Only one
+    band of predictions and accumulators is held at a time.
+    """
+
+    def __init__(self, depth: "np.ndarray", bands: List[List[Tile]],
+                 finalize: Callable[["np.ndarray"], "np.ndarray"], out_dtype: Any):
+        self.depth = depth
+        self.blender = TileBlender(bands, finalize, out_dtype)
+
+    @property
+    def output(self) -> Optional["np.ndarray"]:
+        return self.blender.output
+
+    def add_band(self, tile_depths: List["np.ndarray"]):
+        """Merge the next band's tile predictions (in column order)."""
+        band = self.blender.next_band
+        # The tile pool doesn't copy contextvars, so bind a profiled request here
+        aligned = traced(self._aligned, "tile")
+        self.blender.add_band(list(_tile_pool().map(aligned, band, tile_depths)))
+
+    def _aligned(self, tile: Tile, tile_depth: "np.ndarray") -> "np.ndarray":
+        import cv2
+        import numpy as np
+
+        size = (tile.x1 - tile.x0, tile.y1 - tile.y0)
+        detail = cv2.resize(np.asarray(tile_depth, dtype=np.float32), size, interpolation=cv2.INTER_LINEAR)
+        coarse = upsample_region(self.depth, tile.image_height, tile.image_width, tile.y0, tile.y1, tile.x0, tile.x1)
+        return align_to_reference(detail, coarse)
+
+
+def merge_depth_tiles(
+    depth: "np.ndarray",
+    tile_depths: Iterable["np.ndarray"],
+    bands: List[List[Tile]],
+    finalize: Callable[["np.ndarray"], "np.ndarray"],
+    out_dtype: Any,
+) -> "np.ndarray":
+    """Full-resolution depth from per-tile predictions in raster order (see DepthTileMerger)."""
+    merger = DepthTileMerger(depth, bands, finalize, out_dtype)
+    tile_depths = iter(tile_depths)
+    for band in bands:
+        merger.add_band([next(tile_depths) for _ in band])
+    return merger.output
@@ -0,0 +1,169 @@
+"""
+Streaming H.264 encoder for generated frames.
+
+Frames are piped as raw RGB into an ffmpeg subprocess as they are produced,
+and the encoded fragmented MP4 is forwarded chunk by chunk to a sink (an R2
+multipart stream, a local artifact file or an in-memory buffer). Nothing is
+written to a temp file and read back, and only one frame is held at a time.
+
+Fragmented MP4 (`frag_keyframe+empty_moov`) is used because the output is a
+pipe and can't be seeked to rewrite the moov atom; it plays in browsers and
+standard players.
+"""
+
+import os
+import shutil
+import logging
+import threading
+import subprocess
+from collections import deque
+from typing import Any, Optional
+
+logger = logging.getLogger("gpu-worker.video-encoder")
+
+VIDEO_CRF = os.getenv("VIDEO_CRF", "18")
+VIDEO_PRESET = os.getenv("VIDEO_PRESET", "medium")
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def ffmpeg_binary() -> str:
+    """FFMPEG_BINARY, then ffmpeg on PATH, then the binary bundled with imageio-ffmpeg."""
+    configured = os.getenv("FFMPEG_BINARY")
+    if configured:
+        return configured
+    found = shutil.which("ffmpeg")
+    if found:
+        return found
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except ImportError:
+        raise RuntimeError("ffmpeg not found: install it or set FFMPEG_BINARY")
+
+
+def frame_to_rgb24(frame: Any):
+    """
+    Buffer of packed uint8 RGB for a PIL image or numpy frame.
+
+    Contiguous uint8 arrays are passed through without copying; float frames
+    in [0, 1] (diffusers `output_type="np"`) are quantized once.
+    """
+    import numpy as np
+
+    if hasattr(frame, "mode"):  # PIL image
+        if frame.mode != "RGB":
+            frame = frame.convert("RGB")
+        return frame.tobytes()
+
+    array = np.asarray(frame)
+    if array.dtype != np.uint8:
+        array = (np.clip(array, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+    return memoryview(np.ascontiguousarray(array)).cast("B")
+
+
+class FrameStreamEncoder:
+    """
+    Encode frames to MP4 through an ffmpeg pipe, forwarding output to `sink`.
+
+    `sink` needs a `write(bytes)` method; it is called from a reader thread
+    while frames are still being written, so uploads overlap with encoding.
+
+        with FrameStreamEncoder(1280, 720, 24, sink) as encoder:
+            for frame in frames:
+                encoder.write_frame(frame)
+    """
+
+    def __init__(self, width: int, height: int, fps: float, sink: Any,
+                 crf: str = VIDEO_CRF, preset: str = VIDEO_PRESET):
+        self.width = width
+        self.height = height
+        self.sink = sink
+        self.frames_written = 0
+        self.bytes_out = 0
+        self._sink_error: Optional[BaseException] = None
+        self._stderr_tail: deque = deque(maxlen=20)
+
+        command = [
+            ffmpeg_binary(), "-hide_banner", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+            "-an",
+            # libx264 with yuv420p needs even dimensions
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            "-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p",
+            "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+            "-f", "mp4", "-",
+        ]
+        self._process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0
+        )
+        self._reader = threading.Thread(target=self._pump_output, name="ffmpeg-out", daemon=True)
+        self._stderr_reader = threading.Thread(target=self._pump_stderr, name="ffmpeg-err", daemon=True)
+        self._reader.start()
+        self._stderr_reader.start()
+
+    def write_frame(self, frame: Any):
+        """Write one frame (PIL image, uint8 HxWx3 array, or float array in [0, 1])."""
+        data = frame_to_rgb24(frame)
+        if len(data) != self.width * self.height * 3:
+            raise ValueError(f"Frame size mismatch: expected {self.width}x{self.height} RGB")
+        try:
+            self._process.stdin.write(data)
+        except BrokenPipeError:
+            self._raise_failure()
+        self.frames_written += 1
+
+    def close(self) -> int:
+        """Flush ffmpeg, wait for all output to reach the sink and return the encoded size."""
+        if self._process.stdin and not self._process.stdin.closed:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = self._process.wait()
+        self._reader.join()
+        self._stderr_reader.join()
+        if returncode != 0 or self._sink_error is not None:
+            self._raise_failure()
+        return self.bytes_out
+
+    def abort(self):
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._reader.join(timeout=5)
+
+    def __enter__(self) -> "FrameStreamEncoder":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def _pump_output(self):
+        stdout = self._process.stdout
+        while True:
+            chunk = stdout.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            self.bytes_out += len(chunk)
+            if self._sink_error is None:
+                try:
+                    self.sink.write(chunk)
+                except BaseException as e:
+                    # Keep draining so ffmpeg doesn't block; report on close()
+                    self._sink_error = e
+
+    def _pump_stderr(self):
+        for line in self._process.stderr:
+            self._stderr_tail.append(line.decode(errors="replace").rstrip())
+
+    def _raise_failure(self):
+        if self._sink_error is not None:
+            raise RuntimeError(f"Video sink failed: {self._sink_error}") from self._sink_error
+        self._process.wait()
+        self._stderr_reader.join(timeout=5)
+        detail = "; ".join(self._stderr_tail) or f"exit code {self._process.returncode}"
+        raise RuntimeError(f"ffmpeg failed: {detail}")
@@ -0,0 +1,183 @@
+"""
+Startup warmup for the GPU worker.
+
+PRELOAD_MODELS selects the models to load before traffic arrives:
+- "false" / empty: nothing, models load on first use
+- "true": the default plan (the depth model most requests need)
+- "depth_anything,wan_t2v": exactly these, in this order
+
+Warmup runs in the background while the app starts. Each model is loaded and,
+unless WARMUP_FORWARD=false, run once on a dummy input so CUDA kernel
+selection, cuDNN autotuning and lazy allocations happen before the first real
+request. /ready answers 503 until the plan has finished; /live only says the
+process is responsive.
+
+Time from process start to ready, and to the first real request served, is
+recorded so cold-start changes can be measured.
+"""
+
+import os
+import time
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("gpu-worker.warmup")
+
+PROCESS_STARTED = time.time()
+DEFAULT_PRELOAD_MODELS = ["depth_anything"]
+WARMUP_FORWARD = os.getenv("WARMUP_FORWARD", "true").lower() == "true"
+
+
+def parse_preload_models(value: Optional[str], known: Iterable[str]) -> List[str]:
+    """Turn a PRELOAD_MODELS value into an ordered, de-duplicated list of model names."""
+    value = (value or "").strip().lower()
+    if value in ("", "false", "0", "no", "none"):
+        return []
+    if value in ("true", "1", "yes"):
+        return list(DEFAULT_PRELOAD_MODELS)
+
+    known = set(known)
+    plan = []
+    for name in (part.strip() for part in value.split(",")):
+        if not name or name in plan:
+            continue
+        if name not in known:
+            logger.warning(f"Ignoring unknown model in PRELOAD_MODELS: {name}")
+            continue
+        plan.append(name)
+    return plan
+
+
+class Warmup:
+    """
+    Runs a warmup plan and tracks readiness.
+
+    `load(name)` loads a model into the cache; `forward(name)`, if given,
+    runs one dummy inference. Both are blocking and run on an executor.
+    A model that fails to warm is reported but doesn't block readiness:
+    requests can still load it lazily.
+    """
+
+    def __init__(self, models: List[str], load: Callable[[str], Any],
+                 forward: Optional[Callable[[str], Any]] = None):
+        self.models = models
+        self.load = load
+        self.forward = forward
+        self.status = "pending" if models else "ready"
+        self.current: Optional[str] = None
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.ready_at: Optional[float] = None if models else PROCESS_STARTED
+        self.first_request_at: Optional[float] = None
+        self.first_request_ms: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    async def run(self, executor):
+        """Warm every model in order on `executor`, then mark the worker ready."""
+        if not self.models:
+            return
+        self.status = "warming"
+        logger.info(f"Warming up models: {', '.join(self.models)}")
+        for name in self.models:
+            await executor.run(self._warm_one, name)
+        self._finish()
+
+    def run_blocking(self):
+        """Warm every model in the calling thread (for entry points without an event loop)."""
+        if not self.models:
+            return
+        self.status = "warming"
+        for name in self.models:
+            self._warm_one(name)
+        self._finish()
+
+    def _warm_one(self, name: str):
+        self.current = name
+        result: Dict[str, Any] = {}
+        try:
+            started = time.perf_counter()
+            self.load(name)
+            result["load_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            if self.forward is not None:
+                started = time.perf_counter()
+                self.forward(name)
+                result["forward_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            logger.info(f"Warmed {name}: {result}")
+        except Exception as e:
+            logger.error(f"Warmup failed for {name}: {e}")
+            result["error"] = str(e)
+        finally:
+            self.current = None
+            self.results[name] = result
+
+    def _finish(self):
+        self.status = "ready"
+        self.ready_at = time.time()
+        logger.info(f"Warmup complete in {self.ready_at - PROCESS_STARTED:.1f}s after process start")
+
+    def mark_first_request(self, started: float, finished: float):
+        """Record the first real request (not a probe) served by this process."""
+        if self.first_request_at is None:
+            self.first_request_at = started
+            self.first_request_ms = round((finished - started) * 1000, 1)
+            logger.info(
+                f"First request {started - PROCESS_STARTED:.1f}s after process start, "
+                f"took {self.first_request_ms}ms"
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "plan": self.models,
+            "current": self.current,
+            "models": self.results,
+            "failed": [name for name, result in self.results.items() if "error" in result],
+            "time_to_ready_ms": round((self.ready_at - PROCESS_STARTED) * 1000, 1) if self.ready_at else None,
+            "time_to_first_request_ms": (
+                round((self.first_request_at - PROCESS_STARTED) * 1000, 1) if self.first_request_at else None
+            ),
+            "first_request_ms": self.first_request_ms,
+        }
+
+
+class FirstRequestTimer:
+    """
+    ASGI middleware that records the first non-probe HTTP request on `warmup`.
+
+    Probes, metrics scrapes, model listings and artifact downloads don't
+    count: orchestrators poll them, and they never touch a model.
+
+    Pure ASGI rather than BaseHTTPMiddleware, so streaming and sendfile
+    responses pass through untouched; after the first request it is a
+    single attribute check.
+    """
+
+    def __init__(
+        self,
+        app,
+        warmup: Warmup,
+        skip_paths: Iterable[str] = ("/live", "/ready", "/health", "/metrics", "/models"),
+        skip_prefixes: Iterable[str] = ("/artifacts/",),
+    ):
+        self.app = app
+        self.warmup = warmup
+        self.skip_paths = set(skip_paths)
+        self.skip_prefixes = tuple(skip_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            self.warmup.first_request_at is not None
+            or scope["type"] != "http"
+            or scope["path"] in self.skip_paths
+            or scope["path"].startswith(self.skip_prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.time()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.warmup.mark_first_request(started, time.time())